@@ -0,0 +1,10 @@
+"""
+Performance benchmarks for the spreadsheet report pipeline.
+
+Each module is a standalone script run from the repository root, e.g.
+
+    python -m benchmarks.theme --rows 10000
+
+benchmarks.suite times every stage end to end on the sheet shapes in
+benchmarks.sheets and writes JSON that later runs can be compared with.
+"""
@@ -0,0 +1,88 @@
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def setup_django():
+    """Configure Django so benchmarks can import the app modules"""
+    if str(REPO_ROOT) not in sys.path:
+        sys.path.insert(0, str(REPO_ROOT))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'spreadsheet_project.settings')
+    import django
+    django.setup()
+
+
+def time_calls(func, items):
+    """Call func on every item and return the per-call durations in seconds"""
+    durations = []
+    for item in items:
+        start = time.perf_counter()
+        func(item)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def timed(func, *args):
+    """Call func(*args) once and return (seconds taken, its result)"""
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def generated_sheet_builders(formulas=False):
+    """
+    {name: build(rows) -> DataFrame} for the sheets of generate_test_spreadsheets.py
+    (after setup_django). The formulas sheet is only included when asked for.
+    """
+    import generate_test_spreadsheets as sheets
+
+    builders = {
+        'simple_data': sheets.build_simple_data,
+        'date_based_data': sheets.build_dates_data,
+        'formulas': sheets.build_formulas_data,
+        'missing_data': sheets.build_missing_data,
+    }
+    if not formulas:
+        del builders['formulas']
+    return builders
+
+
+def summarize(durations):
+    """Summary statistics (in milliseconds) for a list of durations in seconds"""
+    ordered = sorted(durations)
+    return {
+        'count': len(ordered),
+        'total_s': round(sum(ordered), 3),
+        'mean_ms': round(statistics.mean(ordered) * 1000, 3),
+        'median_ms': round(statistics.median(ordered) * 1000, 3),
+        'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+    }
+
+
+@contextmanager
+def django_test_environment():
+    """
+    Run views through the Django test client against a throwaway test
+    database and a temporary MEDIA_ROOT (with the metrics files of the runs),
+    like the test runner does.
+    """
+    from django.db import connection
+    from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    media_root = tempfile.mkdtemp()
+    try:
+        with override_settings(MEDIA_ROOT=media_root, REPORT_METRICS_DIR=os.path.join(media_root, 'metrics')):
+            yield
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
@@ -0,0 +1,49 @@
+"""
+Render time of single-row PDFs for rows with many fields or very long
+values. A row that cannot be laid out (a cell taller than a page) is
+reported as an error instead of a time.
+
+    python -m benchmarks.long_rows --repeat 3
+"""
+import argparse
+import json
+
+from .common import setup_django, summarize, time_calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=3, help='renders per case')
+    args = parser.parse_args()
+
+    setup_django()
+    from spreadsheet_processor.reports import get_report_theme, render_report_pdf
+
+    theme = get_report_theme()
+    cases = {
+        f'{count}_fields': ([f'Field {n}' for n in range(count)], [f'value {n}' for n in range(count)])
+        for count in (100, 500, 2000)
+    }
+    cases.update({
+        f'{size}_char_cell': (['Name', 'Notes'], ['A', 'word ' * (size // 5)])
+        for size in (1000, 5000, 100000)
+    })
+    cases['200_fields_of_2000_chars'] = ([f'F{n}' for n in range(200)], ['word ' * 400] * 200)
+
+    results = {}
+    for name, (fields, values) in cases.items():
+        sizes = []
+        try:
+            durations = time_calls(
+                lambda _: sizes.append(len(render_report_pdf(fields, values, theme))), range(args.repeat)
+            )
+        except Exception as e:
+            results[name] = {'error': type(e).__name__}
+            continue
+        results[name] = {**summarize(durations), 'bytes': sizes[0]}
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Time to turn the markdown reports of many rows into HTML: a new converter
+per document (how the markdown filter used to work) versus the per-thread
+converter, with a cold and a warm HTML cache, and the batch API.
+
+    python -m benchmarks.markdown_preview --rows 500
+"""
+import argparse
+import json
+
+from .common import setup_django, summarize, time_calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=500, help='reports to render')
+    parser.add_argument('--columns', type=int, default=8, help='fields per row')
+    args = parser.parse_args()
+
+    setup_django()
+    import markdown
+
+    from spreadsheet_processor.markdown_reports import (
+        MARKDOWN_EXTENSIONS, clear_markdown_cache, render_markdown, render_markdown_reports
+    )
+
+    rows = [
+        (row, {f'Field {column}': f'Value {row}-{column}' for column in range(args.columns)})
+        for row in range(1, args.rows + 1)
+    ]
+    documents = [
+        '\n'.join([f'# Report for Row {row}', '', '## Data Summary']
+                  + [f'- **{field}**: {value}' for field, value in data.items()])
+        for row, data in rows
+    ]
+
+    def per_document_converter(text):
+        markdown.markdown(text, extensions=MARKDOWN_EXTENSIONS)
+
+    def batch(items):
+        for _ in render_markdown_reports(items):
+            pass
+
+    results = {'rows': args.rows, 'columns': args.columns}
+    results['new_converter'] = summarize(time_calls(per_document_converter, documents))
+    clear_markdown_cache()
+    results['shared_converter_cold_cache'] = summarize(time_calls(render_markdown, documents))
+    results['shared_converter_warm_cache'] = summarize(time_calls(render_markdown, documents))
+    clear_markdown_cache()
+    results['batch_template_cold_cache'] = summarize(time_calls(batch, [rows]))
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
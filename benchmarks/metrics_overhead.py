@@ -0,0 +1,57 @@
+"""
+Overhead of the report pipeline metrics: the download view with
+REPORT_METRICS_ENABLED on and off, report cache disabled.
+
+    python -m benchmarks.metrics_overhead --rows 500
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from .common import django_test_environment, setup_django
+from .sheets import build_sheet, write_sheet
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=500, help='rows in the generated sheet')
+    parser.add_argument('--repeat', type=int, default=5, help='downloads per setting (best time is kept)')
+    args = parser.parse_args()
+
+    setup_django()
+    import logging
+    from django.core.files import File
+    from django.test import Client, override_settings
+    from django.urls import reverse
+    from spreadsheet_processor.models import Spreadsheet
+
+    # Only the cost of collecting the metrics is of interest, not console output
+    logging.getLogger('spreadsheet_processor.metrics').setLevel(logging.WARNING)
+
+    results = {}
+    with django_test_environment(), tempfile.TemporaryDirectory() as tmp_dir:
+        path = write_sheet(build_sheet('long', args.rows), os.path.join(tmp_dir, 'long.xlsx'))
+        with open(path, 'rb') as sheet_file:
+            spreadsheet = Spreadsheet.objects.create(file=File(sheet_file, 'long.xlsx'), processed=True)
+        download_url = reverse('download_spreadsheet_reports', args=[spreadsheet.id])
+        client = Client()
+
+        for enabled in (False, True, False, True):
+            with override_settings(REPORT_CACHE_ENABLED=False, REPORT_METRICS_ENABLED=enabled,
+                                   REPORT_METRICS_DIR=os.path.join(tmp_dir, 'metrics')):
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    client.post(download_url).getvalue()
+                    elapsed = time.perf_counter() - start
+                    key = 'enabled_s' if enabled else 'disabled_s'
+                    results[key] = min(results.get(key, elapsed), elapsed)
+
+    results = {key: round(value, 4) for key, value in results.items()}
+    results['overhead'] = round(results['enabled_s'] / results['disabled_s'] - 1, 4)
+    print(json.dumps({'rows': args.rows, **results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Download output size and build time: the ZIP of one PDF per row versus a
+single multi-page PDF of all rows, on the sheets from
+generate_test_spreadsheets.py.
+
+    python -m benchmarks.output_formats --rows 1000
+"""
+import argparse
+import io
+import json
+
+from .common import setup_django, generated_sheet_builders, timed
+
+
+def build_zip(rows):
+    from spreadsheet_processor.archive import write_zip
+    from spreadsheet_processor.pipeline import iter_report_entries
+
+    output = io.BytesIO()
+    write_zip(output, iter_report_entries(rows))
+    return output.tell()
+
+
+def build_pdf(rows):
+    from spreadsheet_processor.reports import render_combined_pdf
+
+    output = io.BytesIO()
+    render_combined_pdf(rows, output)
+    return output.tell()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000, help='rows per generated sheet')
+    args = parser.parse_args()
+
+    setup_django()
+    from spreadsheet_processor.preparation import prepare_rows
+
+    results = {}
+    for name, build in generated_sheet_builders().items():
+        rows = list(prepare_rows(build(args.rows)))
+        zip_s, zip_bytes = timed(build_zip, rows)
+        pdf_s, pdf_bytes = timed(build_pdf, rows)
+        results[name] = {
+            'rows': len(rows),
+            'zip_s': round(zip_s, 3),
+            'zip_bytes': zip_bytes,
+            'pdf_s': round(pdf_s, 3),
+            'pdf_bytes': pdf_bytes,
+            'time_ratio': round(zip_s / pdf_s, 2) if pdf_s else None,
+            'size_ratio': round(zip_bytes / pdf_bytes, 2) if pdf_bytes else None,
+        }
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Per-row and combined PDF render time with the title and table header laid
+out for every row (how reports used to be built) versus drawn from the
+theme's shared ReportTemplate.
+
+    python -m benchmarks.page_template --rows 1000
+"""
+import argparse
+import io
+import json
+
+from .common import setup_django, summarize, time_calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000, help='rows to render')
+    parser.add_argument('--columns', type=int, default=5, help='fields per row')
+    args = parser.parse_args()
+
+    setup_django()
+    from datetime import datetime
+
+    import pytz
+    from reportlab.platypus import PageBreak, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+    from spreadsheet_processor.preparation import PreparedRow
+    from spreadsheet_processor.reports import build_report_story, get_report_theme, render_combined_pdf
+
+    theme = get_report_theme()
+    generated_at = datetime.now(pytz.UTC).astimezone(theme.timezone)
+    fields = [f'Field {column}' for column in range(args.columns)]
+    rows = [
+        (row + 1, PreparedRow(fields, [f'Value {row}-{column}' for column in range(args.columns)]))
+        for row in range(args.rows)
+    ]
+
+    # The header row styled as part of each row's table, as before
+    header_commands = [
+        (command[0], command[1], (command[2][0], 0)) + tuple(command[3:])
+        for command in theme.header_style.getCommands()
+    ]
+    body_commands = [
+        (command[0], (command[1][0], 1), command[2]) + tuple(command[3:])
+        for command in theme.table_style.getCommands()
+    ]
+    full_table_style = TableStyle(header_commands + body_commands)
+
+    def per_row_story(row):
+        story = [Paragraph(theme.title, theme.styles['CustomTitle']), Spacer(1, 30)]
+        table = Table(
+            [theme.table_header] + [[f, Paragraph(v, theme.styles['CustomBodyText'])] for f, v in zip(*row)],
+            colWidths=theme.column_widths
+        )
+        table.setStyle(full_table_style)
+        story.extend([table, Spacer(1, 30), Paragraph('Generated on: now', theme.styles['CustomBodyText'])])
+        return story
+
+    def render_per_row_layout(row):
+        doc = SimpleDocTemplate(io.BytesIO(), pagesize=theme.pagesize, **theme.margins)
+        doc.build(per_row_story(row))
+
+    def render_with_template(row):
+        doc = theme.template.doc_template(io.BytesIO())
+        doc.build(build_report_story(*row, theme, generated_at))
+
+    def combined_per_row_layout(rows):
+        story = []
+        for _, row in rows:
+            if story:
+                story.append(PageBreak())
+            story.extend(per_row_story(row))
+        output = io.BytesIO()
+        SimpleDocTemplate(output, pagesize=theme.pagesize, **theme.margins).build(story)
+        return len(output.getvalue())
+
+    def combined_with_template(rows):
+        output = io.BytesIO()
+        render_combined_pdf(rows, output, bookmarks=False)
+        return len(output.getvalue())
+
+    row_data = [row for _, row in rows]
+    results = {'rows': args.rows, 'columns': args.columns}
+    # Interleave the variants so both see the same machine conditions
+    for name, func in (('per_row_layout', render_per_row_layout), ('template', render_with_template)) * 2:
+        results[f'row_pdf_{name}'] = summarize(time_calls(func, row_data))
+    for name, func in (('per_row_layout', combined_per_row_layout), ('template', combined_with_template)):
+        sizes = []
+        durations = time_calls(lambda items: sizes.append(func(items)), [rows])
+        results[f'combined_pdf_{name}'] = {**summarize(durations), 'bytes': sizes[0]}
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
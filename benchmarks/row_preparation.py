@@ -0,0 +1,47 @@
+"""
+Row preparation cost: the df.iterrows() + row.to_dict() + str(value) loop
+the download view used to run versus the column-wise prepare_rows stage, on
+the sheets from generate_test_spreadsheets.py scaled up.
+
+    python -m benchmarks.row_preparation --rows 100000
+"""
+import argparse
+import json
+
+from .common import setup_django, generated_sheet_builders, timed
+
+
+def iterrows_loop(df):
+    """The per-row conversion generate_pdf_report used to be fed with"""
+    return [
+        (index + 1, {field: str(value) for field, value in row.to_dict().items()})
+        for index, row in df.iterrows()
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000, help='rows per generated sheet')
+    args = parser.parse_args()
+
+    setup_django()
+    from spreadsheet_processor.preparation import prepare_rows
+
+    results = {}
+    for name, build in generated_sheet_builders(formulas=True).items():
+        df = build(args.rows)
+        iterrows_s, _ = timed(iterrows_loop, df)
+        prepared_s, _ = timed(lambda frame: list(prepare_rows(frame)), df)
+        results[name] = {
+            'rows': len(df),
+            'columns': df.shape[1],
+            'iterrows_s': round(iterrows_s, 3),
+            'prepare_rows_s': round(prepared_s, 3),
+            'speedup': round(iterrows_s / prepared_s, 1) if prepared_s else None,
+        }
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
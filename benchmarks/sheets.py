@@ -0,0 +1,87 @@
+"""
+Synthetic spreadsheets of configurable size and shape for the benchmarks.
+The data is generated from a fixed seed, so runs with the same arguments
+measure the same sheets.
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+WORDS = ['alpha', 'beta', 'gamma', 'delta', 'report', 'quarterly', 'revenue',
+         'north', 'south', 'pending', 'approved', 'customer', 'invoice']
+
+
+def _text(rng, rows, words):
+    return [' '.join(rng.choice(WORDS, words)) for _ in range(rows)]
+
+
+def build_long_sheet(rows, columns, rng):
+    """Few mixed-type columns: ids, names, prices, quantities, categories, flags"""
+    data = {
+        'ID': np.arange(1, rows + 1),
+        'Name': [f'Item {i}' for i in range(1, rows + 1)],
+        'Price': rng.uniform(10, 1000, rows).round(2),
+        'Quantity': rng.integers(1, 100, rows),
+        'Category': rng.choice(['A', 'B', 'C', 'D'], rows),
+        'In Stock': rng.choice([True, False], rows),
+    }
+    return pd.DataFrame(data)
+
+
+def build_wide_sheet(rows, columns, rng):
+    """Many columns alternating numbers and short text"""
+    data = {}
+    for column in range(columns):
+        if column % 2:
+            data[f'Text {column}'] = _text(rng, rows, 2)
+        else:
+            data[f'Value {column}'] = rng.uniform(0, 1000, rows).round(2)
+    return pd.DataFrame(data)
+
+
+def build_long_text_sheet(rows, columns, rng):
+    """A handful of columns holding paragraphs of text"""
+    data = {'ID': np.arange(1, rows + 1)}
+    for column in range(max(1, columns // 4)):
+        data[f'Notes {column}'] = _text(rng, rows, 120)
+    return pd.DataFrame(data)
+
+
+def build_sparse_sheet(rows, columns, rng):
+    """Mixed columns with roughly half of the cells missing"""
+    df = build_wide_sheet(rows, columns, rng).astype(object)
+    df[rng.random(df.shape) < 0.5] = None
+    df.insert(0, 'ID', np.arange(1, rows + 1))
+    return df
+
+
+def build_dates_sheet(rows, columns, rng):
+    """Date and datetime columns next to numbers"""
+    start = datetime(2024, 1, 1)
+    return pd.DataFrame({
+        'Date': [start + timedelta(days=int(day)) for day in rng.integers(0, 3650, rows)],
+        'Timestamp': [start + timedelta(seconds=int(second)) for second in rng.integers(0, 10**8, rows)],
+        'Sales': rng.integers(1000, 5000, rows),
+        'Revenue': rng.uniform(5000, 20000, rows).round(2),
+    })
+
+
+SHAPES = {
+    'long': build_long_sheet,
+    'wide': build_wide_sheet,
+    'long_text': build_long_text_sheet,
+    'sparse': build_sparse_sheet,
+    'dates': build_dates_sheet,
+}
+
+
+def build_sheet(shape, rows, columns=40, seed=0):
+    """Build the DataFrame of a sheet shape (see SHAPES)"""
+    return SHAPES[shape](rows, columns, np.random.default_rng(seed))
+
+
+def write_sheet(df, path):
+    """Write a DataFrame as an xlsx file the way users' uploads look"""
+    df.to_excel(path, index=False, engine='openpyxl')
+    return path
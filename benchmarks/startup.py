@@ -0,0 +1,138 @@
+"""
+Startup cost of an app process: the time to import the URL configuration
+(and with it the views), the time of the first request to each endpoint,
+and which heavy engines (pandas, ReportLab, ...) each endpoint loads. Every
+measurement runs in a fresh interpreter, like a newly booted worker. The
+`-X importtime` breakdown lists the packages that dominate the import.
+
+    python -m benchmarks.startup --repeat 3
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from .common import REPO_ROOT, django_test_environment, setup_django
+
+ENGINES = ['pandas', 'numpy', 'openpyxl', 'reportlab', 'markdown', 'pytz']
+
+# name: (method, URL pattern name, needs a stored spreadsheet)
+ENDPOINTS = {
+    'health': ('get', 'health_check', False),
+    'spreadsheet_list': ('get', 'spreadsheet_list', False),
+    'upload_form': ('get', 'upload_spreadsheet', False),
+    'metrics': ('get', 'metrics', False),
+    'job_status': ('get', 'report_job_status', False),
+    'download': ('get', 'download_spreadsheet_reports', True),
+}
+
+
+def measure_endpoint(name, xlsx_path):
+    """Run in a fresh interpreter: time the URLconf import and one request to an endpoint"""
+    start = time.perf_counter()
+    setup_django()
+    setup_s = time.perf_counter() - start
+
+    with django_test_environment():
+        from django.core.files import File
+        from django.test import Client, override_settings
+        from django.urls import reverse
+
+        start = time.perf_counter()
+        import spreadsheet_project.urls  # noqa: F401
+        import_s = time.perf_counter() - start
+
+        method, url_name, needs_spreadsheet = ENDPOINTS[name]
+        args = []
+        if needs_spreadsheet:
+            from spreadsheet_processor.models import Spreadsheet
+            with open(xlsx_path, 'rb') as xlsx_file:
+                spreadsheet = Spreadsheet.objects.create(file=File(xlsx_file, name='startup.xlsx'))
+            args = [spreadsheet.id]
+        elif url_name == 'report_job_status':
+            args = [1]
+        loaded_before = [engine for engine in ENGINES if engine in sys.modules]
+
+        with override_settings(REPORT_CACHE_ENABLED=False):
+            start = time.perf_counter()
+            response = getattr(Client(), method)(reverse(url_name, args=args))
+            request_s = time.perf_counter() - start
+
+    return {
+        'setup_s': round(setup_s, 4),
+        'urls_import_s': round(import_s, 4),
+        'first_request_s': round(request_s, 4),
+        'status': response.status_code,
+        'engines_at_boot': loaded_before,
+        'engines_after_request': [engine for engine in ENGINES if engine in sys.modules],
+    }
+
+
+def run_child(name, xlsx_path):
+    output = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.startup', '--child', name, '--xlsx', xlsx_path],
+        cwd=REPO_ROOT, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def import_time_breakdown(top=10):
+    """Import time (ms) per top-level package, slowest first, of booting Django and loading the URLconf"""
+    code = (
+        "import os; os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'spreadsheet_project.settings'); "
+        "import django; django.setup(); import spreadsheet_project.urls"
+    )
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code], cwd=REPO_ROOT, capture_output=True, text=True
+    ).stderr
+    packages = {}
+    for line in stderr.splitlines():
+        # "import time: <self us> | <cumulative us> | <indented module name>"
+        fields = line[len('import time:'):].split('|')
+        if not line.startswith('import time:') or len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        package = fields[2].strip().split('.')[0]
+        packages[package] = packages.get(package, 0) + int(fields[0])
+    slowest = sorted(packages.items(), key=lambda item: -item[1])[:top]
+    return {package: round(us / 1000, 1) for package, us in slowest}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=3, help='fresh processes per endpoint')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--xlsx', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure_endpoint(args.child, args.xlsx)))
+        return
+
+    from .sheets import write_sheet
+    import pandas as pd
+
+    with tempfile.TemporaryDirectory() as directory:
+        xlsx_path = write_sheet(
+            pd.DataFrame({'Name': [f'Person {n}' for n in range(20)], 'Age': range(20)}),
+            os.path.join(directory, 'startup.xlsx')
+        )
+        results = {'import_time_ms': import_time_breakdown()}
+        for name in ENDPOINTS:
+            runs = [run_child(name, xlsx_path) for _ in range(args.repeat)]
+            results[name] = {
+                key: round(statistics.median(run[key] for run in runs), 4)
+                for key in ('setup_s', 'urls_import_s', 'first_request_s')
+            }
+            results[name].update({
+                key: runs[0][key] for key in ('status', 'engines_at_boot', 'engines_after_request')
+            })
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""
+End-to-end benchmark suite: times every stage of the report pipeline on
+synthetic sheets of configurable size and shape and writes the results as
+JSON, optionally comparing them against an earlier run.
+
+Stages, per sheet shape:
+    upload          the upload view through the Django test client
+    read_excel      pd.read_excel of the xlsx file
+    prepare         column-wise formatting of all rows (prepare_rows)
+    render_row      generate_pdf_report for a sample of rows
+    zip             ZIP assembly of the sampled row PDFs
+    download        the download view, report cache disabled
+    download_cached the download view when the archive is already cached
+
+    python -m benchmarks.suite --rows 1000 --output results.json
+    python -m benchmarks.suite --rows 1000 --compare results.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+from .common import REPO_ROOT, django_test_environment, setup_django, summarize, time_calls, timed
+from .sheets import SHAPES, build_sheet, write_sheet
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    import django
+    import openpyxl
+    import pandas
+    import reportlab
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'django': django.__version__,
+        'pandas': pandas.__version__,
+        'openpyxl': openpyxl.__version__,
+        'reportlab': reportlab.Version,
+    }
+
+
+def run_shape(shape, args, tmp_dir):
+    """Time every stage for one sheet shape"""
+    import pandas as pd
+    from django.test import Client, override_settings
+    from django.urls import reverse
+    from spreadsheet_processor.archive import write_zip
+    from spreadsheet_processor.models import Spreadsheet
+    from spreadsheet_processor.preparation import prepare_rows
+    from spreadsheet_processor.reports import generate_pdf_report
+
+    df = build_sheet(shape, args.rows, args.columns, args.seed)
+    path = write_sheet(df, os.path.join(tmp_dir, f'{shape}.xlsx'))
+    results = {
+        'rows': df.shape[0],
+        'columns': df.shape[1],
+        'file_bytes': os.path.getsize(path),
+    }
+    client = Client()
+
+    with open(path, 'rb') as upload_file:
+        seconds, response = timed(client.post, reverse('upload_spreadsheet'), {'spreadsheet': upload_file})
+    spreadsheet = Spreadsheet.objects.latest('id')
+    results['upload'] = {'seconds': round(seconds, 4), 'status': response.status_code}
+
+    seconds, df = timed(pd.read_excel, path)
+    results['read_excel'] = {'seconds': round(seconds, 4)}
+
+    seconds, _ = timed(lambda frame: list(prepare_rows(frame)), df)
+    results['prepare'] = {'seconds': round(seconds, 4)}
+
+    sample = [row.to_dict() for _, row in df.head(args.render_sample).iterrows()]
+    pdfs = []
+    durations = time_calls(lambda row: pdfs.append(generate_pdf_report(row, len(pdfs) + 1)), sample)
+    results['render_row'] = summarize(durations)
+    results['render_row']['seconds'] = results['render_row']['total_s']
+    results['render_row']['pdf_bytes'] = sum(len(pdf) for pdf in pdfs)
+
+    entries = [(f'row_{index}.pdf', pdf) for index, pdf in enumerate(pdfs, 1)]
+    output = io.BytesIO()
+    seconds, _ = timed(write_zip, output, entries)
+    results['zip'] = {'seconds': round(seconds, 4), 'zip_bytes': output.tell()}
+
+    if args.skip_download:
+        return results
+    download_url = reverse('download_spreadsheet_reports', args=[spreadsheet.id])
+    with override_settings(REPORT_CACHE_ENABLED=False):
+        seconds, response = timed(lambda: client.post(download_url).getvalue())
+    results['download'] = {'seconds': round(seconds, 4), 'zip_bytes': len(response)}
+
+    client.post(download_url).getvalue()
+    seconds, response = timed(lambda: client.post(download_url).getvalue())
+    results['download_cached'] = {'seconds': round(seconds, 4)}
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print per-stage time ratios against a baseline run; return the regressions"""
+    regressions = []
+    for shape, stages in results.items():
+        for stage, values in stages.items():
+            old = baseline.get(shape, {}).get(stage)
+            if not isinstance(values, dict) or not isinstance(old, dict) or not old.get('seconds'):
+                continue
+            ratio = values['seconds'] / old['seconds']
+            flag = ''
+            if ratio > 1 + threshold:
+                flag = '  REGRESSION'
+                regressions.append(f'{shape}.{stage}')
+            print(f"{shape:>10} {stage:<16} {old['seconds']:>9.4f}s -> {values['seconds']:>9.4f}s  x{ratio:.2f}{flag}",
+                  file=sys.stderr)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000, help='rows per generated sheet')
+    parser.add_argument('--columns', type=int, default=40, help='columns of the wide and sparse sheets')
+    parser.add_argument('--shapes', nargs='+', choices=sorted(SHAPES), default=list(SHAPES))
+    parser.add_argument('--render-sample', type=int, default=200, help='rows rendered for the render_row and zip stages')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip-download', action='store_true', help='skip the full download view stages')
+    parser.add_argument('--output', help='write the JSON results to this file instead of stdout')
+    parser.add_argument('--compare', help='earlier JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='slowdown (fraction) reported as a regression by --compare')
+    args = parser.parse_args()
+
+    setup_django()
+    report = {'environment': environment(), 'arguments': vars(args), 'results': {}}
+    with django_test_environment(), tempfile.TemporaryDirectory() as tmp_dir:
+        for shape in args.shapes:
+            report['results'][shape] = run_shape(shape, args, tmp_dir)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if compare(report['results'], baseline['results'], args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Upload handling: time, peak Python heap and bytes written outside storage
+for one upload of a generated long sheet through the upload view, with
+Django's default upload handlers alone, with hashing in front of them, and
+with SpreadsheetUploadHandler writing straight to storage as the view does.
+
+    python -m benchmarks.upload --rows 200000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from django.core.files.uploadhandler import FileUploadHandler
+
+from .common import django_test_environment, setup_django
+
+# The handler the upload view puts in front of Django's default handlers
+HANDLERS = {
+    'default': None,
+    'hashing': 'spreadsheet_processor.uploads.ContentHashUploadHandler',
+    'streamed': 'spreadsheet_processor.uploads.SpreadsheetUploadHandler',
+}
+
+
+class PassThroughUploadHandler(FileUploadHandler):
+    """Stands in for the view's handler, leaving the upload to the default handlers"""
+    def receive_data_chunk(self, raw_data, start):
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+
+def measure_upload(body, content_type):
+    """Post a prepared multipart body and return its time, peak heap and temporary bytes"""
+    from django.test import Client
+    from django.urls import reverse
+
+    from spreadsheet_processor.models import Spreadsheet
+
+    Spreadsheet.objects.all().delete()
+    written = []
+    # Temporary uploads are deleted when the request is closed: record their size before that
+    from django.core.files.uploadhandler import TemporaryFileUploadHandler
+    file_complete = TemporaryFileUploadHandler.file_complete
+
+    def record_temporary(handler, file_size):
+        written.append(file_size)
+        return file_complete(handler, file_size)
+
+    TemporaryFileUploadHandler.file_complete = record_temporary
+    try:
+        tracemalloc.start()
+        start = time.perf_counter()
+        response = Client().post(reverse('upload_spreadsheet'), data=body, content_type=content_type)
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        TemporaryFileUploadHandler.file_complete = file_complete
+    return {
+        'seconds': round(seconds, 4),
+        'status': response.status_code,
+        # Less the copy of the body the test client keeps to read the request from
+        'peak_heap_mb': round((peak - len(body)) / (1024 * 1024), 2),
+        'temporary_file_mb': round(sum(written) / (1024 * 1024), 2),
+        'stored': Spreadsheet.objects.filter(processed=True).count(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200000, help='rows of the uploaded sheet')
+    parser.add_argument('--repeat', type=int, default=3, help='uploads per configuration (best time is kept)')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.test.client import BOUNDARY, encode_multipart
+    from django.test.utils import override_settings
+    from django.utils.module_loading import import_string
+    from unittest import mock
+
+    from .sheets import build_sheet, write_sheet
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = write_sheet(build_sheet('long', args.rows, columns=10), os.path.join(directory, 'upload.xlsx'))
+        with open(path, 'rb') as upload_file:
+            body = encode_multipart(BOUNDARY, {'spreadsheet': upload_file})
+        # Not the client's MULTIPART_CONTENT, which would make it encode the body again
+        content_type = f'multipart/form-data;boundary={BOUNDARY}'
+        results = {'upload_mb': round(os.path.getsize(path) / (1024 * 1024), 2)}
+
+        with django_test_environment():
+            for name, handler in HANDLERS.items():
+                handler_class = import_string(handler) if handler else PassThroughUploadHandler
+                with override_settings(FILE_UPLOAD_TEMP_DIR=directory), \
+                        mock.patch('spreadsheet_processor.views.SpreadsheetUploadHandler', handler_class):
+                    runs = [measure_upload(body, content_type) for _ in range(args.repeat)]
+                results[name] = min(runs, key=lambda run: run['seconds'])
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
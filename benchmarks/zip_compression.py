@@ -0,0 +1,62 @@
+"""
+ZIP compression modes for report archives: build time, throughput and
+archive size for stored, deflate at several levels and adaptive, on row
+PDFs rendered from the sheets in generate_test_spreadsheets.py.
+
+    python -m benchmarks.zip_compression --rows 500
+"""
+import argparse
+import io
+import json
+import time
+
+from .common import setup_django, generated_sheet_builders
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=500, help='rows per generated sheet')
+    parser.add_argument('--repeat', type=int, default=3, help='archives built per mode (best time is kept)')
+    args = parser.parse_args()
+
+    setup_django()
+    from spreadsheet_processor.archive import ZipCompression, write_zip
+    from spreadsheet_processor.pipeline import iter_report_entries
+    from spreadsheet_processor.preparation import prepare_rows
+
+    modes = {
+        'stored': dict(mode='stored'),
+        'deflate_1': dict(mode='deflate', level=1),
+        'deflate_default': dict(mode='deflate'),
+        'deflate_9': dict(mode='deflate', level=9),
+        'adaptive': dict(mode='adaptive'),
+    }
+
+    # Render the PDFs once; only the archive step is measured
+    entries = []
+    for sheet, build in generated_sheet_builders().items():
+        for name, data in iter_report_entries(prepare_rows(build(args.rows))):
+            entries.append((f'{sheet}/{name}', data))
+    pdf_bytes = sum(len(data) for _, data in entries)
+
+    results = {'entries': len(entries), 'pdf_bytes': pdf_bytes}
+    for name, options in modes.items():
+        best = None
+        for _ in range(args.repeat):
+            output = io.BytesIO()
+            start = time.perf_counter()
+            write_zip(output, entries, ZipCompression(**options))
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = {
+            'seconds': round(best, 4),
+            'mb_per_s': round(pdf_bytes / best / 1e6, 1),
+            'zip_bytes': output.tell(),
+            'ratio': round(output.tell() / pdf_bytes, 3),
+        }
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
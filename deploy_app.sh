@@ -70,6 +70,10 @@ server {
     auth_basic \"Restricted Access\";
     auth_basic_user_file /etc/nginx/.htpasswd;
 
+    # Refuse bodies beyond SPREADSHEET_UPLOAD_MAX_BYTES (plus the other form
+    # fields) before they reach the app
+    client_max_body_size 101m;
+
     location / {
         proxy_pass http://127.0.0.1:8000;
         proxy_set_header Host \$host;
@@ -85,6 +89,12 @@ server {
     location /media/ {
         alias /home/ubuntu/spreadsheet_project/media/;
     }
+
+    # Cached report archives, sent by nginx when the app answers with X-Accel-Redirect
+    location /_report_cache/ {
+        internal;
+        alias /home/ubuntu/spreadsheet_project/media/report_cache/;
+    }
 }
 EOF"
 
@@ -210,6 +220,12 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Media files configuration
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+
+# Let nginx send cached report archives (see the /_report_cache/ location)
+REPORT_CACHE_ACCEL_REDIRECT = '/_report_cache/'
+
+# Largest spreadsheet upload accepted; keep client_max_body_size in line
+SPREADSHEET_UPLOAD_MAX_BYTES = 100 * 1024 * 1024
 EOF"
 
 # Create systemd service file
@@ -231,12 +247,31 @@ ExecStart=/home/ubuntu/spreadsheet_project/venv/bin/gunicorn --workers 3 --bind
 WantedBy=multi-user.target
 EOF"
 
+# Create systemd service for the background report worker
+run_remote "sudo tee /etc/systemd/system/spreadsheet_report_worker.service << 'EOF'
+[Unit]
+Description=Spreadsheet Project Report Worker
+After=network.target
+
+[Service]
+User=ubuntu
+Group=ubuntu
+WorkingDirectory=/home/ubuntu/spreadsheet_project
+Environment=\"PATH=/home/ubuntu/spreadsheet_project/venv/bin:/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin\"
+Environment=\"PYTHONPATH=/home/ubuntu/spreadsheet_project\"
+ExecStart=/home/ubuntu/spreadsheet_project/venv/bin/python manage.py run_report_worker
+Restart=always
+
+[Install]
+WantedBy=multi-user.target
+EOF"
+
 # Run database migrations
 echo "Running database migrations..."
 run_remote "cd ~/spreadsheet_project && source venv/bin/activate && python manage.py migrate"
 
 # Reload systemd and start the service
-run_remote "sudo systemctl daemon-reload && sudo systemctl enable spreadsheet_project && sudo systemctl restart spreadsheet_project"
+run_remote "sudo systemctl daemon-reload && sudo systemctl enable spreadsheet_project spreadsheet_report_worker && sudo systemctl restart spreadsheet_project spreadsheet_report_worker"
 
 # Restart Nginx
 run_remote "sudo systemctl restart nginx"
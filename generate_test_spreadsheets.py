@@ -3,8 +3,8 @@ import numpy as np
 from datetime import datetime, timedelta
 import os
 
-def generate_simple_spreadsheet(filename, rows=100):
-    """Generate a simple spreadsheet with basic data types."""
+def build_simple_data(rows=100):
+    """Build a DataFrame with basic data types."""
     data = {
         'ID': range(1, rows + 1),
         'Name': [f'Item {i}' for i in range(1, rows + 1)],
@@ -13,12 +13,16 @@ def generate_simple_spreadsheet(filename, rows=100):
         'Category': np.random.choice(['A', 'B', 'C', 'D'], rows),
         'In Stock': np.random.choice([True, False], rows)
     }
-    df = pd.DataFrame(data)
+    return pd.DataFrame(data)
+
+def generate_simple_spreadsheet(filename, rows=100):
+    """Generate a simple spreadsheet with basic data types."""
+    df = build_simple_data(rows)
     df.to_excel(filename, index=False)
     print(f"Generated {filename}")
 
-def generate_dates_spreadsheet(filename, rows=100):
-    """Generate a spreadsheet with date-based data."""
+def build_dates_data(rows=100):
+    """Build a DataFrame with date-based data."""
     start_date = datetime.now()
     dates = [start_date + timedelta(days=i) for i in range(rows)]
     
@@ -28,12 +32,16 @@ def generate_dates_spreadsheet(filename, rows=100):
         'Customers': np.random.randint(50, 200, rows),
         'Revenue': np.random.uniform(5000, 20000, rows).round(2)
     }
-    df = pd.DataFrame(data)
+    return pd.DataFrame(data)
+
+def generate_dates_spreadsheet(filename, rows=100):
+    """Generate a spreadsheet with date-based data."""
+    df = build_dates_data(rows)
     df.to_excel(filename, index=False)
     print(f"Generated {filename}")
 
-def generate_formulas_spreadsheet(filename, rows=10):
-    """Generate a spreadsheet with formulas and calculations."""
+def build_formulas_data(rows=10):
+    """Build a DataFrame with calculated columns."""
     data = {
         'Item': [f'Product {i}' for i in range(1, rows + 1)],
         'Unit Price': np.random.uniform(10, 100, rows).round(2),
@@ -46,12 +54,16 @@ def generate_formulas_spreadsheet(filename, rows=10):
     df['Subtotal'] = df['Unit Price'] * df['Quantity']
     df['Discount Amount'] = df['Subtotal'] * (df['Discount %'] / 100)
     df['Total'] = df['Subtotal'] - df['Discount Amount']
-    
+    return df
+
+def generate_formulas_spreadsheet(filename, rows=10):
+    """Generate a spreadsheet with formulas and calculations."""
+    df = build_formulas_data(rows)
     df.to_excel(filename, index=False)
     print(f"Generated {filename}")
 
-def generate_missing_data_spreadsheet(filename, rows=100):
-    """Generate a spreadsheet with missing data patterns."""
+def build_missing_data(rows=100):
+    """Build a DataFrame with missing data patterns."""
     data = {
         'ID': range(1, rows + 1),
         'Name': [f'Item {i}' for i in range(1, rows + 1)],
@@ -67,7 +79,11 @@ def generate_missing_data_spreadsheet(filename, rows=100):
         if col != 'ID':  # Keep ID column complete
             mask = np.random.random(rows) < 0.1
             df.loc[mask, col] = None
-    
+    return df
+
+def generate_missing_data_spreadsheet(filename, rows=100):
+    """Generate a spreadsheet with missing data patterns."""
+    df = build_missing_data(rows)
     df.to_excel(filename, index=False)
     print(f"Generated {filename}")
 
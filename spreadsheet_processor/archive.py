@@ -0,0 +1,121 @@
+import zipfile
+
+from django.conf import settings
+
+ZIP_COMPRESSION_MODES = ('stored', 'deflate', 'adaptive')
+
+
+class ZipCompression:
+    """
+    Chooses how each entry of a ZIP archive is compressed:
+
+        stored    entries are stored as-is
+        deflate   entries are deflated at `level` (None uses the zlib default)
+        adaptive  the first `sample_size` entries are deflated; if together
+                  they shrank by less than `min_saving`, the remaining
+                  entries are stored
+
+    ReportLab already compresses page streams, so deflating the row PDFs
+    again often costs more CPU than it saves bytes. An instance keeps the
+    adaptive sample, so use a new one for every archive.
+    """
+    def __init__(self, mode='deflate', level=None, sample_size=10, min_saving=0.05):
+        if mode not in ZIP_COMPRESSION_MODES:
+            raise ValueError(f"Unknown ZIP compression mode: {mode}")
+        self.mode = mode
+        self.level = level
+        self.sample_size = sample_size
+        self.min_saving = min_saving
+        self.sampled = 0
+        self.sampled_bytes = 0
+        self.sampled_compressed_bytes = 0
+
+    @property
+    def saving(self):
+        """Fraction of the sampled bytes saved by deflating them"""
+        if not self.sampled_bytes:
+            return 0.0
+        return 1 - self.sampled_compressed_bytes / self.sampled_bytes
+
+    def compress_type(self):
+        """Compression for the next entry"""
+        if self.mode == 'stored':
+            return zipfile.ZIP_STORED
+        if self.mode == 'adaptive' and self.sampled >= self.sample_size and self.saving < self.min_saving:
+            return zipfile.ZIP_STORED
+        return zipfile.ZIP_DEFLATED
+
+    def record(self, info):
+        """Add a written entry to the adaptive sample"""
+        if self.mode != 'adaptive' or self.sampled >= self.sample_size:
+            return
+        self.sampled += 1
+        self.sampled_bytes += info.file_size
+        self.sampled_compressed_bytes += info.compress_size
+
+
+def get_zip_compression():
+    """Return a ZipCompression for one archive, as configured in the settings"""
+    return ZipCompression(
+        getattr(settings, 'REPORT_ZIP_COMPRESSION', 'deflate'),
+        getattr(settings, 'REPORT_ZIP_COMPRESSLEVEL', None),
+        getattr(settings, 'REPORT_ZIP_ADAPTIVE_SAMPLE', 10),
+        getattr(settings, 'REPORT_ZIP_ADAPTIVE_MIN_SAVING', 0.05)
+    )
+
+
+class ZipStreamBuffer:
+    """
+    Write-only sink for zipfile.ZipFile. It has no tell()/seek(), so ZipFile
+    writes data descriptors instead of seeking back, and every entry can be
+    drained and sent as soon as it has been written.
+    """
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        """Return and forget everything written since the last drain"""
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def write_entry(zip_file, name, data, compression):
+    """Write one entry with the compression chosen for it"""
+    zip_file.writestr(
+        name,
+        data,
+        compress_type=compression.compress_type(),
+        compresslevel=compression.level
+    )
+    compression.record(zip_file.filelist[-1])
+
+
+def write_zip(fileobj, entries, compression=None):
+    """Write (name, data) entries into a ZIP archive in fileobj"""
+    compression = compression or get_zip_compression()
+    with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for name, data in entries:
+            write_entry(zip_file, name, data, compression)
+
+
+def iter_zip_stream(entries, compression=None):
+    """
+    Yield the bytes of a ZIP archive built from (name, data) entries. Each
+    local file entry is yielded as soon as it is written and the central
+    directory is yielded last, so only one entry is held in memory at a time.
+    """
+    compression = compression or get_zip_compression()
+    buffer = ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for name, data in entries:
+            write_entry(zip_file, name, data, compression)
+            yield buffer.drain()
+    yield buffer.drain()
@@ -0,0 +1,174 @@
+from collections import deque, namedtuple
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from django.conf import settings
+
+from .archive import write_zip
+from .pipeline import iter_sheet_rows, pick_sheets, select_sheets, sheet_folder, workbook_sheets
+from .preparation import prepare_rows
+from .readers import iter_xlsx_frames
+from .rendering import get_render_workers, render_pool, render_rows, write_atomic
+
+logger = logging.getLogger(__name__)
+
+# A workbook to report on: the name its output is written under, the sheets
+# to report, and a function of the render pool that returns an iterator of
+# (sheet, rows) pairs like pipeline.iter_sheet_rows
+BatchSource = namedtuple('BatchSource', ['name', 'sheets', 'sheet_rows'])
+
+# Output formats: a directory of row PDFs per workbook, or a ZIP per workbook
+BATCH_FORMATS = ('tree', 'zip')
+
+def spreadsheet_source(spreadsheet, sheet_names=None):
+    """A BatchSource for an uploaded Spreadsheet, read like downloads read it"""
+    sheets = select_sheets(spreadsheet, sheet_names)
+    return BatchSource(
+        f'spreadsheet_{spreadsheet.id}',
+        sheets,
+        lambda executor: iter_sheet_rows(spreadsheet, sheets, executor=executor)
+    )
+
+def iter_xlsx_path_rows(path, sheet, block_size):
+    """Lazily yield (row_number, PreparedRow) pairs for a sheet of an xlsx file on disk"""
+    with open(path, 'rb') as xlsx_file:
+        row_number = 1
+        for frame in iter_xlsx_frames(xlsx_file, sheet_name=sheet.name, block_size=block_size):
+            yield from prepare_rows(frame, first_row_number=row_number, block_size=block_size)
+            row_number += len(frame)
+
+def xlsx_source(path, name, sheet_names=None):
+    """A BatchSource for an xlsx file on disk, read with the streaming reader"""
+    with open(path, 'rb') as xlsx_file:
+        sheets = pick_sheets(workbook_sheets(xlsx_file), sheet_names)
+    block_size = getattr(settings, 'SPREADSHEET_READER_BLOCK_SIZE', 1000)
+    return BatchSource(
+        name,
+        sheets,
+        lambda executor: ((sheet, iter_xlsx_path_rows(path, sheet, block_size)) for sheet in sheets)
+    )
+
+class BatchSummary:
+    """Counts and throughput of a generate_reports run"""
+    def __init__(self):
+        self.sources = 0
+        self.skipped_sources = 0
+        self.sheets = 0
+        self.rendered_rows = 0
+        self.skipped_rows = 0
+        self.failed_rows = 0
+        self.bytes_written = 0
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rendered_rows / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (
+            f'{self.sources} workbooks ({self.skipped_sources} already done), {self.sheets} sheets: '
+            f'{self.rendered_rows} rows rendered, {self.skipped_rows} already written, '
+            f'{self.failed_rows} failed in {self.seconds:.1f}s '
+            f'({self.rows_per_second:.1f} rows/s, {self.bytes_written / (1024 * 1024):.1f} MB of PDFs written)'
+        )
+
+def generate_reports(sources, output_dir, report_format='tree', workers=None, row_cache_dir=None, log=None):
+    """
+    Render the reports of BatchSources into output_dir and return a
+    BatchSummary. The 'tree' format writes <name>/[<sheet>/]row_<n>.pdf, the
+    'zip' format writes <name>.zip with the entries a download has.
+
+    All rows of all workbooks go through one render pool, so workers stay
+    busy across sheet and workbook boundaries. Every PDF is written
+    atomically and rows whose PDF already exists are not rendered again, so
+    an interrupted run picks up where it stopped. ZIPs are assembled from
+    row PDFs kept in <output_dir>/.partial/<name> until the ZIP is complete.
+    """
+    if report_format not in BATCH_FORMATS:
+        raise ValueError(f"Unknown output format: {report_format}")
+    log = log or logger.info
+    workers = workers or get_render_workers()
+    summary = BatchSummary()
+    partial_dir = os.path.join(output_dir, '.partial')
+    # Entry names of each ZIP, in order, and the output path of every row sent
+    # to the pool; results come back in the order rows were sent
+    zip_entries = {}
+    destinations = deque()
+
+    def iter_tasks(executor):
+        for source in sources:
+            summary.sources += 1
+            if report_format == 'zip':
+                if os.path.exists(os.path.join(output_dir, f'{source.name}.zip')):
+                    summary.skipped_sources += 1
+                    continue
+                root = os.path.join(partial_dir, source.name)
+                entries = zip_entries[source.name] = []
+            else:
+                root = os.path.join(output_dir, source.name)
+                entries = []
+            log(f'Rendering {source.name} ({len(source.sheets)} sheets)')
+
+            folders = len(source.sheets) > 1
+            used = set()
+            for sheet, rows in source.sheet_rows(executor):
+                summary.sheets += 1
+                prefix = f'{sheet_folder(sheet.name, used)}/' if folders else ''
+                for row_number, row_data in rows:
+                    entry = f'{prefix}row_{row_number}.pdf'
+                    path = os.path.join(root, entry)
+                    entries.append((entry, path))
+                    if os.path.exists(path):
+                        summary.skipped_rows += 1
+                        continue
+                    destinations.append(path)
+                    yield row_number, row_data
+
+    with render_pool(workers) as executor:
+        for result in render_rows(iter_tasks(executor), workers, cache_dir=row_cache_dir, executor=executor):
+            path = destinations.popleft()
+            if result.error is not None:
+                logger.error(f"Error creating PDF {path}: {result.error}")
+                summary.failed_rows += 1
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_atomic(path, result.pdf_data)
+            summary.rendered_rows += 1
+            summary.bytes_written += len(result.pdf_data)
+
+    for name, entries in zip_entries.items():
+        write_batch_zip(os.path.join(output_dir, f'{name}.zip'), entries)
+        shutil.rmtree(os.path.join(partial_dir, name), ignore_errors=True)
+        try:
+            # Remove the directories left empty, .partial included
+            os.removedirs(os.path.dirname(os.path.join(partial_dir, name)))
+        except OSError:
+            pass
+
+    summary.seconds = time.perf_counter() - summary.started
+    return summary
+
+def write_batch_zip(zip_path, entries):
+    """Atomically write a ZIP of the (entry name, PDF path) entries whose PDF exists"""
+    def read_entries():
+        for entry, path in entries:
+            try:
+                with open(path, 'rb') as pdf_file:
+                    yield entry, pdf_file.read()
+            except FileNotFoundError:
+                # The row failed to render
+                continue
+
+    os.makedirs(os.path.dirname(zip_path), exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(zip_path), suffix='.tmp', delete=False) as tmp:
+        try:
+            write_zip(tmp, read_entries())
+        except BaseException:
+            tmp.close()
+            os.unlink(tmp.name)
+            raise
+    os.replace(tmp.name, zip_path)
@@ -0,0 +1,219 @@
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Running size of each cache root as seen by this process: root -> [bytes, monotonic
+# time of the last walk]. Other processes' stores are picked up by the next walk.
+_usage = {}
+
+def file_content_hash(field_file):
+    """SHA-256 hex digest of the contents of a stored FieldFile"""
+    digest = hashlib.sha256()
+    with field_file.storage.open(field_file.name, 'rb') as stored_file:
+        for chunk in stored_file.chunks():
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def archive_cache_key(spreadsheet):
+    """Cache key for the report archive of a spreadsheet: file contents + theme version"""
+    from .reports import ReportTheme
+
+    content_hash = spreadsheet.content_hash or file_content_hash(spreadsheet.file)
+    return hashlib.sha256(f'{content_hash}:{ReportTheme.version}'.encode()).hexdigest()
+
+def selection_cache_key(key, selection):
+    """Cache key for the archive of part of a spreadsheet (see selection.RowSelection)"""
+    if selection is None:
+        return key
+    return hashlib.sha256(f'{key}:{selection.cache_key()}'.encode()).hexdigest()
+
+def sheets_cache_key(key, sheets):
+    """
+    Cache key for the reports of some sheets of a workbook. The first sheet
+    alone keeps the workbook's key, so single-sheet archives are cached as
+    before.
+    """
+    if [sheet.index for sheet in sheets] == [0]:
+        return key
+    names = '\x00'.join(f'{sheet.index}:{sheet.name}' for sheet in sheets)
+    return hashlib.sha256(f'{key}:sheets:{names}'.encode()).hexdigest()
+
+class ReportCache:
+    """
+    Content-addressed on-disk cache of report archives and row PDFs.
+
+    Layout under `root`:
+        archives/<key>.<ext>     finished report archives (ZIP or combined PDF)
+        rows/<hh>/<hash>.pdf     row PDFs by row content hash (see
+                                 rendering.row_content_hash), shared by every
+                                 spreadsheet and every version of it
+
+    The total size is bounded by `max_bytes`; when it is exceeded the least
+    recently used files are evicted. Cache hits refresh a file's mtime, which
+    is what the eviction order is based on. Stores add to a running total
+    of the cache size, so the tree is only walked when that total goes over
+    the limit or once every `sweep_interval` seconds.
+
+    With an `accel_redirect` URL prefix, an nginx internal location that maps
+    to `root`, cached archives are sent by nginx (see accel_redirect_path).
+    """
+    def __init__(self, root, max_bytes, accel_redirect=None, sweep_interval=300):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.accel_redirect = accel_redirect
+        self.sweep_interval = sweep_interval
+
+    def archive_path(self, key, extension='zip'):
+        return self.root / 'archives' / f'{key}.{extension}'
+
+    def accel_redirect_path(self, key, extension='zip'):
+        """X-Accel-Redirect location of a cached archive, or None when nginx does not serve the cache"""
+        if not self.accel_redirect:
+            return None
+        return f"{self.accel_redirect.rstrip('/')}/archives/{key}.{extension}"
+
+    def row_dir(self):
+        """Directory holding the cached row PDFs (created on demand)"""
+        path = self.root / 'rows'
+        path.mkdir(parents=True, exist_ok=True)
+        return str(path)
+
+    def open_archive(self, key, extension='zip'):
+        """Open a cached archive for reading, or return None when it is not cached"""
+        path = self.archive_path(key, extension)
+        try:
+            archive = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        # Mark the archive as recently used
+        os.utime(path)
+        return archive
+
+    def store_archive(self, key, write, extension='zip'):
+        """Create a cached archive by calling write(fileobj) and return it opened for reading"""
+        path = self.archive_path(key, extension)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=path.parent, suffix='.tmp', delete=False) as tmp:
+            try:
+                write(tmp)
+            except BaseException:
+                tmp.close()
+                os.unlink(tmp.name)
+                raise
+        os.replace(tmp.name, path)
+        archive = open(path, 'rb')
+        self.record_store(os.fstat(archive.fileno()).st_size)
+        return archive
+
+    def tee_archive(self, key, chunks, extension='zip'):
+        """
+        Pass through the chunks of a streamed archive while writing them to the
+        cache. The archive is only cached if the stream runs to completion.
+        """
+        path = self.archive_path(key, extension)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = tempfile.NamedTemporaryFile(dir=path.parent, suffix='.tmp', delete=False)
+        complete = False
+        try:
+            for chunk in chunks:
+                tmp.write(chunk)
+                yield chunk
+            complete = True
+        finally:
+            size = tmp.tell()
+            tmp.close()
+            if complete:
+                os.replace(tmp.name, path)
+                self.record_store(size)
+            else:
+                os.unlink(tmp.name)
+
+    def record_store(self, size):
+        """Count a newly stored file of size bytes toward the limit, evicting when it is exceeded"""
+        usage = _usage.get(self.root)
+        if (usage is None or usage[0] + size > self.max_bytes
+                or time.monotonic() - usage[1] > self.sweep_interval):
+            self.enforce_limit()
+        else:
+            usage[0] += size
+
+    def _entries(self):
+        """(mtime, size, path) for every cached file"""
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith('.tmp'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def size(self):
+        """Total size in bytes of all cached files"""
+        return sum(size for _, size, _ in self._entries())
+
+    def enforce_limit(self, max_bytes=None):
+        """Evict least recently used files until the cache fits in max_bytes"""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in entries:
+            if total <= max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        _usage[self.root] = [total, time.monotonic()]
+        if removed:
+            self._remove_empty_row_dirs()
+            logger.info(f"Evicted {removed} files from the report cache")
+        return removed
+
+    def _remove_empty_row_dirs(self):
+        rows_dir = self.root / 'rows'
+        if not rows_dir.is_dir():
+            return
+        for path in rows_dir.iterdir():
+            if path.is_dir() and not any(path.iterdir()):
+                try:
+                    path.rmdir()
+                except OSError:
+                    pass
+
+    def purge(self):
+        """Remove everything from the cache"""
+        shutil.rmtree(self.root, ignore_errors=True)
+        _usage.pop(self.root, None)
+
+def get_report_cache():
+    """Return the configured ReportCache, or None if caching is disabled"""
+    if not getattr(settings, 'REPORT_CACHE_ENABLED', True):
+        return None
+    return ReportCache(
+        Path(settings.MEDIA_ROOT) / getattr(settings, 'REPORT_CACHE_DIR', 'report_cache'),
+        getattr(settings, 'REPORT_CACHE_MAX_BYTES', 1024 * 1024 * 1024),
+        getattr(settings, 'REPORT_CACHE_ACCEL_REDIRECT', None),
+        getattr(settings, 'REPORT_CACHE_SWEEP_INTERVAL', 300)
+    )
+
+def record_row_store(row_dir, size):
+    """Count a row PDF stored in row_dir toward the limit of the configured cache it belongs to"""
+    cache = get_report_cache()
+    if cache is not None and Path(row_dir) == cache.root / 'rows':
+        cache.record_store(size)
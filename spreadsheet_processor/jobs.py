@@ -0,0 +1,190 @@
+import logging
+import tempfile
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .archive import write_zip
+from .cache import get_report_cache
+from .metrics import start_run
+from .models import ReportJob
+
+logger = logging.getLogger(__name__)
+
+def enqueue_report_job(spreadsheet):
+    """Queue a background job that renders all reports of a spreadsheet"""
+    return ReportJob.objects.create(spreadsheet=spreadsheet)
+
+def reclaim_stale_jobs():
+    """
+    Put running jobs whose worker has not reported progress for
+    REPORT_JOB_STALE_AFTER seconds (it crashed or was killed) back in the
+    queue, or fail them once REPORT_JOB_MAX_ATTEMPTS workers have claimed
+    them. Returns the number of jobs requeued or failed.
+    """
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=getattr(settings, 'REPORT_JOB_STALE_AFTER', 600))
+    max_attempts = getattr(settings, 'REPORT_JOB_MAX_ATTEMPTS', 3)
+    # Jobs claimed before heartbeats were recorded only have a start time
+    stale = ReportJob.objects.filter(
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff),
+        status=ReportJob.STATUS_RUNNING
+    )
+    failed = stale.filter(attempts__gte=max_attempts).update(
+        status=ReportJob.STATUS_FAILED,
+        error='The worker running the job stopped responding',
+        finished_at=now
+    )
+    requeued = stale.filter(attempts__lt=max_attempts).update(
+        status=ReportJob.STATUS_PENDING,
+        processed_rows=0,
+        failed_rows=0
+    )
+    if failed or requeued:
+        logger.warning(f"Reclaimed stale report jobs: {requeued} requeued, {failed} failed")
+    return failed + requeued
+
+def claim_next_job():
+    """
+    Atomically move the oldest pending job to running and return it, or return
+    None when the queue is empty. The conditional UPDATE makes it safe to run
+    several workers against the same database. Stale jobs are reclaimed first
+    (see reclaim_stale_jobs).
+    """
+    reclaim_stale_jobs()
+    while True:
+        job = ReportJob.objects.filter(status=ReportJob.STATUS_PENDING).order_by('created_at', 'id').first()
+        if job is None:
+            return None
+        now = timezone.now()
+        claimed = ReportJob.objects.filter(id=job.id, status=ReportJob.STATUS_PENDING).update(
+            status=ReportJob.STATUS_RUNNING,
+            started_at=now,
+            heartbeat_at=now,
+            attempts=F('attempts') + 1
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+class JobSuperseded(Exception):
+    """The job was reclaimed (see reclaim_stale_jobs) while this run was still working on it"""
+
+def claimed_job(job):
+    """Queryset of the job as long as it is still running under this claim"""
+    return ReportJob.objects.filter(id=job.id, status=ReportJob.STATUS_RUNNING, attempts=job.attempts)
+
+class JobProgress:
+    """
+    Counts rendered rows and periodically writes the counters and a heartbeat
+    to the job. Raises JobSuperseded once the job is no longer running under
+    this run's claim.
+    """
+    def __init__(self, job):
+        self.job = job
+        self.interval = max(1, int(getattr(settings, 'REPORT_JOB_PROGRESS_INTERVAL', 25)))
+        self.heartbeat_interval = getattr(settings, 'REPORT_JOB_HEARTBEAT_INTERVAL', 30)
+        self.processed_rows = 0
+        self.failed_rows = 0
+        self.last_saved = time.monotonic()
+
+    def __call__(self, result):
+        self.processed_rows += 1
+        if result.error is not None:
+            self.failed_rows += 1
+        if self.processed_rows % self.interval == 0:
+            self.save()
+
+    def heartbeat(self):
+        """Save the job if nothing was written to it for REPORT_JOB_HEARTBEAT_INTERVAL seconds"""
+        if time.monotonic() - self.last_saved >= self.heartbeat_interval:
+            self.save()
+
+    def save(self, **fields):
+        updated = claimed_job(self.job).update(
+            processed_rows=self.processed_rows,
+            failed_rows=self.failed_rows,
+            heartbeat_at=timezone.now(),
+            **fields
+        )
+        if not updated:
+            raise JobSuperseded(f"Report job {self.job.id} was taken over by another worker")
+        self.last_saved = time.monotonic()
+        self.job.processed_rows = self.processed_rows
+        self.job.failed_rows = self.failed_rows
+
+def run_report_job(job):
+    """
+    Render the reports of a claimed job (every configured sheet) into its ZIP
+    artifact. The outcome is only written while the job is still running
+    under this claim; a run whose job was reclaimed meanwhile discards its
+    artifact and leaves the job to the run that took it over.
+    """
+    # Loaded here so that queueing a job from a view does not import the engines
+    from .pipeline import iter_dataframe_rows, iter_sheet_entries, load_sheet_dataframes, select_sheets
+    from .rendering import render_pool
+
+    run = start_run('job', spreadsheet_id=job.spreadsheet_id)
+    progress = JobProgress(job)
+    try:
+        sheets = select_sheets(job.spreadsheet)
+        # Reuse the PDFs of rows that are unchanged since an earlier upload
+        cache = get_report_cache()
+        row_cache_dir = cache.row_dir() if cache else None
+        with render_pool() as executor:
+            # Parse the sheets (concurrently in the pool) to know the total row count
+            dataframes = []
+            with run.stage('read'):
+                for sheet, df in load_sheet_dataframes(job.spreadsheet, sheets, executor, progress.heartbeat):
+                    dataframes.append((sheet, df))
+                    progress.heartbeat()
+            job.total_rows = sum(len(df) for _, df in dataframes)
+            progress.save(total_rows=job.total_rows)
+
+            def on_result(result):
+                run.record_result(result)
+                progress(result)
+
+            def heartbeat_entries(entries):
+                for entry in entries:
+                    progress.heartbeat()
+                    yield entry
+
+            sheet_rows = [(sheet, run.timed(iter_dataframe_rows(df), 'prepare')) for sheet, df in dataframes]
+            entries = run.timed(
+                iter_sheet_entries(sheet_rows, len(sheets) > 1, on_result, row_cache_dir, executor),
+                'render'
+            )
+            with tempfile.TemporaryFile() as zip_file:
+                with run.stage('archive'):
+                    write_zip(zip_file, heartbeat_entries(entries))
+                run.finish()
+                progress.save()
+                zip_file.seek(0)
+                job.artifact.save(f'spreadsheet_{job.spreadsheet_id}_reports.zip', File(zip_file), save=False)
+
+        job.status = ReportJob.STATUS_COMPLETED
+    except JobSuperseded as e:
+        logger.warning(str(e))
+    except Exception as e:
+        logger.error(f"Error running report job {job.id}: {str(e)}")
+        job.status = ReportJob.STATUS_FAILED
+        job.error = str(e)
+
+    job.finished_at = timezone.now()
+    finished = job.status != ReportJob.STATUS_RUNNING and claimed_job(job).update(
+        status=job.status,
+        artifact=job.artifact.name,
+        error=job.error,
+        finished_at=job.finished_at
+    )
+    if not finished:
+        # Another worker owns the job now: keep nothing of this run
+        if job.artifact:
+            job.artifact.delete(save=False)
+        job.refresh_from_db()
+    return job
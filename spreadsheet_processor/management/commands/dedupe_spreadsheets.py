@@ -0,0 +1,56 @@
+import glob
+import shutil
+
+from django.core.management.base import BaseCommand
+
+from spreadsheet_processor.cache import file_content_hash
+from spreadsheet_processor.models import Spreadsheet
+
+
+class Command(BaseCommand):
+    help = 'Point spreadsheets with identical contents at one stored file and delete the other copies'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report what would be merged and deleted',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        stored = {}
+        merged = 0
+        deleted = 0
+        for spreadsheet in Spreadsheet.objects.exclude(file='').order_by('id'):
+            storage = spreadsheet.file.storage
+            if not storage.exists(spreadsheet.file.name):
+                continue
+            if not spreadsheet.content_hash:
+                spreadsheet.content_hash = file_content_hash(spreadsheet.file)
+                if not dry_run:
+                    spreadsheet.save(update_fields=['content_hash'])
+
+            original = stored.setdefault(spreadsheet.content_hash, spreadsheet)
+            if original.file.name == spreadsheet.file.name:
+                continue
+
+            duplicate_name = spreadsheet.file.name
+            self.stdout.write(f'Spreadsheet {spreadsheet.id}: {duplicate_name} -> {original.file.name}')
+            merged += 1
+            if dry_run:
+                continue
+            Spreadsheet.objects.filter(file=duplicate_name).update(
+                file=original.file.name,
+                content_hash=original.content_hash,
+                snapshot=original.snapshot,
+            )
+            # Remove the copy along with its sheet snapshots
+            path = storage.path(duplicate_name)
+            for snapshot_path in glob.glob(glob.escape(path) + '.*snapshot'):
+                shutil.rmtree(snapshot_path, ignore_errors=True)
+            storage.delete(duplicate_name)
+            deleted += 1
+
+        verb = 'Would merge' if dry_run else 'Merged'
+        self.stdout.write(f'{verb} {merged} spreadsheets, deleted {deleted} duplicate files')
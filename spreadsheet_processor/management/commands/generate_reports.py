@@ -0,0 +1,95 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from spreadsheet_processor.batch import BATCH_FORMATS, generate_reports, spreadsheet_source, xlsx_source
+from spreadsheet_processor.cache import get_report_cache
+from spreadsheet_processor.models import Spreadsheet
+from spreadsheet_processor.selection import SelectionError
+
+
+class Command(BaseCommand):
+    help = (
+        'Render the reports of spreadsheets (by ID) and xlsx files or directories of them '
+        'into an output directory, resuming where an earlier run stopped'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'sources',
+            nargs='+',
+            help='Spreadsheet IDs, xlsx files, or directories searched for xlsx files',
+        )
+        parser.add_argument(
+            '--output-dir',
+            required=True,
+            help='Directory the reports are written to',
+        )
+        parser.add_argument(
+            '--format',
+            choices=BATCH_FORMATS,
+            default='tree',
+            help="'tree' writes a directory of row PDFs per workbook, 'zip' a ZIP per workbook",
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Render processes (default: REPORT_RENDER_WORKERS)',
+        )
+        parser.add_argument(
+            '--sheets',
+            action='append',
+            help="Sheet to report on (repeatable, or 'all' / 'first'; default: REPORT_SHEETS)",
+        )
+        parser.add_argument(
+            '--no-row-cache',
+            action='store_true',
+            help='Do not read or write the report cache of row PDFs',
+        )
+
+    def get_sources(self, arguments, sheet_names):
+        """BatchSources for the command line arguments, with a unique output name each"""
+        sources = []
+        for argument in arguments:
+            path = Path(argument)
+            if argument.isdigit() and not path.exists():
+                try:
+                    spreadsheet = Spreadsheet.objects.get(id=int(argument))
+                except Spreadsheet.DoesNotExist:
+                    raise CommandError(f'Spreadsheet {argument} not found')
+                sources.append(spreadsheet_source(spreadsheet, sheet_names))
+            elif path.is_dir():
+                for xlsx_path in sorted(path.rglob('*.xlsx')):
+                    # Skip the lock files Excel leaves next to open workbooks
+                    if not xlsx_path.name.startswith('~$'):
+                        name = xlsx_path.relative_to(path).with_suffix('').as_posix()
+                        sources.append(xlsx_source(xlsx_path, name, sheet_names))
+            elif path.is_file():
+                sources.append(xlsx_source(path, path.stem, sheet_names))
+            else:
+                raise CommandError(f'No spreadsheet, file or directory: {argument}')
+
+        names = [source.name for source in sources]
+        duplicates = sorted({name for name in names if names.count(name) > 1})
+        if duplicates:
+            raise CommandError(f'Several sources would be written to {duplicates[0]}')
+        return sources
+
+    def handle(self, *args, **options):
+        try:
+            sources = self.get_sources(options['sources'], options['sheets'])
+        except SelectionError as e:
+            raise CommandError(str(e))
+        if not sources:
+            raise CommandError('No xlsx files found')
+
+        cache = None if options['no_row_cache'] else get_report_cache()
+        summary = generate_reports(
+            sources,
+            options['output_dir'],
+            report_format=options['format'],
+            workers=options['workers'],
+            row_cache_dir=cache.row_dir() if cache else None,
+            log=self.stdout.write,
+        )
+        self.stdout.write(str(summary))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from spreadsheet_processor.cache import get_report_cache
+
+
+class Command(BaseCommand):
+    help = 'Remove cached report archives and row PDFs'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-bytes',
+            type=int,
+            help='Only evict least recently used files until the cache fits in this many bytes',
+        )
+
+    def handle(self, *args, **options):
+        cache = get_report_cache()
+        if cache is None:
+            self.stdout.write('Report cache is disabled')
+            return
+
+        if options['max_bytes'] is not None:
+            removed = cache.enforce_limit(options['max_bytes'])
+            self.stdout.write(f'Evicted {removed} files, {cache.size()} bytes remain in {cache.root}')
+        else:
+            cache.purge()
+            self.stdout.write(f'Purged report cache at {cache.root}')
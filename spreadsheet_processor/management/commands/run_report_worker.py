@@ -0,0 +1,40 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from spreadsheet_processor.jobs import claim_next_job, run_report_job
+
+
+class Command(BaseCommand):
+    help = 'Process queued report jobs from the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit when the queue is empty instead of waiting for new jobs',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=getattr(settings, 'REPORT_JOB_POLL_INTERVAL', 2.0),
+            help='Seconds to wait between checks of an empty queue',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Report worker started')
+        while True:
+            job = claim_next_job()
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            self.stdout.write(f'Processing report job {job.id} for spreadsheet {job.spreadsheet_id}')
+            run_report_job(job)
+            self.stdout.write(
+                f'Report job {job.id} {job.status}: '
+                f'{job.processed_rows - job.failed_rows}/{job.total_rows} rows rendered'
+            )
@@ -0,0 +1,84 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.template import Context, engines
+from django.utils import timezone
+from django.utils.safestring import mark_safe
+
+MARKDOWN_EXTENSIONS = ['extra', 'nl2br', 'sane_lists']
+REPORT_TEMPLATE = 'spreadsheet_processor/markdown_report_template.md'
+
+_local = threading.local()
+_html_cache = OrderedDict()
+_html_cache_lock = threading.Lock()
+
+def get_converter():
+    """
+    The markdown converter of the current thread. Building one loads and
+    configures every extension, so each thread builds it once and resets it
+    between documents.
+    """
+    converter = getattr(_local, 'converter', None)
+    if converter is None:
+        import markdown
+        converter = _local.converter = markdown.Markdown(extensions=MARKDOWN_EXTENSIONS)
+    return converter
+
+def get_markdown_cache_size():
+    return getattr(settings, 'MARKDOWN_CACHE_SIZE', 1024)
+
+def render_markdown(text):
+    """
+    Convert markdown to HTML. Results are kept in a process-wide LRU cache of
+    MARKDOWN_CACHE_SIZE documents keyed by the SHA-256 of the text, so the
+    same content is converted once however often it is shown.
+    """
+    key = hashlib.sha256(text.encode()).digest()
+    with _html_cache_lock:
+        html = _html_cache.get(key)
+        if html is not None:
+            _html_cache.move_to_end(key)
+            return html
+
+    html = get_converter().reset().convert(text)
+
+    max_size = get_markdown_cache_size()
+    if max_size > 0:
+        with _html_cache_lock:
+            _html_cache[key] = html
+            while len(_html_cache) > max_size:
+                _html_cache.popitem(last=False)
+    return html
+
+def clear_markdown_cache():
+    with _html_cache_lock:
+        _html_cache.clear()
+
+def render_markdown_reports(rows, generated_at=None):
+    """
+    Render the markdown report of many rows as HTML, yielding (row_number,
+    html) pairs. rows are (row_number, row_data) pairs where row_data is a
+    PreparedRow (whose values are already escaped) or a dict of raw values.
+    The template is compiled once and every row is converted by the same
+    converter; the report ID is the row's content hash (see
+    rendering.row_content_hash), so identical rows share a cache entry.
+    """
+    from .preparation import PreparedRow
+    from .rendering import row_content_hash
+
+    template = engines['django'].engine.get_template(REPORT_TEMPLATE)
+    generated_at = generated_at or timezone.now()
+    for row_number, row_data in rows:
+        if isinstance(row_data, PreparedRow):
+            data = {field: mark_safe(value) for field, value in zip(*row_data)}
+        else:
+            data = row_data
+        text = template.render(Context({
+            'row_number': row_number,
+            'data': data,
+            'report_id': row_content_hash(row_data)[:12],
+            'generated_at': generated_at,
+        }))
+        yield row_number, render_markdown(text)
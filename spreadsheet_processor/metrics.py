@@ -0,0 +1,319 @@
+import bisect
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+from django.conf import settings
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Pipeline stages that run time is attributed to
+STAGES = ('read', 'prepare', 'render', 'archive')
+
+# Upper bounds (seconds) of the per-row render time histogram buckets
+RENDER_BUCKETS = (0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+_lock = threading.Lock()
+_registry = None
+
+def metrics_enabled():
+    return getattr(settings, 'REPORT_METRICS_ENABLED', True)
+
+def get_metrics_dir():
+    """Directory where every process mirrors its metrics for /metrics/ to merge"""
+    return Path(getattr(settings, 'REPORT_METRICS_DIR', None) or Path(settings.BASE_DIR) / 'metrics')
+
+def peak_rss_bytes():
+    """Peak resident set size of this process, or None when unknown"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def new_registry():
+    """Empty metrics of one process; plain dicts so they can be stored as JSON"""
+    return {
+        'runs': {},
+        'rows': {},
+        'failed_rows': {},
+        'cached_rows': {},
+        'run_seconds': {},
+        'stage_seconds': {},
+        'rows_per_second': {},
+        'render_buckets': [0] * (len(RENDER_BUCKETS) + 1),
+        'render_sum': 0.0,
+        'render_count': 0,
+        'peak_rss_bytes': None,
+    }
+
+def get_registry():
+    global _registry
+    if _registry is None:
+        _registry = new_registry()
+    return _registry
+
+class PipelineRun:
+    """
+    Timings of one report pipeline run (a download or a background job).
+
+    Time is attributed to the innermost active stage: the stages of a lazy
+    pipeline are nested generators, so the time spent pulling rows through
+    `prepare` while `render` is pulling them is charged to `prepare` only.
+    Per-row render times come from the RenderResults, which works for rows
+    rendered in worker processes too.
+    """
+    def __init__(self, kind, **labels):
+        self.kind = kind
+        self.labels = labels
+        self.stage_seconds = dict.fromkeys(STAGES, 0.0)
+        self.rows = 0
+        self.failed_rows = 0
+        self.cached_rows = 0
+        self.render_times = []
+        self.started = time.perf_counter()
+        self.finished = False
+        self._active = []
+
+    def _enter(self, name):
+        now = time.perf_counter()
+        if self._active:
+            outer, since = self._active[-1]
+            self.stage_seconds[outer] += now - since
+        self._active.append((name, now))
+
+    def _exit(self):
+        now = time.perf_counter()
+        name, since = self._active.pop()
+        self.stage_seconds[name] += now - since
+        if self._active:
+            self._active[-1] = (self._active[-1][0], now)
+
+    @contextmanager
+    def stage(self, name):
+        """Attribute the time spent in the block to a stage"""
+        self._enter(name)
+        try:
+            yield
+        finally:
+            self._exit()
+
+    def timed(self, iterable, name):
+        """Wrap an iterator so the time spent producing each item goes to a stage"""
+        iterator = iter(iterable)
+        while True:
+            self._enter(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._exit()
+            yield item
+
+    def record_result(self, result):
+        """on_result callback for iter_report_entries"""
+        self.rows += 1
+        if result.error is not None:
+            self.failed_rows += 1
+        if result.seconds is None:
+            self.cached_rows += 1
+        else:
+            self.render_times.append(result.seconds)
+
+    def track(self, chunks):
+        """Pass through a streamed response and finish the run when it ends"""
+        try:
+            yield from chunks
+        finally:
+            self.finish()
+
+    def finish(self, rows=None):
+        """Add the run to the process metrics and log it"""
+        if self.finished:
+            return
+        self.finished = True
+        if rows is not None:
+            self.rows = rows
+        seconds = time.perf_counter() - self.started
+        rows_per_second = self.rows / seconds if seconds else 0.0
+        peak_rss = peak_rss_bytes()
+
+        with _lock:
+            registry = get_registry()
+            for key, value in (
+                ('runs', 1),
+                ('rows', self.rows),
+                ('failed_rows', self.failed_rows),
+                ('cached_rows', self.cached_rows),
+                ('run_seconds', seconds),
+            ):
+                registry[key][self.kind] = registry[key].get(self.kind, 0) + value
+            stages = registry['stage_seconds'].setdefault(self.kind, dict.fromkeys(STAGES, 0.0))
+            for name, value in self.stage_seconds.items():
+                stages[name] += value
+            registry['rows_per_second'][self.kind] = rows_per_second
+            for value in self.render_times:
+                registry['render_buckets'][bisect.bisect_left(RENDER_BUCKETS, value)] += 1
+            registry['render_sum'] += sum(self.render_times)
+            registry['render_count'] += len(self.render_times)
+            registry['peak_rss_bytes'] = peak_rss
+            save_registry(registry)
+
+        logger.info("report_pipeline " + json.dumps({
+            'kind': self.kind,
+            **self.labels,
+            'rows': self.rows,
+            'failed_rows': self.failed_rows,
+            'cached_rows': self.cached_rows,
+            'seconds': round(seconds, 4),
+            'rows_per_second': round(rows_per_second, 1),
+            'stage_seconds': {name: round(value, 4) for name, value in self.stage_seconds.items()},
+            'peak_rss_bytes': peak_rss,
+        }))
+
+class NullRun:
+    """Stand-in for PipelineRun when metrics are disabled"""
+    def stage(self, name):
+        return nullcontext()
+
+    def timed(self, iterable, name):
+        return iterable
+
+    def record_result(self, result):
+        pass
+
+    def track(self, chunks):
+        return chunks
+
+    def finish(self, rows=None):
+        pass
+
+def start_run(kind, **labels):
+    """Start timing a pipeline run, or return a no-op run when metrics are disabled"""
+    if not metrics_enabled():
+        return NullRun()
+    return PipelineRun(kind, **labels)
+
+def save_registry(registry):
+    """Mirror this process's metrics to its file in the metrics directory"""
+    try:
+        metrics_dir = get_metrics_dir()
+        metrics_dir.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=metrics_dir, suffix='.tmp', delete=False) as tmp:
+            json.dump(registry, tmp)
+        os.replace(tmp.name, metrics_dir / f'{os.getpid()}.json')
+    except Exception as e:
+        logger.error(f"Error saving metrics: {str(e)}")
+
+def process_alive(pid):
+    """Whether a process with this PID is running"""
+    if os.name == 'nt':
+        # os.kill would terminate it; keep every file on Windows
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Running as another user
+        return True
+    return True
+
+def load_registries():
+    """
+    Metrics of every running process that has finished a run, this one
+    included. The files of processes that have exited are deleted, so their
+    gauges are no longer exported; the merged counters drop by their counts,
+    which Prometheus treats as a counter reset.
+    """
+    registries = {}
+    metrics_dir = get_metrics_dir()
+    if metrics_dir.is_dir():
+        for path in metrics_dir.glob('*.json'):
+            if path.stem.isdigit() and not process_alive(int(path.stem)):
+                path.unlink(missing_ok=True)
+                continue
+            try:
+                with open(path) as metrics_file:
+                    registries[path.stem] = json.load(metrics_file)
+            except (OSError, ValueError):
+                continue
+    with _lock:
+        registries[str(os.getpid())] = json.loads(json.dumps(get_registry()))
+    return registries
+
+def merge_registries(registries):
+    """Sum the counters and histograms of several processes"""
+    merged = new_registry()
+    for registry in registries:
+        for key in ('runs', 'rows', 'failed_rows', 'cached_rows', 'run_seconds'):
+            for kind, value in registry[key].items():
+                merged[key][kind] = merged[key].get(kind, 0) + value
+        for kind, stages in registry['stage_seconds'].items():
+            merged_stages = merged['stage_seconds'].setdefault(kind, dict.fromkeys(STAGES, 0.0))
+            for name, value in stages.items():
+                merged_stages[name] = merged_stages.get(name, 0.0) + value
+        for index, count in enumerate(registry['render_buckets']):
+            merged['render_buckets'][index] += count
+        merged['render_sum'] += registry['render_sum']
+        merged['render_count'] += registry['render_count']
+    return merged
+
+def render_prometheus():
+    """Metrics of all processes in the Prometheus text exposition format"""
+    registries = load_registries()
+    merged = merge_registries(registries.values())
+    lines = []
+
+    def family(name, metric_type, help_text):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+
+    for key, name, help_text in (
+        ('runs', 'report_runs_total', 'Report pipeline runs.'),
+        ('rows', 'report_rows_total', 'Rows processed by report pipeline runs.'),
+        ('failed_rows', 'report_failed_rows_total', 'Rows whose PDF could not be rendered.'),
+        ('cached_rows', 'report_cached_rows_total', 'Row PDFs served from the row cache.'),
+        ('run_seconds', 'report_run_seconds_total', 'Wall time of report pipeline runs.'),
+    ):
+        family(name, 'counter', help_text)
+        for kind, value in sorted(merged[key].items()):
+            lines.append(f'{name}{{kind="{kind}"}} {value}')
+
+    family('report_stage_seconds_total', 'counter', 'Time spent in each report pipeline stage.')
+    for kind, stages in sorted(merged['stage_seconds'].items()):
+        for name, value in stages.items():
+            lines.append(f'report_stage_seconds_total{{kind="{kind}",stage="{name}"}} {value}')
+
+    family('report_row_render_seconds', 'histogram', 'Time to render the PDF of one row.')
+    cumulative = 0
+    for bound, count in zip(RENDER_BUCKETS + ('+Inf',), merged['render_buckets']):
+        cumulative += count
+        lines.append(f'report_row_render_seconds_bucket{{le="{bound}"}} {cumulative}')
+    lines.append(f'report_row_render_seconds_sum {merged["render_sum"]}')
+    lines.append(f'report_row_render_seconds_count {merged["render_count"]}')
+
+    family('report_last_rows_per_second', 'gauge', 'Throughput of the last run of each process.')
+    for pid, registry in sorted(registries.items()):
+        for kind, value in sorted(registry['rows_per_second'].items()):
+            lines.append(f'report_last_rows_per_second{{kind="{kind}",pid="{pid}"}} {value}')
+
+    family('process_peak_rss_bytes', 'gauge', 'Peak resident set size of each process.')
+    for pid, registry in sorted(registries.items()):
+        peak = peak_rss_bytes() if pid == str(os.getpid()) else registry['peak_rss_bytes']
+        if peak is not None:
+            lines.append(f'process_peak_rss_bytes{{pid="{pid}"}} {peak}')
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,29 @@
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spreadsheet_processor', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], db_index=True, default='pending', max_length=20)),
+                ('total_rows', models.IntegerField(default=0)),
+                ('processed_rows', models.IntegerField(default=0)),
+                ('failed_rows', models.IntegerField(default=0)),
+                ('artifact', models.FileField(blank=True, upload_to='reports/')),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('spreadsheet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='report_jobs', to='spreadsheet_processor.spreadsheet')),
+            ],
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spreadsheet_processor', '0002_reportjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='spreadsheet',
+            name='snapshot',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
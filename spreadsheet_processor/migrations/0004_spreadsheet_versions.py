@@ -0,0 +1,22 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spreadsheet_processor', '0003_spreadsheet_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='spreadsheet',
+            name='original_name',
+            field=models.CharField(blank=True, db_index=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='spreadsheet',
+            name='previous_version',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='next_versions', to='spreadsheet_processor.spreadsheet'),
+        ),
+    ]
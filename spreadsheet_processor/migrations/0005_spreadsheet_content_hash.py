@@ -0,0 +1,34 @@
+import hashlib
+
+from django.db import migrations, models
+
+
+def hash_existing_files(apps, schema_editor):
+    Spreadsheet = apps.get_model('spreadsheet_processor', 'Spreadsheet')
+    for spreadsheet in Spreadsheet.objects.filter(content_hash='').exclude(file=''):
+        digest = hashlib.sha256()
+        try:
+            with spreadsheet.file.open('rb') as stored_file:
+                for chunk in stored_file.chunks():
+                    digest.update(chunk)
+        except OSError:
+            # The stored file is gone; there is nothing to share
+            continue
+        spreadsheet.content_hash = digest.hexdigest()
+        spreadsheet.save(update_fields=['content_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spreadsheet_processor', '0004_spreadsheet_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='spreadsheet',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.RunPython(hash_existing_files, migrations.RunPython.noop),
+    ]
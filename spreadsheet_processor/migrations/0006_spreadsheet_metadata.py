@@ -0,0 +1,113 @@
+import posixpath
+import re
+import zipfile
+from xml.etree import ElementTree
+
+from django.db import migrations, models
+
+# A frozen copy of what spreadsheet_processor.validation read from a workbook
+# when this migration was written, so that later changes to the app cannot
+# change what the migration does
+_RELATIONSHIPS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+_MAIN = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_R_ID = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id'
+_OFFICE_DOCUMENT = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument'
+_DIMENSION_RE = re.compile(r'^\$?([A-Z]+)\$?(\d+)(?::\$?([A-Z]+)\$?(\d+))?$')
+
+
+def _relationships(archive, part):
+    directory, name = posixpath.split(part)
+    root = ElementTree.fromstring(archive.read(posixpath.join(directory, '_rels', f'{name}.rels')))
+    relationships = {}
+    for rel in root.iter(f'{_RELATIONSHIPS}Relationship'):
+        target = rel.get('Target')
+        if target.startswith('/'):
+            target = target[1:]
+        else:
+            target = posixpath.normpath(posixpath.join(posixpath.dirname(part), target))
+        relationships[rel.get('Id')] = (rel.get('Type'), target)
+    return relationships
+
+
+def _column_number(letters):
+    number = 0
+    for letter in letters:
+        number = number * 26 + ord(letter) - ord('A') + 1
+    return number
+
+
+def describe_workbook(xlsx_file):
+    """(sheet count, data rows, columns) of a workbook; rows and columns come from the first sheet's dimension"""
+    with zipfile.ZipFile(xlsx_file) as archive:
+        workbook_part = next(
+            target for rel_type, target in _relationships(archive, '').values() if rel_type == _OFFICE_DOCUMENT
+        )
+        sheets = ElementTree.fromstring(archive.read(workbook_part)).findall(f'{_MAIN}sheets/{_MAIN}sheet')
+        _, sheet_part = _relationships(archive, workbook_part)[sheets[0].get(_R_ID)]
+        dimension = None
+        with archive.open(sheet_part) as sheet_file:
+            for _, element in ElementTree.iterparse(sheet_file, events=('start',)):
+                if element.tag == f'{_MAIN}dimension':
+                    dimension = element.get('ref')
+                elif element.tag == f'{_MAIN}sheetData':
+                    break
+
+    match = _DIMENSION_RE.match(dimension or '')
+    if match is None or match.group(3) is None:
+        return len(sheets), None, None
+    first_column, first_row, last_column, last_row = match.groups()
+    rows = max(int(last_row) - int(first_row), 0)
+    return len(sheets), rows, _column_number(last_column) - _column_number(first_column) + 1
+
+
+def describe_existing_files(apps, schema_editor):
+    Spreadsheet = apps.get_model('spreadsheet_processor', 'Spreadsheet')
+    for spreadsheet in Spreadsheet.objects.exclude(file=''):
+        try:
+            spreadsheet.file_size = spreadsheet.file.size
+            with spreadsheet.file.open('rb') as xlsx_file:
+                sheet_count, rows, columns = describe_workbook(xlsx_file)
+        except (OSError, zipfile.BadZipFile, KeyError, IndexError, StopIteration, ElementTree.ParseError):
+            # Missing or unreadable files keep whatever could be found out
+            if spreadsheet.file_size is not None:
+                spreadsheet.save(update_fields=['file_size'])
+            continue
+        spreadsheet.sheet_count = sheet_count
+        spreadsheet.row_count = rows
+        spreadsheet.column_count = columns
+        spreadsheet.save(update_fields=['file_size', 'sheet_count', 'row_count', 'column_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spreadsheet_processor', '0005_spreadsheet_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='spreadsheet',
+            name='file_size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='spreadsheet',
+            name='sheet_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='spreadsheet',
+            name='row_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='spreadsheet',
+            name='column_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='spreadsheet',
+            index=models.Index(fields=['uploaded_at', 'id'], name='spreadsheet_uploaded_idx'),
+        ),
+        migrations.RunPython(describe_existing_files, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spreadsheet_processor', '0006_spreadsheet_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reportjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='reportjob',
+            name='attempts',
+            field=models.IntegerField(default=0),
+        ),
+    ]
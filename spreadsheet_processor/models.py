@@ -3,8 +3,61 @@ from django.utils import timezone
 
 class Spreadsheet(models.Model):
     file = models.FileField(upload_to='spreadsheets/')
+    # SHA-256 of the file contents; identical uploads share one stored file
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
     uploaded_at = models.DateTimeField(default=timezone.now)
     processed = models.BooleanField(default=False)
+    # Storage name of the columnar snapshot of the parsed first sheet (see snapshots.py)
+    snapshot = models.CharField(max_length=255, blank=True)
+    # Name of the file as uploaded, before storage made it unique
+    original_name = models.CharField(max_length=255, blank=True, db_index=True)
+    # The latest earlier upload of a file with the same name
+    previous_version = models.ForeignKey(
+        'self', null=True, blank=True, on_delete=models.SET_NULL, related_name='next_versions'
+    )
+    # Shown in the list without opening the file; the row and column counts
+    # of the first sheet are estimated at upload and corrected once it is parsed
+    file_size = models.BigIntegerField(null=True, blank=True)
+    sheet_count = models.IntegerField(null=True, blank=True)
+    row_count = models.IntegerField(null=True, blank=True)
+    column_count = models.IntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Newest first list, paginated by (uploaded_at, id) keyset
+            models.Index(fields=['uploaded_at', 'id'], name='spreadsheet_uploaded_idx'),
+        ]
 
     def __str__(self):
         return f"Spreadsheet uploaded at {self.uploaded_at}"
+
+class ReportJob(models.Model):
+    """A queued request to render every report of a spreadsheet into a ZIP file"""
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_COMPLETED, 'Completed'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    spreadsheet = models.ForeignKey(Spreadsheet, on_delete=models.CASCADE, related_name='report_jobs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True)
+    total_rows = models.IntegerField(default=0)
+    processed_rows = models.IntegerField(default=0)
+    failed_rows = models.IntegerField(default=0)
+    artifact = models.FileField(upload_to='reports/', blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Last time the worker running the job reported progress (see jobs.reclaim_stale_jobs)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    # Number of times a worker has claimed the job
+    attempts = models.IntegerField(default=0)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Report job {self.id} for spreadsheet {self.spreadsheet_id} ({self.status})"
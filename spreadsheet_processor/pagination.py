@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta, timezone
+
+from django.db.models import Q
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def encode_cursor(spreadsheet):
+    """Opaque position of a spreadsheet in the newest-first list"""
+    microseconds = (spreadsheet.uploaded_at - _EPOCH) // timedelta(microseconds=1)
+    return f'{microseconds}.{spreadsheet.id}'
+
+def decode_cursor(cursor):
+    """(uploaded_at, id) of a cursor made by encode_cursor, or None if it is not one"""
+    try:
+        microseconds, spreadsheet_id = cursor.split('.')
+        return _EPOCH + timedelta(microseconds=int(microseconds)), int(spreadsheet_id)
+    except (AttributeError, ValueError, OverflowError):
+        return None
+
+def keyset_page(queryset, page_size, after=None, before=None):
+    """
+    One page of spreadsheets, newest first, starting after or ending before
+    a cursor. Rows are found by seeking the (uploaded_at, id) index rather
+    than with OFFSET, so deep pages cost the same as the first one.
+    Returns (spreadsheets, next_cursor, previous_cursor); a cursor is None
+    when there is no page in that direction.
+
+    The conditions are written as a range on uploaded_at minus the tied rows
+    already shown, rather than as `uploaded_at < t OR (uploaded_at = t AND
+    id < i)`, which SQLite answers by scanning the whole index.
+    """
+    after = decode_cursor(after)
+    before = decode_cursor(before) if after is None else None
+
+    if before is not None:
+        uploaded_at, spreadsheet_id = before
+        rows = list(queryset.filter(
+            Q(uploaded_at__gte=uploaded_at) & ~Q(uploaded_at=uploaded_at, id__lte=spreadsheet_id)
+        ).order_by('uploaded_at', 'id')[:page_size + 1])
+        has_previous = len(rows) > page_size
+        spreadsheets = rows[:page_size][::-1]
+        has_next = True
+    else:
+        if after is not None:
+            uploaded_at, spreadsheet_id = after
+            queryset = queryset.filter(
+                Q(uploaded_at__lte=uploaded_at) & ~Q(uploaded_at=uploaded_at, id__gte=spreadsheet_id)
+            )
+        rows = list(queryset.order_by('-uploaded_at', '-id')[:page_size + 1])
+        has_next = len(rows) > page_size
+        spreadsheets = rows[:page_size]
+        has_previous = after is not None
+
+    next_cursor = encode_cursor(spreadsheets[-1]) if has_next and spreadsheets else None
+    previous_cursor = encode_cursor(spreadsheets[0]) if has_previous and spreadsheets else None
+    return spreadsheets, next_cursor, previous_cursor
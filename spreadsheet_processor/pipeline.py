@@ -0,0 +1,340 @@
+from collections import namedtuple
+from concurrent.futures import wait
+import logging
+import os
+import re
+
+import pandas as pd
+from django.conf import settings
+from openpyxl import load_workbook
+
+from .metrics import NullRun
+from .preparation import prepare_rows
+from .readers import iter_xlsx_frames
+from .rendering import render_pool, render_rows
+from .selection import SelectionError
+from .snapshots import read_snapshot, snapshot_name_for, write_snapshot
+
+logger = logging.getLogger(__name__)
+
+# A sheet of a workbook: its position and name
+Sheet = namedtuple('Sheet', ['index', 'name'])
+
+def workbook_sheets(xlsx_file):
+    """All sheets of an xlsx file, in workbook order"""
+    workbook = load_workbook(xlsx_file, read_only=True)
+    try:
+        return [Sheet(index, name) for index, name in enumerate(workbook.sheetnames)]
+    finally:
+        workbook.close()
+
+def get_sheets(spreadsheet):
+    """All sheets of an uploaded workbook, in workbook order"""
+    with spreadsheet.file.storage.open(spreadsheet.file.name, 'rb') as xlsx_file:
+        return workbook_sheets(xlsx_file)
+
+def select_sheets(spreadsheet, names=None):
+    """
+    The sheets to report on: the given sheet names, or REPORT_SHEETS when none
+    are given ('all' for every sheet, 'first' for the first sheet only).
+    """
+    return pick_sheets(get_sheets(spreadsheet), names)
+
+def pick_sheets(sheets, names=None):
+    """The sheets of a workbook that select_sheets picks for the given names"""
+    names = names or getattr(settings, 'REPORT_SHEETS', 'all')
+    if names == 'all' or names == ['all']:
+        return sheets
+    if names == 'first' or names == ['first']:
+        return sheets[:1]
+    by_name = {sheet.name: sheet for sheet in sheets}
+    for name in names:
+        if name not in by_name:
+            raise SelectionError(f"Unknown sheet: {name}")
+    return [by_name[name] for name in names]
+
+def save_snapshot(spreadsheet, df):
+    """Store a columnar snapshot of the parsed DataFrame next to the uploaded file"""
+    try:
+        name = snapshot_name_for(spreadsheet.file.name)
+        write_snapshot(df, spreadsheet.file.storage.path(name))
+        spreadsheet.snapshot = name
+        spreadsheet.save(update_fields=['snapshot'])
+    except Exception as e:
+        logger.error(f"Error saving snapshot for spreadsheet {spreadsheet.id}: {str(e)}")
+
+def load_dataframe(spreadsheet):
+    """
+    Return the parsed first sheet of a Spreadsheet. The columnar snapshot is
+    used when there is one; otherwise the Excel file is parsed and a snapshot
+    is saved for the next read.
+    """
+    if spreadsheet.snapshot:
+        try:
+            df = read_snapshot(spreadsheet.file.storage.path(spreadsheet.snapshot))
+            record_shape(spreadsheet, df)
+            return df
+        except Exception as e:
+            logger.error(f"Error reading snapshot for spreadsheet {spreadsheet.id}: {str(e)}")
+    
+    # Read the Excel file with openpyxl engine
+    df = pd.read_excel(spreadsheet.file, engine='openpyxl')
+    save_snapshot(spreadsheet, df)
+    record_shape(spreadsheet, df)
+    return df
+
+def record_shape(spreadsheet, df):
+    """
+    Replace the row and column counts estimated at upload with those of the
+    parsed first sheet, for every upload of the same file
+    """
+    rows, columns = df.shape
+    if (spreadsheet.row_count, spreadsheet.column_count) == (rows, columns):
+        return
+    spreadsheet.row_count, spreadsheet.column_count = rows, columns
+    type(spreadsheet).objects.filter(file=spreadsheet.file.name).update(row_count=rows, column_count=columns)
+
+def parse_sheet(file_path, sheet_name, snapshot_path):
+    """
+    Parse one sheet of an xlsx file into a snapshot at snapshot_path. Runs in
+    render pool workers, so only the (small) snapshot path is sent back; the
+    DataFrame itself is returned if the snapshot cannot be written.
+    """
+    df = pd.read_excel(file_path, sheet_name=sheet_name, engine='openpyxl')
+    try:
+        write_snapshot(df, snapshot_path)
+    except Exception as e:
+        logger.error(f"Error saving snapshot of sheet {sheet_name}: {str(e)}")
+        return df
+    return snapshot_path
+
+def load_sheet_dataframes(spreadsheet, sheets, executor=None, heartbeat=None):
+    """
+    Yield (sheet, DataFrame) for each of the given sheets, in order. Sheets
+    are read from their snapshots; the others are parsed (concurrently in the
+    executor, when given) and snapshotted for the next read. heartbeat, if
+    given, is called every few seconds while waiting for the executor.
+    """
+    storage = spreadsheet.file.storage
+    file_path = storage.path(spreadsheet.file.name)
+    snapshot_paths = {
+        sheet.index: storage.path(snapshot_name_for(spreadsheet.file.name, sheet.index))
+        for sheet in sheets
+    }
+
+    # Start parsing every sheet that has no snapshot yet
+    parsing = {}
+    for sheet in sheets:
+        if not os.path.isdir(snapshot_paths[sheet.index]):
+            args = (file_path, sheet.name, snapshot_paths[sheet.index])
+            parsing[sheet.index] = executor.submit(parse_sheet, *args) if executor else args
+
+    for sheet in sheets:
+        task = parsing.pop(sheet.index, None)
+        if task is not None:
+            if executor:
+                while heartbeat is not None and task not in wait([task], timeout=5).done:
+                    heartbeat()
+                result = task.result()
+            else:
+                result = parse_sheet(*task)
+            if not isinstance(result, str):
+                yield sheet, result
+                continue
+            if sheet.index == 0:
+                spreadsheet.snapshot = snapshot_name_for(spreadsheet.file.name)
+                spreadsheet.save(update_fields=['snapshot'])
+
+        if sheet.index == 0:
+            # Also falls back to parsing the file if the snapshot is unreadable
+            yield sheet, load_dataframe(spreadsheet)
+            continue
+        try:
+            df = read_snapshot(snapshot_paths[sheet.index])
+        except Exception as e:
+            logger.error(f"Error reading snapshot of sheet {sheet.name} for spreadsheet {spreadsheet.id}: {str(e)}")
+            df = pd.read_excel(file_path, sheet_name=sheet.name, engine='openpyxl')
+        yield sheet, df
+
+def iter_dataframe_rows(df, selection=None):
+    """
+    Yield (row_number, PreparedRow) pairs for every row of the DataFrame, or
+    for the rows and columns picked by a RowSelection. The selection is
+    applied before any row is formatted.
+    """
+    row_numbers = None
+    if selection is not None:
+        df, row_numbers = selection.apply(df)
+    return prepare_rows(
+        df,
+        block_size=getattr(settings, 'REPORT_PREPARE_BLOCK_SIZE', 1000),
+        row_numbers=row_numbers
+    )
+
+def iter_xlsx_file_rows(spreadsheet, run=None, selection=None, sheet_name=None):
+    """
+    Lazily yield (row_number, PreparedRow) pairs for a sheet (the first one
+    by default) straight from the xlsx file, applying a RowSelection to every
+    block as it is read. Reading stops after the last selected row. With a
+    metrics run, reading the file is timed as the `read` stage.
+    """
+    block_size = getattr(settings, 'SPREADSHEET_READER_BLOCK_SIZE', 1000)
+    last_row = selection.last_row if selection is not None else None
+    with spreadsheet.file.storage.open(spreadsheet.file.name, 'rb') as xlsx_file:
+        frames = iter_xlsx_frames(xlsx_file, sheet_name=sheet_name, block_size=block_size)
+        if run is not None:
+            frames = run.timed(frames, 'read')
+        row_number = 1
+        for frame in frames:
+            if selection is None:
+                yield from prepare_rows(frame, first_row_number=row_number, block_size=block_size)
+            else:
+                selected, row_numbers = selection.apply(frame, first_row_number=row_number)
+                yield from prepare_rows(selected, block_size=block_size, row_numbers=row_numbers)
+            row_number += len(frame)
+            if last_row is not None and row_number > last_row:
+                break
+
+def iter_spreadsheet_rows(spreadsheet, run=None, selection=None):
+    """
+    Return an iterator of (row_number, PreparedRow) pairs for a Spreadsheet using
+    the configured SPREADSHEET_ROW_READER: 'dataframe' loads the whole sheet
+    up front (from its snapshot when available), 'streaming' reads the xlsx
+    row by row in openpyxl read-only mode. Only the rows and columns of a
+    RowSelection are returned when one is given. With a metrics run (see
+    metrics.start_run), reading is timed as `read` and row formatting as
+    `prepare`.
+    """
+    run = run or NullRun()
+    if getattr(settings, 'SPREADSHEET_ROW_READER', 'dataframe') == 'streaming':
+        return run.timed(iter_xlsx_file_rows(spreadsheet, run, selection), 'prepare')
+    with run.stage('read'):
+        df = load_dataframe(spreadsheet)
+    with run.stage('prepare'):
+        rows = iter_dataframe_rows(df, selection)
+    return run.timed(rows, 'prepare')
+
+def iter_sheet_columns(spreadsheet, sheets):
+    """
+    Yield (sheet, empty DataFrame) with the columns and dtypes each of the
+    given sheets is read with by the configured SPREADSHEET_ROW_READER.
+    Sheets are parsed (and snapshotted) as iter_sheet_rows would parse them.
+    """
+    if getattr(settings, 'SPREADSHEET_ROW_READER', 'dataframe') == 'streaming':
+        block_size = getattr(settings, 'SPREADSHEET_READER_BLOCK_SIZE', 1000)
+        for sheet in sheets:
+            with spreadsheet.file.storage.open(spreadsheet.file.name, 'rb') as xlsx_file:
+                # Every block is typed with the dtypes of the whole sheet
+                frames = iter_xlsx_frames(xlsx_file, sheet_name=sheet.name, block_size=block_size)
+                yield sheet, next(frames, pd.DataFrame()).iloc[:0]
+        return
+    for sheet, df in load_sheet_dataframes(spreadsheet, sheets):
+        yield sheet, df.iloc[:0]
+
+def check_selection(spreadsheet, sheets, selection):
+    """
+    Check a RowSelection against the columns of the sheets it is applied to
+    (see RowSelection.check) before anything is rendered, so that a bad
+    selection is reported up front instead of ending a streamed download
+    part way through. Selections of rows only need no reading.
+
+    Of several sheets, those without every column the selection names are
+    left out. Returns (sheets to report, sheets left out); raises
+    SelectionError when no sheet is left.
+    """
+    if selection is None or not selection.named_columns:
+        return sheets, []
+    kept, skipped = [], []
+    for sheet, columns in iter_sheet_columns(spreadsheet, sheets):
+        if len(sheets) > 1 and not set(selection.named_columns) <= set(columns.columns):
+            skipped.append(sheet)
+            continue
+        selection.check(columns)
+        kept.append(sheet)
+    if not kept:
+        missing = [name for name in selection.named_columns if name not in columns.columns]
+        raise SelectionError(f"Unknown column: {missing[0]}")
+    return kept, skipped
+
+def iter_sheet_rows(spreadsheet, sheets, run=None, selection=None, executor=None):
+    """
+    Yield (sheet, rows) for each of the given sheets, where rows is an iterator
+    of (row_number, PreparedRow) pairs like iter_spreadsheet_rows returns.
+    With the 'dataframe' reader the sheets are parsed concurrently in the
+    executor, when given, while earlier sheets are being rendered.
+    """
+    run = run or NullRun()
+    if getattr(settings, 'SPREADSHEET_ROW_READER', 'dataframe') == 'streaming':
+        for sheet in sheets:
+            yield sheet, run.timed(iter_xlsx_file_rows(spreadsheet, run, selection, sheet.name), 'prepare')
+        return
+
+    dataframes = load_sheet_dataframes(spreadsheet, sheets, executor)
+    while True:
+        with run.stage('read'):
+            sheet, df = next(dataframes, (None, None))
+        if sheet is None:
+            return
+        with run.stage('prepare'):
+            rows = iter_dataframe_rows(df, selection)
+        yield sheet, run.timed(rows, 'prepare')
+
+def sheet_folder(name, used):
+    """
+    The folder (ZIP folder or output directory) a sheet's reports go in: the
+    sheet name without path separators, control characters and leading or
+    trailing dots and spaces, so that names like '..' stay inside the
+    archive or directory. Names are made unique (ignoring case) within the
+    set of folders already used, which is updated.
+    """
+    folder = re.sub(r'[\x00-\x1f/\\]', '_', name).strip(' .') or 'sheet'
+    candidate, number = folder, 1
+    while candidate.lower() in used:
+        number += 1
+        candidate = f'{folder}_{number}'
+    used.add(candidate.lower())
+    return candidate
+
+def iter_sheet_entries(sheet_rows, folders, on_result=None, row_cache_dir=None, executor=None):
+    """
+    Render the (sheet, rows) pairs of iter_sheet_rows and yield (filename,
+    pdf_data) entries, under a folder per sheet (see sheet_folder) when
+    folders is true.
+    """
+    used = set()
+    for sheet, rows in sheet_rows:
+        prefix = f'{sheet_folder(sheet.name, used)}/' if folders else ''
+        for name, pdf_data in iter_report_entries(rows, on_result, row_cache_dir, executor):
+            yield prefix + name, pdf_data
+
+def iter_workbook_entries(spreadsheet, sheets, run=None, selection=None, on_result=None, row_cache_dir=None,
+                          folders=None):
+    """
+    Yield the (filename, pdf_data) report entries of the given sheets of a
+    workbook, in per-sheet folders when folders is true (by default, when
+    there is more than one sheet). One render pool parses the sheets and
+    renders their rows.
+    """
+    if folders is None:
+        folders = len(sheets) > 1
+    with render_pool() as executor:
+        sheet_rows = iter_sheet_rows(spreadsheet, sheets, run, selection, executor)
+        yield from iter_sheet_entries(sheet_rows, folders, on_result, row_cache_dir, executor)
+
+def iter_report_entries(rows, on_result=None, row_cache_dir=None, executor=None):
+    """
+    Render (row_number, row_data) pairs (see rendering.render_row) and yield (filename, pdf_data) for
+    every row that renders, in row order. on_result, if given, is called with
+    every RenderResult, including failed ones. Row PDFs are read from and
+    written to the content-addressed row_cache_dir when it is given, so only
+    rows that changed since an earlier upload are rendered. executor is a shared render
+    pool (see rendering.render_pool).
+    """
+    # Render rows (in a process pool when configured) and yield them in row order
+    for result in render_rows(rows, cache_dir=row_cache_dir, executor=executor):
+        if on_result is not None:
+            on_result(result)
+        if result.error is not None:
+            logger.error(f"Error creating PDF for row {result.row_number}: {result.error}")
+            continue
+        yield f'row_{result.row_number}.pdf', result.pdf_data
@@ -0,0 +1,118 @@
+from collections import namedtuple
+from datetime import datetime
+import html
+
+import numpy as np
+import pandas as pd
+
+# A row ready for rendering: column names plus one Paragraph markup string per column
+PreparedRow = namedtuple('PreparedRow', ['fields', 'values'])
+
+_is_datetime_like = np.frompyfunc(lambda value: isinstance(value, (datetime, np.datetime64)), 1, 1)
+
+def escape_markup(strings):
+    """Escape Paragraph markup characters (&, <, >) in an object array of strings"""
+    text = '\x00'.join(strings)
+    if '&' not in text and '<' not in text and '>' not in text:
+        return strings
+    return np.array([html.escape(value, quote=False) for value in strings], dtype=object)
+
+def format_datetimes(values):
+    """Format a datetime64 array the way str(pd.Timestamp) / str(pd.NaT) do"""
+    values = values.astype('datetime64[ns]')
+    missing = np.isnat(values)
+    if (missing | (values.view('i8') % 1_000_000_000 == 0)).all():
+        strings = np.char.replace(np.datetime_as_string(values, unit='s'), 'T', ' ')
+        return np.where(missing, 'NaT', strings).astype(object)
+    return np.array([str(pd.Timestamp(value)) for value in values], dtype=object)
+
+def format_column(values):
+    """Return str(value) for every element of a 1-D array, as an object array"""
+    kind = values.dtype.kind
+    if kind == 'M':
+        return format_datetimes(values)
+    if kind in 'biuf':
+        return values.astype(str).astype(object)
+    return np.array([str(value) for value in values], dtype=object)
+
+def _datetime_row_mask(df, missing):
+    """
+    Rows that df.iterrows() turns into a datetime64 Series: in a mixed-dtype
+    frame, a row whose values are all missing or datetime-like, with at least
+    one datetime-like value (NaT included), has its missing values shown as NaT.
+    """
+    # A present numeric or boolean value rules a row out, which is cheap to check
+    candidates = np.ones(len(df), dtype=bool)
+    datetime_columns = []
+    object_columns = []
+    for position in range(df.shape[1]):
+        kind = df.iloc[:, position].dtype.kind
+        if kind == 'M':
+            datetime_columns.append(position)
+        elif kind == 'O':
+            object_columns.append(position)
+        else:
+            candidates &= missing[:, position]
+    if not candidates.any():
+        return candidates
+
+    # Only the object cells of the remaining rows are inspected one by one
+    rows = np.flatnonzero(candidates)
+    all_datetime_or_missing = np.ones(len(rows), dtype=bool)
+    any_datetime = np.full(len(rows), bool(datetime_columns))
+    for position in object_columns:
+        datetime_like = _is_datetime_like(df.iloc[:, position].to_numpy()[rows]).astype(bool)
+        all_datetime_or_missing &= datetime_like | missing[rows, position]
+        any_datetime |= datetime_like
+
+    mask = np.zeros(len(df), dtype=bool)
+    mask[rows] = all_datetime_or_missing & any_datetime
+    return mask
+
+def format_frame(df):
+    """
+    Format every cell of a DataFrame as escaped Paragraph markup, one column
+    at a time. The strings are the same as str(value) for the values of
+    row.to_dict() in df.iterrows(), including the per-row dtype that iterrows
+    applies (e.g. integers shown as floats in an all-numeric frame).
+    Returns a list of object arrays, one per column.
+    """
+    # The dtype iterrows() gives each row Series
+    row_dtype = df.iloc[:0].to_numpy().dtype
+
+    columns = []
+    for position in range(df.shape[1]):
+        column = df.iloc[:, position]
+        if row_dtype == object:
+            values = column.to_numpy()
+        else:
+            values = column.to_numpy(dtype=row_dtype)
+        strings = format_column(values)
+        # Only text columns can contain markup characters
+        if column.dtype == object:
+            strings = escape_markup(strings)
+        columns.append(strings)
+
+    if row_dtype == object and df.shape[1]:
+        missing = df.isna().to_numpy()
+        datetime_rows = _datetime_row_mask(df, missing)
+        if datetime_rows.any():
+            for position, strings in enumerate(columns):
+                strings[datetime_rows & missing[:, position]] = 'NaT'
+
+    return columns
+
+def prepare_rows(df, first_row_number=1, block_size=1000, row_numbers=None):
+    """
+    Yield (row_number, PreparedRow) pairs for a DataFrame. Rows are numbered
+    from first_row_number, or by row_numbers (one per row) when given. Cells
+    are formatted a block of rows at a time, so memory stays proportional to
+    block_size.
+    """
+    fields = list(df.columns)
+    if row_numbers is None:
+        row_numbers = range(first_row_number, first_row_number + len(df))
+    for start in range(0, len(df), block_size):
+        columns = format_frame(df.iloc[start:start + block_size])
+        for row_number, values in zip(row_numbers[start:start + block_size], zip(*columns)):
+            yield int(row_number), PreparedRow(fields, values)
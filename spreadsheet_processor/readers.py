@@ -0,0 +1,198 @@
+import itertools
+from datetime import datetime
+
+import numpy as np
+from openpyxl import load_workbook
+from openpyxl.cell.cell import ERROR_CODES, TYPE_ERROR, TYPE_NUMERIC
+from pandas.io.parsers import TextParser
+
+def convert_cell(cell):
+    """Convert an openpyxl cell the same way pandas' openpyxl reader does"""
+    if cell.value is None:
+        return ''
+    elif cell.data_type == TYPE_ERROR:
+        return np.nan
+    elif cell.data_type == TYPE_NUMERIC:
+        value = int(cell.value)
+        if value == cell.value:
+            return value
+        return float(cell.value)
+    return cell.value
+
+def _trimmed_length(values):
+    """Length of a row without its trailing empty cells"""
+    length = len(values)
+    while length and values[length - 1] == '':
+        length -= 1
+    return length
+
+def _fit(values, width):
+    """Pad or cut a row to exactly width cells"""
+    if len(values) >= width:
+        return values[:width]
+    return values + [''] * (width - len(values))
+
+# Strings the parser reads as missing values (pandas' default na_values)
+NA_STRINGS = {
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+}
+
+def _value_kind(value):
+    """The kind of a cell value that decides its column's dtype"""
+    if value is None:
+        return 'missing'
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, int):
+        return 'int'
+    if isinstance(value, float):
+        if np.isnan(value):
+            return 'missing'
+        return 'int' if value.is_integer() else 'float'
+    if isinstance(value, datetime):
+        return 'datetime'
+    if isinstance(value, str):
+        # The parser turns numeric text into numbers
+        if value in NA_STRINGS or value in ERROR_CODES:
+            return 'missing'
+        for kind, convert in (('int', int), ('float', float)):
+            try:
+                convert(value)
+                return kind
+            except ValueError:
+                pass
+        return 'text'
+    return 'other'
+
+def sheet_dtypes(rows, columns, width):
+    """
+    The dtypes pd.read_excel gives the columns of a whole sheet, for the
+    columns whose dtype a block of rows cannot decide on its own: numbers
+    (booleans included) are float when any of them is fractional or missing,
+    dates with missing values are datetime64 (NaT), and columns with text
+    or mixed kinds are object, keeping integers as integers, also in blocks
+    where they are all missing.
+    """
+    kinds = [set() for _ in range(width)]
+    for row in rows:
+        row = row[:width]
+        for column_kinds, value in zip(kinds, row):
+            column_kinds.add(_value_kind(value))
+        if len(row) < width:
+            for column_kinds in kinds[len(row):]:
+                column_kinds.add('missing')
+
+    dtypes = {}
+    for column, column_kinds in zip(columns, kinds):
+        values = column_kinds - {'missing'}
+        if not values:
+            continue
+        if values <= {'int', 'float', 'bool'}:
+            if 'float' in values or 'missing' in column_kinds:
+                dtypes[column] = np.dtype('float64')
+            elif len(values) > 1:
+                dtypes[column] = np.dtype('int64')
+        elif values == {'datetime'}:
+            dtypes[column] = np.dtype('datetime64[ns]')
+        else:
+            dtypes[column] = np.dtype(object)
+    return dtypes
+
+def _parse_block(rows, columns, width, dtypes):
+    """Parse a block of rows with the whole-sheet dtypes"""
+    frame = TextParser(
+        [_fit(row, width) for row in rows], header=None, names=columns,
+        dtype={column: dtype for column, dtype in dtypes.items() if dtype.kind == 'O'}
+    ).read()
+    for column, dtype in dtypes.items():
+        if frame[column].dtype != dtype:
+            frame[column] = frame[column].astype(dtype)
+    return frame
+
+def iter_sheet_values(worksheet):
+    """
+    Yield the converted cell values of every row of a read-only worksheet,
+    dropping trailing empty rows like pd.read_excel does. Empty rows are only
+    held back until the next non-empty row, so memory stays bounded.
+    """
+    empty_rows = []
+    for row in worksheet.iter_rows():
+        values = [convert_cell(cell) for cell in row]
+        if _trimmed_length(values) == 0:
+            empty_rows.append(values)
+            continue
+        yield from empty_rows
+        empty_rows.clear()
+        yield values
+
+def _iter_raw_rows(worksheet):
+    """
+    The raw cell values (None when empty, error codes as text) of the rows
+    iter_sheet_values yields, without converting every cell
+    """
+    empty_rows = 0
+    for row in worksheet.iter_rows(values_only=True):
+        if all(value is None or value == '' for value in row):
+            empty_rows += 1
+            continue
+        for _ in range(empty_rows):
+            yield ()
+        empty_rows = 0
+        yield row
+
+def iter_xlsx_frames(file, sheet_name=None, block_size=1000):
+    """
+    Lazily yield the rows of a sheet of an xlsx file as DataFrames of at most
+    block_size rows, typed the way `pd.read_excel(file, engine='openpyxl')`
+    types them.
+
+    The workbook is opened with openpyxl in read-only mode and every block is
+    converted with the parser pd.read_excel uses. A sheet longer than one
+    block is scanned once more up front for the dtypes that depend on the
+    whole sheet (see sheet_dtypes), so NaN handling and numeric and date
+    columns come out as they do for the whole sheet. The columns are fixed by
+    the header and the first block.
+    """
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        worksheet = workbook[sheet_name] if sheet_name is not None else workbook.worksheets[0]
+        values = iter_sheet_values(worksheet)
+
+        # The first block determines the columns, including pandas' naming of
+        # unnamed and duplicated headers
+        first_block = list(itertools.islice(values, block_size + 1))
+        if not first_block:
+            return
+        width = max(_trimmed_length(row) for row in first_block)
+        frame = TextParser([_fit(row, width) for row in first_block], header=0).read()
+        if len(first_block) <= block_size:
+            # The whole sheet is in one block, typed like read_excel types it
+            yield frame
+            return
+
+        # Later blocks can change a column's dtype (a missing value turns
+        # integers into floats), so look at every row before yielding any
+        columns = list(frame.columns)
+        rows = itertools.islice(_iter_raw_rows(worksheet), 1, None)
+        dtypes = sheet_dtypes(rows, columns, width)
+        yield _parse_block(first_block[1:], columns, width, dtypes)
+        while True:
+            block = list(itertools.islice(values, block_size))
+            if not block:
+                return
+            yield _parse_block(block, columns, width, dtypes)
+    finally:
+        workbook.close()
+
+def iter_xlsx_rows(file, sheet_name=None, block_size=1000):
+    """
+    Lazily yield (row_number, row_data) pairs for a sheet of an xlsx file,
+    where row_data matches what `row.to_dict()` gives for the rows of
+    `pd.read_excel(file, engine='openpyxl')` (see iter_xlsx_frames).
+    """
+    row_number = 0
+    for frame in iter_xlsx_frames(file, sheet_name, block_size):
+        for _, row in frame.iterrows():
+            row_number += 1
+            yield row_number, row.to_dict()
@@ -0,0 +1,159 @@
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import hashlib
+import itertools
+import json
+import os
+import tempfile
+import time
+
+from django.conf import settings
+
+from .cache import record_row_store
+from .preparation import PreparedRow
+from .reports import ReportTheme, generate_pdf_report, render_report_pdf
+
+# Outcome of rendering one row: error is None if and only if the row was
+# rendered. pdf_data is the row's PDF, except for rows rendered into a
+# combined PDF (see reports.render_workbook_pdf), where it is always None.
+# seconds is the render time, or None when the PDF came from the row cache.
+RenderResult = namedtuple('RenderResult', ['row_number', 'pdf_data', 'error', 'seconds'], defaults=(None,))
+
+
+def get_render_workers():
+    """Number of processes used to render rows (1 renders in-process)"""
+    return max(1, int(getattr(settings, 'REPORT_RENDER_WORKERS', 1)))
+
+
+def get_render_chunk_size():
+    """Number of rows handed to a worker process at a time"""
+    return max(1, int(getattr(settings, 'REPORT_RENDER_CHUNK_SIZE', 50)))
+
+
+def write_atomic(path, data):
+    """Write data to path so that readers never see a partially written file"""
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix='.tmp', delete=False) as tmp:
+        tmp.write(data)
+    os.replace(tmp.name, path)
+
+
+def row_content_hash(row_data):
+    """
+    SHA-256 of everything a row's PDF is rendered from: its field names, its
+    Paragraph markup values and the report theme version. Rows with the same
+    hash render to the same report, whichever spreadsheet or row they are in.
+    """
+    if isinstance(row_data, PreparedRow):
+        fields, values = row_data
+    else:
+        fields, values = list(row_data.keys()), [str(value) for value in row_data.values()]
+    content = json.dumps([ReportTheme.version, [str(field) for field in fields], list(values)])
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def render_row(row_number, row_data, cache_dir=None):
+    """
+    Render a single row into a RenderResult. row_data is either a PreparedRow
+    or a dict of raw values. With a cache_dir, row PDFs are stored there by
+    content hash (see row_content_hash), so a row that is unchanged since any
+    earlier upload is not rendered again.
+    """
+    cache_path = None
+    if cache_dir is not None:
+        content_hash = row_content_hash(row_data)
+        cache_path = os.path.join(cache_dir, content_hash[:2], f'{content_hash}.pdf')
+        try:
+            with open(cache_path, 'rb') as cached:
+                pdf_data = cached.read()
+        except FileNotFoundError:
+            pass
+        else:
+            # Mark the row PDF as recently used
+            os.utime(cache_path)
+            return RenderResult(row_number, pdf_data, None)
+
+    start = time.perf_counter()
+    try:
+        if isinstance(row_data, PreparedRow):
+            pdf_data = render_report_pdf(row_data.fields, row_data.values)
+        else:
+            pdf_data = generate_pdf_report(row_data, row_number)
+    except Exception as e:
+        return RenderResult(row_number, None, str(e), time.perf_counter() - start)
+    seconds = time.perf_counter() - start
+
+    if cache_path is not None:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        write_atomic(cache_path, pdf_data)
+        record_row_store(cache_dir, len(pdf_data))
+    return RenderResult(row_number, pdf_data, None, seconds)
+
+
+def render_chunk(chunk, cache_dir=None):
+    """Render a list of (row_number, row_data) pairs into RenderResults"""
+    return [render_row(row_number, row_data, cache_dir) for row_number, row_data in chunk]
+
+
+def chunked(rows, chunk_size):
+    """Split an iterable of rows into lists of at most chunk_size items"""
+    iterator = iter(rows)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+@contextmanager
+def render_pool(workers=None):
+    """
+    Process pool shared by all the work of one download (sheet parsing and row
+    rendering), or None when REPORT_RENDER_WORKERS renders in-process.
+    """
+    workers = workers or get_render_workers()
+    if workers <= 1:
+        yield None
+        return
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        yield executor
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def render_rows(rows, workers=None, chunk_size=None, cache_dir=None, executor=None):
+    """
+    Render (row_number, row_data) pairs and yield a RenderResult per row, in
+    input order. With more than one worker the rows are rendered in chunks by
+    a process pool (the given executor, or a pool of their own); only a
+    bounded number of chunks is in flight at a time so callers can stream
+    results as they arrive. cache_dir is passed on to render_row.
+    """
+    workers = workers or get_render_workers()
+    chunk_size = chunk_size or get_render_chunk_size()
+
+    if executor is None:
+        if workers <= 1:
+            for row_number, row_data in rows:
+                yield render_row(row_number, row_data, cache_dir)
+            return
+        with render_pool(workers) as executor:
+            yield from render_rows(rows, workers, chunk_size, cache_dir, executor)
+        return
+
+    chunks = chunked(rows, chunk_size)
+    pending = deque(
+        executor.submit(render_chunk, chunk, cache_dir)
+        for chunk in itertools.islice(chunks, workers * 2)
+    )
+    try:
+        while pending:
+            results = pending.popleft().result()
+            for chunk in itertools.islice(chunks, 1):
+                pending.append(executor.submit(render_chunk, chunk, cache_dir))
+            yield from results
+    finally:
+        # Do not leave work for abandoned rows in a shared pool
+        for future in pending:
+            future.cancel()
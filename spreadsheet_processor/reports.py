@@ -0,0 +1,524 @@
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen.canvas import Canvas
+from reportlab.platypus import (
+    BaseDocTemplate, Flowable, Frame, NextPageTemplate, PageBreak, PageTemplate, Paragraph, Spacer, Table, TableStyle
+)
+from reportlab.platypus.doctemplate import LayoutError
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib import colors
+from reportlab.lib.units import inch
+import html
+import io
+from datetime import datetime
+from functools import cached_property, lru_cache
+import logging
+import re
+import threading
+import time
+import pytz
+
+logger = logging.getLogger(__name__)
+
+class ReportTheme:
+    """
+    Page layout, paragraph styles, colours and table style used by the PDF
+    reports. Building it is expensive compared to rendering a small row, so a
+    single instance is shared by every report rendered in a process (see
+    get_report_theme). Bump `version` whenever the output changes so cached
+    reports are invalidated.
+    """
+    version = '6'
+
+    def __init__(self):
+        # Static page content, drawn from the shared ReportTemplate
+        self.title = 'Report'
+        self.table_header = ['Field', 'Value']
+
+        # Limits that keep the layout of long and wide rows bounded (see
+        # fit_row_cells): longer values are cut short in the table and shown
+        # in full, up to max_appendix_chars per row, in an appendix
+        self.max_cell_chars = 1500
+        self.max_field_chars = 200
+        self.table_chunk_rows = 40
+        self.table_chunk_chars = 3000
+        self.max_appendix_chars = 100000
+        self.appendix_paragraph_chars = 2000
+
+        # Page layout
+        self.pagesize = letter
+        self.margins = {
+            'rightMargin': 72,
+            'leftMargin': 72,
+            'topMargin': 72,
+            'bottomMargin': 72,
+        }
+        self.column_widths = [2*inch, 4.5*inch]
+
+        # Colours
+        self.primary_color = colors.HexColor('#2c3e50')
+        self.secondary_color = colors.HexColor('#34495e')
+        self.row_background = colors.HexColor('#ecf0f1')
+        self.grid_color = colors.HexColor('#bdc3c7')
+
+        # Footer timestamps are shown in PST
+        self.timezone = pytz.timezone('America/Los_Angeles')
+
+        # Get styles
+        self.styles = getSampleStyleSheet()
+
+        # Create custom styles
+        self.styles.add(ParagraphStyle(
+            name='CustomTitle',
+            parent=self.styles['Heading1'],
+            fontSize=24,
+            spaceAfter=30,
+            textColor=self.primary_color,
+            alignment=1  # Center alignment
+        ))
+
+        self.styles.add(ParagraphStyle(
+            name='CustomSubTitle',
+            parent=self.styles['Heading2'],
+            fontSize=16,
+            spaceAfter=20,
+            textColor=self.secondary_color,
+            alignment=1  # Center alignment
+        ))
+
+        self.styles.add(ParagraphStyle(
+            name='CustomBodyText',
+            parent=self.styles['Normal'],
+            fontSize=12,
+            spaceAfter=12,
+            textColor=self.primary_color
+        ))
+
+        # The header row and the field/value rows are separate tables: the
+        # header is part of the static page content (see ReportTemplate)
+        cell_commands = [
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('GRID', (0, 0), (-1, -1), 1, self.grid_color),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            ('WORDWRAP', (0, 0), (-1, -1), True),
+            ('LEFTPADDING', (0, 0), (-1, -1), 6),
+            ('RIGHTPADDING', (0, 0), (-1, -1), 6),
+            ('TOPPADDING', (0, 0), (-1, -1), 3),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 3),
+        ]
+        self.header_style = TableStyle([
+            ('BACKGROUND', (0, 0), (-1, -1), self.primary_color),
+            ('TEXTCOLOR', (0, 0), (-1, -1), colors.whitesmoke),
+            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, -1), 12),
+        ] + cell_commands)
+        self.table_style = TableStyle([
+            ('BACKGROUND', (0, 0), (-1, -1), self.row_background),
+            ('TEXTCOLOR', (0, 0), (-1, -1), self.primary_color),
+            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+            ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ] + cell_commands)
+
+    @cached_property
+    def template(self):
+        """The ReportTemplate of this theme, built on first use"""
+        return ReportTemplate(self)
+
+class _Placement(Flowable):
+    """Stands in for a flowable while a Frame lays it out, recording where it would be drawn"""
+    def __init__(self, flowable=None):
+        super().__init__()
+        self.flowable = flowable
+        self.position = None
+
+    def wrap(self, availWidth, availHeight):
+        if self.flowable is None:
+            return 0, 0
+        return self.flowable.wrap(availWidth, availHeight)
+
+    def getSpaceBefore(self):
+        return self.flowable.getSpaceBefore() if self.flowable is not None else 0
+
+    def getSpaceAfter(self):
+        return self.flowable.getSpaceAfter() if self.flowable is not None else 0
+
+    def drawOn(self, canvas, x, y, _sW=0):
+        self.position = (x, y, _sW)
+
+class _RowDocTemplate(BaseDocTemplate):
+    """
+    A document whose story is extended with the next row's flowables from
+    the row_flowables iterator whenever everything before them has been
+    laid out, so a document of many rows holds one row at a time
+    """
+    def __init__(self, output, row_flowables=(), **kwargs):
+        super().__init__(output, **kwargs)
+        self.row_flowables = iter(row_flowables)
+        self.story = None
+
+    def build(self, flowables, *args, **kwargs):
+        self.story = flowables
+        super().build(flowables, *args, **kwargs)
+
+    def handle_flowable(self, flowables):
+        super().handle_flowable(flowables)
+        # Also called for the flowables ReportLab queues itself at page ends
+        if flowables is self.story and not flowables:
+            flowables.extend(next(self.row_flowables, ()))
+
+class ReportTemplate:
+    """
+    Page templates for reports. The parts of a report that are the same for
+    every row (the theme's title and table header) are laid out once per
+    theme. A document of one report draws them straight onto its first
+    page; a document of many reports draws them once into a form XObject
+    that every row's first page shows. Rows then only lay out their
+    field/value table, in a frame that starts below the static part. Pages
+    a long row runs over to use the plain 'continuation' template.
+    """
+    form_name = 'ReportStatic'
+
+    def __init__(self, theme):
+        self.theme = theme
+        page_width, page_height = theme.pagesize
+        self.frame_box = (
+            theme.margins['leftMargin'],
+            theme.margins['bottomMargin'],
+            page_width - theme.margins['leftMargin'] - theme.margins['rightMargin'],
+            page_height - theme.margins['topMargin'] - theme.margins['bottomMargin'],
+        )
+
+        header = Table([theme.table_header], colWidths=theme.column_widths)
+        header.setStyle(theme.header_style)
+        static = [
+            _Placement(Paragraph(theme.title, theme.styles['CustomTitle'])),
+            _Placement(Spacer(1, 30)),
+            _Placement(header),
+        ]
+        content_start = _Placement()
+
+        # Let a frame of the page's size place the static flowables, exactly
+        # as it would place them at the top of a story
+        frame = Frame(*self.frame_box)
+        canvas = Canvas(io.BytesIO(), pagesize=theme.pagesize)
+        for placement in static + [content_start]:
+            if not frame.add(placement, canvas):
+                raise ValueError("The static report content does not fit on a page")
+        self.static = [(placement.flowable, placement.position) for placement in static]
+        self.content_top = content_start.position[1]
+
+        # Drawing sets attributes on the shared flowables
+        self._lock = threading.Lock()
+
+    def _draw(self, canvas):
+        with self._lock:
+            for flowable, (x, y, sW) in self.static:
+                flowable.drawOn(canvas, x, y, _sW=sW)
+
+    def draw_static(self, canvas, doc):
+        """onPage callback of the 'report' template for documents of one report"""
+        self._draw(canvas)
+
+    def draw_static_form(self, canvas, doc):
+        """onPage callback of the 'report' template for documents of many reports"""
+        if not canvas.hasForm(self.form_name):
+            canvas.beginForm(self.form_name)
+            self._draw(canvas)
+            canvas.endForm()
+        canvas.doForm(self.form_name)
+
+    def doc_template(self, output, first_page='report', shared=False, row_flowables=()):
+        """
+        A document whose pages use the 'report' and 'continuation' templates,
+        starting with a page of the first_page template. The static content
+        of a shared document (one holding many reports) is drawn from a form
+        XObject; in a document of one report that would only add work.
+        Lists of flowables from row_flowables are added to the story, one at
+        a time, once the story passed to build() has been laid out.
+        """
+        x, y, width, height = self.frame_box
+        report_frame = Frame(x, y, width, self.content_top - y, topPadding=0, id='report')
+        continuation_frame = Frame(x, y, width, height, id='continuation')
+        page_templates = [
+            PageTemplate(
+                'report',
+                [report_frame],
+                onPage=self.draw_static_form if shared else self.draw_static,
+                autoNextPageTemplate='continuation'
+            ),
+            PageTemplate('continuation', [continuation_frame]),
+        ]
+        page_templates.sort(key=lambda page_template: page_template.id != first_page)
+        return _RowDocTemplate(
+            output,
+            row_flowables,
+            pagesize=self.theme.pagesize,
+            pageTemplates=page_templates,
+            **self.theme.margins
+        )
+
+@lru_cache(maxsize=None)
+def get_report_theme():
+    """Return the ReportTheme shared by all reports rendered in this process"""
+    return ReportTheme()
+
+def generate_pdf_report(row_data, row_number, theme=None):
+    """Generate a beautiful PDF report for a single row"""
+    # Convert values to text; Paragraph markup in the values is interpreted as-is
+    return render_report_pdf(
+        list(row_data.keys()),
+        [str(value) for value in row_data.values()],
+        theme
+    )
+
+_TAG_RE = re.compile(r'<[^>]*>')
+
+def markup_text(markup):
+    """The plain text of Paragraph markup"""
+    return html.unescape(_TAG_RE.sub('', markup))
+
+def _text_paragraphs(text, size):
+    """Split text into pieces of at most size characters, at whitespace where possible"""
+    pieces = []
+    while len(text) > size:
+        cut = text.rfind(' ', size // 2, size)
+        cut = size if cut == -1 else cut + 1
+        pieces.append(text[:cut])
+        text = text[cut:]
+    if text:
+        pieces.append(text)
+    return pieces
+
+def fit_row_cells(fields, markup_values, theme):
+    """
+    Return (table_rows, appendix) for a row's report. Values longer than
+    theme.max_cell_chars are cut short in the table, where a cell cannot be
+    split over pages, and their full text goes into appendix flowables,
+    which can. The appendix holds at most theme.max_appendix_chars of text
+    per row, so the layout work of any row is bounded.
+    """
+    styles = theme.styles
+    table_rows = []
+    appendix = []
+    budget = theme.max_appendix_chars
+    for field, value in zip(fields, markup_values):
+        field = str(field)
+        if len(field) > theme.max_field_chars:
+            field = field[:theme.max_field_chars] + '\u2026'
+        if len(value) <= theme.max_cell_chars:
+            table_rows.append([field, Paragraph(value, styles['CustomBodyText'])])
+            continue
+
+        # The note goes in a paragraph of its own, so the cut text keeps the
+        # fast line breaking of paragraphs without inline markup
+        text = markup_text(value)
+        shown = Paragraph(html.escape(text[:theme.max_cell_chars], quote=False) + '\u2026', styles['CustomBodyText'])
+        if budget <= 0:
+            note = f'<i>({len(text) - theme.max_cell_chars} more characters not shown)</i>'
+            table_rows.append([field, [shown, Paragraph(note, styles['CustomBodyText'])]])
+            continue
+
+        label = f'A{len(appendix) + 1}'
+        note = f'<i>(full text in appendix {label})</i>'
+        table_rows.append([field, [shown, Paragraph(note, styles['CustomBodyText'])]])
+        section = [Paragraph(f'<b>{label}. {html.escape(field, quote=False)}</b>', styles['CustomBodyText'])]
+        for piece in _text_paragraphs(text[:budget], theme.appendix_paragraph_chars):
+            section.append(Paragraph(html.escape(piece, quote=False), styles['CustomBodyText']))
+        if len(text) > budget:
+            section.append(Paragraph(f'<i>({len(text) - budget} more characters not shown)</i>', styles['CustomBodyText']))
+        budget -= len(text)
+        appendix.append(section)
+    return table_rows, appendix
+
+def _paragraph_height(paragraph, width):
+    """
+    An upper bound of a paragraph's height at width, from its text width
+    alone: of two consecutive lines, the words of both would not fit on one.
+    Paragraphs with inline markup are wrapped, since tags can change fonts
+    and break lines.
+    """
+    if '<' in paragraph.text:
+        return paragraph.wrap(width, 1e6)[1]
+    style = paragraph.style
+    text_width = stringWidth(html.unescape(paragraph.text), style.fontName, style.fontSize)
+    return (2 * text_width / (width - style.fontSize) + 2) * style.leading
+
+def check_row_layout(table_rows, theme):
+    """
+    Raise LayoutError when a table row of a report is taller than a page.
+    A table cannot split a row over pages, so ReportLab would fail on it in
+    the middle of a document. Only cells whose height bound exceeds a page
+    are actually wrapped.
+    """
+    # The page's frame and a cell have 6pt and 3pt padding above and below
+    limit = theme.template.frame_box[3] - 2 * 6 - 2 * 3
+    field_width, value_width = (width - 2 * 6 for width in theme.column_widths)
+    for field, value in table_rows:
+        # Field names are plain strings in the 10pt table font: one line per line break
+        if (field.count('\n') + 1) * 12 > limit:
+            raise LayoutError(f"Field {field[:40]!r} is taller than a page")
+        paragraphs = value if isinstance(value, list) else [value]
+        spacing = sum(p.style.spaceBefore + p.style.spaceAfter for p in paragraphs)
+        if sum(_paragraph_height(p, value_width) for p in paragraphs) + spacing <= limit:
+            continue
+        if sum(p.wrap(value_width, limit)[1] for p in paragraphs) + spacing > limit:
+            raise LayoutError(f"The value of {field[:40]!r} is taller than a page")
+
+def _table_chunks(table_rows, theme):
+    """
+    Split table rows into runs of at most theme.table_chunk_rows rows and
+    about theme.table_chunk_chars characters of values, roughly a page
+    """
+    chunk = []
+    chars = 0
+    for row in table_rows:
+        value = row[1]
+        size = sum(len(p.text) for p in value) if isinstance(value, list) else len(value.text)
+        if chunk and (len(chunk) == theme.table_chunk_rows or chars + size > theme.table_chunk_chars):
+            yield chunk
+            chunk = []
+            chars = 0
+        chunk.append(row)
+        chars += size
+    if chunk:
+        yield chunk
+
+def build_report_story(fields, markup_values, theme, generated_at):
+    """
+    Build the flowables of one row's report, which start on a page of the
+    'report' template (see ReportTemplate); the title and the table header
+    come from that template.
+    """
+    styles = theme.styles
+    story = []
+
+    # Lay the rows out in tables of a bounded number of rows; consecutive
+    # tables look like one, but each splits over pages cheaply
+    table_rows, appendix = fit_row_cells(fields, markup_values, theme)
+    check_row_layout(table_rows, theme)
+    for chunk in _table_chunks(table_rows, theme):
+        table = Table(chunk, colWidths=theme.column_widths)
+        table.setStyle(theme.table_style)
+        story.append(table)
+    story.append(Spacer(1, 30))
+
+    # Add footer with PST timezone
+    story.append(Paragraph(f"Generated on: {generated_at.strftime('%B %d, %Y at %I:%M %p %Z')}", styles['CustomBodyText']))
+
+    # Full text of the values that were cut short
+    if appendix:
+        story.append(PageBreak())
+        story.append(Paragraph("Appendix", styles['CustomSubTitle']))
+        for section in appendix:
+            story.extend(section)
+    return story
+
+def render_report_pdf(fields, markup_values, theme=None):
+    """Render the PDF report for one row from its field names and Paragraph markup values"""
+    try:
+        theme = theme or get_report_theme()
+
+        # Create a buffer for the PDF
+        pdf_buffer = io.BytesIO()
+
+        # Create PDF document
+        doc = theme.template.doc_template(pdf_buffer)
+
+        # Build PDF content
+        current_time = datetime.now(pytz.UTC).astimezone(theme.timezone)
+        story = build_report_story(fields, markup_values, theme, current_time)
+
+        # Build PDF
+        doc.build(story)
+
+        # Get the PDF data
+        pdf_buffer.seek(0)
+        return pdf_buffer.getvalue()
+
+    except Exception as e:
+        logger.error(f"Error generating PDF report: {str(e)}")
+        raise
+
+class RowBookmark(Flowable):
+    """Zero-size flowable that adds an outline entry pointing at the current page"""
+    def __init__(self, key, title, level=0):
+        super().__init__()
+        self.key = key
+        self.title = title
+        self.level = level
+
+    def wrap(self, availWidth, availHeight):
+        return 0, 0
+
+    def draw(self):
+        self.canv.bookmarkPage(self.key)
+        self.canv.addOutlineEntry(self.title, self.key, level=self.level)
+
+def render_combined_pdf(rows, output, theme=None, bookmarks=True, on_result=None):
+    """
+    Render (row_number, row_data) pairs into a single PDF written to output,
+    starting every row on a new page. Fonts, styles and document overhead are
+    shared by all rows. row_data is a PreparedRow-like (fields, values) pair
+    or a dict of raw values. Rows whose content cannot be built or laid out
+    are logged and skipped. Returns the number of rows in the document.
+    """
+    return render_workbook_pdf([(None, rows)], output, theme, bookmarks, on_result)
+
+def render_workbook_pdf(sections, output, theme=None, bookmarks=True, on_result=None):
+    """
+    Render (sheet_name, rows) sections into a single PDF, like
+    render_combined_pdf. The row bookmarks of a named section are nested
+    under a bookmark for its sheet. Rows are built, checked and laid out one
+    at a time, so memory does not grow with the number of rows. on_result,
+    when given, is called with a RenderResult for every row, failed or not,
+    without PDF data. Returns the number of rows in the document.
+    """
+    from .rendering import RenderResult
+
+    theme = theme or get_report_theme()
+    current_time = datetime.now(pytz.UTC).astimezone(theme.timezone)
+    on_result = on_result or (lambda result: None)
+    row_count = 0
+
+    def iter_row_flowables():
+        nonlocal row_count
+        for section, (sheet_name, rows) in enumerate(sections):
+            section_started = False
+            for row_number, row_data in rows:
+                start = time.perf_counter()
+                if isinstance(row_data, dict):
+                    fields, values = list(row_data.keys()), [str(value) for value in row_data.values()]
+                else:
+                    fields, values = row_data
+                try:
+                    row_story = build_report_story(fields, values, theme, current_time)
+                except Exception as e:
+                    logger.error(f"Error creating PDF for row {row_number}: {str(e)}")
+                    on_result(RenderResult(row_number, None, str(e), time.perf_counter() - start))
+                    continue
+
+                flowables = []
+                if row_count:
+                    flowables.extend([NextPageTemplate('report'), PageBreak()])
+                if bookmarks and sheet_name is None:
+                    flowables.append(RowBookmark(f'row_{row_number}', f'Row {row_number}'))
+                elif bookmarks:
+                    if not section_started:
+                        flowables.append(RowBookmark(f'sheet_{section}', sheet_name))
+                    flowables.append(RowBookmark(f'sheet_{section}_row_{row_number}', f'Row {row_number}', level=1))
+                section_started = True
+                flowables.extend(row_story)
+                row_count += 1
+                # Resumed once ReportLab has laid the row out
+                yield flowables
+                on_result(RenderResult(row_number, None, None, time.perf_counter() - start))
+
+    row_flowables = iter_row_flowables()
+    story = next(row_flowables, None)
+    if story is None:
+        doc = theme.template.doc_template(output, first_page='continuation', shared=True)
+        story = [Paragraph("No rows to report", theme.styles['CustomBodyText'])]
+    else:
+        doc = theme.template.doc_template(output, shared=True, row_flowables=row_flowables)
+    doc.build(story)
+    return row_count
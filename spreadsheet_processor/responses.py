@@ -0,0 +1,95 @@
+import os
+import re
+
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import quote_etag
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+class UnsatisfiableRange(ValueError):
+    """A byte range that lies entirely beyond the end of the file"""
+
+def report_etag(key, report_format):
+    """
+    ETag of a report download: its cache key (the spreadsheet contents, theme
+    version, selection and sheets, see cache.archive_cache_key) and format
+    """
+    return quote_etag(f'{key}.{report_format}')
+
+def parse_byte_range(header, size):
+    """
+    The inclusive (start, end) byte range asked for by a Range header, or
+    None to send the whole file: without a header, and for multiple ranges,
+    other units or malformed values, which may be ignored. Raises
+    UnsatisfiableRange for a range that starts beyond the end of the file.
+    """
+    match = _RANGE_RE.match((header or '').strip())
+    if match is None or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        # A suffix range: the last `last` bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise UnsatisfiableRange(header)
+        return max(size - length, 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise UnsatisfiableRange(header)
+    end = min(int(last), size - 1) if last else size - 1
+    return start, end
+
+def iter_file_range(file, start, length, chunk_size=64 * 1024):
+    """Yield length bytes of a file from start on, closing the file at the end"""
+    try:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+def archive_response(request, archive, content_type, filename, etag, accel_redirect=None):
+    """
+    Serve a report archive that is materialized on disk. With an
+    accel_redirect path, nginx is asked to send the file itself (see
+    REPORT_CACHE_ACCEL_REDIRECT). Otherwise a single Range is honoured, so an
+    interrupted download can be resumed, unless an If-Range validator does
+    not match the ETag.
+    """
+    if accel_redirect is not None:
+        archive.close()
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = accel_redirect
+    else:
+        size = os.fstat(archive.fileno()).st_size
+        byte_range = None
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if if_range is None or if_range.strip() == etag:
+            try:
+                byte_range = parse_byte_range(request.META.get('HTTP_RANGE'), size)
+            except UnsatisfiableRange:
+                archive.close()
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{size}'
+                return response
+
+        if byte_range is None:
+            response = FileResponse(archive, content_type=content_type)
+        else:
+            start, end = byte_range
+            response = StreamingHttpResponse(
+                iter_file_range(archive, start, end - start + 1), status=206, content_type=content_type
+            )
+            response['Content-Length'] = str(end - start + 1)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Accept-Ranges'] = 'bytes'
+
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['ETag'] = etag
+    return response
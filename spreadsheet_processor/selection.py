@@ -0,0 +1,195 @@
+import hashlib
+import re
+
+import numpy as np
+import pandas as pd
+
+# `column operator value`; two-character operators come first so '>=' is not read as '>'
+_FILTER_RE = re.compile(
+    r'^\s*(?P<column>.+?)\s*(?P<operator>==|!=|>=|<=|>|<|\scontains\s)\s*(?P<value>.*?)\s*$'
+)
+
+class SelectionError(ValueError):
+    """A row selection that cannot be parsed or applied"""
+
+class ColumnFilter:
+    """
+    A `column operator value` condition, e.g. `Age >= 30` or `Name contains
+    smith`. The value is compared as a number, date or boolean when the column
+    has that type and as text otherwise; `contains` is a case-insensitive
+    substring match on the text. Missing cells never match.
+    """
+    def __init__(self, expression):
+        match = _FILTER_RE.match(expression)
+        if match is None:
+            raise SelectionError(f"Invalid filter: {expression}")
+        self.expression = expression.strip()
+        self.column = match.group('column')
+        self.operator = match.group('operator').strip()
+        self.value = match.group('value')
+
+    def _value_for(self, column):
+        """The filter value converted to the type of a column"""
+        kind = column.dtype.kind
+        try:
+            if kind == 'b':
+                if self.value.lower() not in ('true', 'false'):
+                    raise ValueError(self.value)
+                return self.value.lower() == 'true'
+            if kind in 'iuf':
+                return float(self.value)
+            if kind == 'M':
+                return pd.Timestamp(self.value)
+        except ValueError:
+            raise SelectionError(f"Invalid value for column {self.column}: {self.value}")
+        return self.value
+
+    def mask(self, df):
+        """Boolean array of the rows of df that match the filter"""
+        if self.column not in df.columns:
+            raise SelectionError(f"Unknown column: {self.column}")
+        column = df[self.column]
+        present = column.notna().to_numpy()
+
+        if self.operator == 'contains':
+            text = column.astype(str).str.lower()
+            return present & text.str.contains(self.value.lower(), regex=False).to_numpy()
+
+        value = self._value_for(column)
+        if isinstance(value, str):
+            column = column.astype(str)
+        matches = {
+            '==': column.__eq__,
+            '!=': column.__ne__,
+            '>=': column.__ge__,
+            '<=': column.__le__,
+            '>': column.__gt__,
+            '<': column.__lt__,
+        }[self.operator](value)
+        return present & matches.to_numpy(dtype=bool)
+
+class RowSelection:
+    """
+    Which rows and columns of a sheet to render:
+
+        rows     1-based row numbers and inclusive ranges, e.g. "1-10,15"
+        columns  column names to keep, in the order given
+        filters  ColumnFilter expressions that every row must match
+
+    Row numbers always refer to the full sheet, so `row_15.pdf` is the same
+    row whether or not the other rows are selected.
+    """
+    def __init__(self, rows=None, columns=None, filters=None):
+        self.row_ranges = parse_row_ranges(rows) if rows else None
+        self.columns = list(columns or [])
+        self.filters = [ColumnFilter(expression) for expression in filters or []]
+
+    @classmethod
+    def from_request(cls, request):
+        """
+        Build the selection from the `rows`, `columns` and `filter` parameters
+        of a request (POST or GET). `columns` may be repeated or comma-separated
+        and `filter` may be repeated or hold one expression per line. Returns
+        None when nothing is selected.
+        """
+        params = request.POST if request.method == 'POST' else request.GET
+        rows = params.get('rows', '').strip()
+        columns = [
+            name.strip()
+            for value in params.getlist('columns')
+            for name in value.split(',')
+            if name.strip()
+        ]
+        filters = [
+            line.strip()
+            for value in params.getlist('filter')
+            for line in value.splitlines()
+            if line.strip()
+        ]
+        if not (rows or columns or filters):
+            return None
+        return cls(rows, columns, filters)
+
+    @property
+    def single_row(self):
+        """The row number when exactly one row was asked for, else None"""
+        if self.row_ranges and len(self.row_ranges) == 1:
+            start, end = self.row_ranges[0]
+            if start == end:
+                return start
+        return None
+
+    @property
+    def last_row(self):
+        """The highest row number that can be selected, or None for no limit"""
+        if not self.row_ranges:
+            return None
+        return max(end for _, end in self.row_ranges)
+
+    def cache_key(self):
+        """Hash of the selection, for cache keys"""
+        text = repr((self.row_ranges, self.columns, [f.expression for f in self.filters]))
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    @property
+    def named_columns(self):
+        """The columns the selection refers to, filtered on or kept"""
+        return list(dict.fromkeys([f.column for f in self.filters] + self.columns))
+
+    def check(self, df):
+        """
+        Raise SelectionError unless the selection can be applied to df: every
+        named column exists and every filter value converts to the type of its
+        column. Only the columns and dtypes of df are used, so it may be empty.
+        """
+        unknown = [name for name in self.named_columns if name not in df.columns]
+        if unknown:
+            raise SelectionError(f"Unknown column: {unknown[0]}")
+        for column_filter in self.filters:
+            if column_filter.operator != 'contains':
+                column_filter._value_for(df[column_filter.column])
+
+    def apply(self, df, first_row_number=1):
+        """
+        Return (frame, row_numbers) with the selected rows and columns of df,
+        where df holds consecutive rows starting at first_row_number.
+        """
+        self.check(df)
+
+        row_numbers = np.arange(first_row_number, first_row_number + len(df))
+        mask = np.ones(len(df), dtype=bool)
+        if self.row_ranges:
+            in_ranges = np.zeros(len(df), dtype=bool)
+            for start, end in self.row_ranges:
+                in_ranges |= (row_numbers >= start) & (row_numbers <= end)
+            mask &= in_ranges
+        for column_filter in self.filters:
+            if not mask.any():
+                break
+            mask &= column_filter.mask(df)
+
+        if self.columns:
+            df = df[self.columns]
+        if not mask.all():
+            df = df[mask]
+        return df, row_numbers[mask]
+
+def parse_row_ranges(text):
+    """Parse "1-10,15,20-25" into a sorted list of inclusive (start, end) ranges"""
+    ranges = []
+    for part in text.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        start, separator, end = part.partition('-')
+        try:
+            start = int(start)
+            end = int(end) if separator else start
+        except ValueError:
+            raise SelectionError(f"Invalid row range: {part}")
+        if start < 1 or end < start:
+            raise SelectionError(f"Invalid row range: {part}")
+        ranges.append((start, end))
+    if not ranges:
+        raise SelectionError(f"Invalid row range: {text}")
+    return sorted(ranges)
@@ -0,0 +1,70 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+# Bump when the on-disk layout changes; older snapshots are then rebuilt
+SNAPSHOT_VERSION = 1
+
+def snapshot_name_for(file_name, sheet_index=0):
+    """Storage name of the snapshot directory of a sheet, kept next to the uploaded file"""
+    if sheet_index:
+        return f'{file_name}.sheet{sheet_index}.snapshot'
+    return f'{file_name}.snapshot'
+
+def _column_array(series):
+    """Return (kind, array) for a column; native dtypes can be memory-mapped"""
+    dtype = series.dtype
+    if isinstance(dtype, np.dtype) and dtype.kind in 'biufcM':
+        return 'native', series.to_numpy()
+    return 'object', series.to_numpy(dtype=object)
+
+def write_snapshot(df, path):
+    """
+    Write a DataFrame as a columnar snapshot directory: one .npy file per
+    column plus a meta.json. Numeric, boolean and datetime columns are stored
+    in their native dtype so they can be memory-mapped when read back; other
+    columns are stored as pickled object arrays.
+    """
+    tmp_path = f'{path}.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    kinds = []
+    for position in range(df.shape[1]):
+        kind, array = _column_array(df.iloc[:, position])
+        np.save(os.path.join(tmp_path, f'col_{position}.npy'), array, allow_pickle=(kind == 'object'))
+        kinds.append(kind)
+    np.save(os.path.join(tmp_path, 'columns.npy'), np.array(list(df.columns), dtype=object), allow_pickle=True)
+
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as meta_file:
+        json.dump({
+            'version': SNAPSHOT_VERSION,
+            'rows': int(df.shape[0]),
+            'kinds': kinds,
+        }, meta_file)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+def read_snapshot(path):
+    """Load a snapshot written by write_snapshot, memory-mapping native columns"""
+    with open(os.path.join(path, 'meta.json')) as meta_file:
+        meta = json.load(meta_file)
+    if meta.get('version') != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {meta.get('version')}")
+
+    columns = np.load(os.path.join(path, 'columns.npy'), allow_pickle=True)
+    data = {}
+    for position, kind in enumerate(meta['kinds']):
+        column_path = os.path.join(path, f'col_{position}.npy')
+        if kind == 'native':
+            data[position] = np.load(column_path, mmap_mode='r')
+        else:
+            data[position] = np.load(column_path, allow_pickle=True)
+
+    df = pd.DataFrame(data, index=pd.RangeIndex(meta['rows']), copy=False)
+    df.columns = pd.Index(list(columns), dtype=object)
+    return df
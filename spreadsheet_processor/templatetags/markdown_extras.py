@@ -1,9 +1,10 @@
 from django import template
-import markdown
+
+from ..markdown_reports import render_markdown
 
 register = template.Library()
 
 @register.filter(name='markdown')
 def markdown_filter(value):
     """Convert markdown content to HTML"""
-    return markdown.markdown(value, extensions=['extra', 'nl2br', 'sane_lists']) 
\ No newline at end of file
+    return render_markdown(value)
@@ -1,14 +1,93 @@
-from django.test import TestCase, Client
+from django.test import TestCase, Client, RequestFactory, override_settings
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.urls import reverse
+from django.utils import timezone
+from django.db.models import F
+from django.core.files.storage import FileSystemStorage
 from django.core.files.uploadedfile import SimpleUploadedFile
-from .models import Spreadsheet
+from unittest import mock
+from datetime import datetime
+import datetime as dt
+from .models import Spreadsheet, ReportJob
+from .jobs import JobProgress, claim_next_job, enqueue_report_job, run_report_job
+from .batch import generate_reports, spreadsheet_source
+from .rendering import render_rows
+from .archive import ZipCompression, iter_zip_stream, write_zip
+from .reports import (
+    ReportTheme, build_report_story, fit_row_cells, generate_pdf_report, get_report_theme,
+    render_combined_pdf, render_report_pdf
+)
+from reportlab.platypus import Table
+from .cache import ReportCache, archive_cache_key, get_report_cache
+from .snapshots import read_snapshot, write_snapshot
+from .readers import iter_xlsx_rows
+from .preparation import PreparedRow, prepare_rows
+from .rendering import render_row, row_content_hash
+from . import metrics
+from .selection import RowSelection, SelectionError
+from .markdown_reports import clear_markdown_cache, render_markdown, render_markdown_reports
+from .templatetags.markdown_extras import markdown_filter
+from .responses import UnsatisfiableRange, parse_byte_range
+from .validation import EmptySpreadsheetError, SpreadsheetValidationError, validate_xlsx
+from .uploads import uploaded_content_hash
+import hashlib
+import html
+import json
+import logging
+import openpyxl
+import os
 import pandas as pd
+import numpy as np
 import io
 import zipfile
 import markdown
+import pytz
+import shutil
+import subprocess
+import sys
+import tempfile
 
-class SpreadsheetProcessorTests(TestCase):
+
+class TempMediaMixin:
+    """
+    Store files written during a test in a temporary MEDIA_ROOT, and keep
+    the report_pipeline log lines of runs out of the test output
+    """
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            REPORT_METRICS_DIR=os.path.join(self.media_root, 'metrics')
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        metrics_logger = logging.getLogger('spreadsheet_processor.metrics')
+        self.addCleanup(metrics_logger.setLevel, metrics_logger.level)
+        metrics_logger.setLevel(logging.WARNING)
+
+    def xlsx_bytes(self, df):
+        """The xlsx file of a DataFrame, or of a dict of DataFrames by sheet name"""
+        sheets = {'Sheet1': df} if isinstance(df, pd.DataFrame) else df
+        excel_file = io.BytesIO()
+        with pd.ExcelWriter(excel_file, engine='openpyxl') as writer:
+            for sheet_name, sheet in sheets.items():
+                sheet.to_excel(writer, sheet_name=sheet_name, index=False)
+        return excel_file.getvalue()
+
+    def create_spreadsheet(self, df, name='test.xlsx', **fields):
+        """A processed Spreadsheet stored with the xlsx file of df (see xlsx_bytes)"""
+        fields.setdefault('processed', True)
+        return Spreadsheet.objects.create(file=SimpleUploadedFile(name, self.xlsx_bytes(df)), **fields)
+
+
+@override_settings(REPORT_METRICS_ENABLED=False)
+class SpreadsheetProcessorTests(TempMediaMixin, TestCase):
     def setUp(self):
+        super().setUp()
         self.client = Client()
         self.upload_url = reverse('upload_spreadsheet')
         self.spreadsheet_list_url = reverse('spreadsheet_list')
@@ -115,7 +194,7 @@ class SpreadsheetProcessorTests(TestCase):
         )
         
         # Verify ZIP file contents
-        zip_buffer = io.BytesIO(response.content)
+        zip_buffer = io.BytesIO(response.getvalue())
         with zipfile.ZipFile(zip_buffer, 'r') as zip_file:
             # Should contain 2 PDFs (one for each row, excluding header)
             self.assertEqual(len(zip_file.namelist()), 2)
@@ -130,3 +209,1438 @@ class SpreadsheetProcessorTests(TestCase):
         messages = list(response.context['messages'])
         self.assertEqual(len(messages), 1)
         self.assertEqual(str(messages[0]), 'Spreadsheet not found')
+
+
+class FixedDatetime(datetime):
+    """datetime whose now() is pinned so report timestamps are reproducible"""
+    @classmethod
+    def now(cls, tz=None):
+        return datetime(2025, 1, 1, 12, 0, tzinfo=pytz.UTC)
+
+
+class RenderEngineTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.rows = [
+            (index + 1, {'Name': f'Person {index}', 'Age': 20 + index, 'Notes': float('nan')})
+            for index in range(7)
+        ]
+
+    @mock.patch('reportlab.rl_config.invariant', 1)
+    @mock.patch('spreadsheet_processor.reports.datetime', FixedDatetime)
+    def test_process_pool_matches_serial_output(self):
+        """Test that pooled rendering returns the serial PDFs in row order"""
+        serial = list(render_rows(self.rows, workers=1, chunk_size=3))
+        pooled = list(render_rows(self.rows, workers=2, chunk_size=3))
+        self.assertEqual([r.row_number for r in pooled], list(range(1, 8)))
+        self.assertEqual(
+            [r.pdf_data for r in serial],
+            [r.pdf_data for r in pooled]
+        )
+
+    def test_report_theme_is_shared(self):
+        """Test that reports reuse one theme per process and render with an explicit one"""
+        self.assertIs(get_report_theme(), get_report_theme())
+        pdf_data = generate_pdf_report({'Name': 'John Doe'}, 1, theme=ReportTheme())
+        self.assertTrue(pdf_data.startswith(b'%PDF'))
+
+    def test_render_errors_are_reported_per_row(self):
+        """Test that a failing row yields an error result without stopping the others"""
+        rows = [(1, {'Name': 'ok'}), (2, {'Name': '<para><b>unclosed'}), (3, {'Name': 'ok'})]
+        results = list(render_rows(rows, workers=2, chunk_size=1))
+        self.assertEqual([r.row_number for r in results], [1, 2, 3])
+        self.assertIsNotNone(results[0].pdf_data)
+        self.assertIsNone(results[1].pdf_data)
+        self.assertIsNotNone(results[1].error)
+        self.assertIsNotNone(results[2].pdf_data)
+
+    @override_settings(REPORT_RENDER_WORKERS=2, REPORT_RENDER_CHUNK_SIZE=1)
+    def test_download_with_process_pool(self):
+        """Test downloading reports with the process pool enabled"""
+        df = pd.DataFrame({'Name': [f'Person {i}' for i in range(5)]})
+        spreadsheet = self.create_spreadsheet(df, 'pool.xlsx')
+        response = self.client.get(reverse('download_spreadsheet_reports', args=[spreadsheet.id]))
+        self.assertEqual(response.status_code, 200)
+        with zipfile.ZipFile(io.BytesIO(response.getvalue()), 'r') as zip_file:
+            self.assertEqual(
+                zip_file.namelist(),
+                [f'row_{i}.pdf' for i in range(1, 6)]
+            )
+
+
+class StreamingDownloadTests(TempMediaMixin, TestCase):
+    def test_zip_stream_is_lazy(self):
+        """Test that each entry is yielded before the next one is produced"""
+        produced = []
+
+        def entries():
+            for index in range(3):
+                produced.append(index)
+                yield f'row_{index + 1}.pdf', b'%PDF-' + bytes([index]) * 1000
+
+        stream = iter_zip_stream(entries())
+        first = next(stream)
+        self.assertTrue(first.startswith(b'PK\x03\x04'))
+        self.assertEqual(produced, [0])
+
+        archive = first + b''.join(stream)
+        with zipfile.ZipFile(io.BytesIO(archive), 'r') as zip_file:
+            self.assertEqual(zip_file.namelist(), ['row_1.pdf', 'row_2.pdf', 'row_3.pdf'])
+            self.assertEqual(zip_file.read('row_2.pdf'), b'%PDF-' + b'\x01' * 1000)
+
+    @override_settings(REPORT_DOWNLOAD_STREAMING=True)
+    def test_download_streaming_response(self):
+        """Test downloading reports as a streamed ZIP"""
+        df = pd.DataFrame({'Name': ['John Doe', 'Jane Smith'], 'Age': [30, 25]})
+        spreadsheet = self.create_spreadsheet(df, 'stream.xlsx')
+        response = self.client.get(reverse('download_spreadsheet_reports', args=[spreadsheet.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertEqual(
+            response['Content-Disposition'],
+            f'attachment; filename="spreadsheet_{spreadsheet.id}_reports.zip"'
+        )
+        archive = b''.join(response.streaming_content)
+        with zipfile.ZipFile(io.BytesIO(archive), 'r') as zip_file:
+            self.assertEqual(zip_file.namelist(), ['row_1.pdf', 'row_2.pdf'])
+            self.assertIsNone(zip_file.testzip())
+
+
+class ReportJobTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+
+        df = pd.DataFrame({'Name': ['John Doe', 'Jane Smith', 'Max Mustermann'], 'Age': [30, 25, 41]})
+        self.spreadsheet = self.create_spreadsheet(df, 'jobs.xlsx')
+
+    def test_enqueue_and_process_job(self):
+        """Test queueing a job, running the worker and downloading the artifact"""
+        response = self.client.post(reverse('enqueue_report_generation', args=[self.spreadsheet.id]))
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()['job_id']
+        self.assertEqual(response.json()['status'], ReportJob.STATUS_PENDING)
+
+        download_url = reverse('download_report_job', args=[job_id])
+        self.assertEqual(self.client.get(download_url).status_code, 409)
+
+        call_command('run_report_worker', '--once', stdout=io.StringIO())
+
+        status = self.client.get(reverse('report_job_status', args=[job_id])).json()
+        self.assertEqual(status['status'], ReportJob.STATUS_COMPLETED)
+        self.assertEqual(status['total_rows'], 3)
+        self.assertEqual(status['processed_rows'], 3)
+        self.assertEqual(status['failed_rows'], 0)
+        self.assertEqual(status['progress'], 100.0)
+        self.assertEqual(status['download_url'], download_url)
+
+        response = self.client.get(download_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archive = b''.join(response.streaming_content)
+        with zipfile.ZipFile(io.BytesIO(archive), 'r') as zip_file:
+            self.assertEqual(zip_file.namelist(), ['row_1.pdf', 'row_2.pdf', 'row_3.pdf'])
+
+    def test_failed_job(self):
+        """Test that a job for an unreadable file is marked as failed"""
+        spreadsheet = Spreadsheet.objects.create(
+            file=SimpleUploadedFile('broken.xlsx', b'not an excel file'),
+            processed=True
+        )
+        job = ReportJob.objects.create(spreadsheet=spreadsheet)
+        call_command('run_report_worker', '--once', stdout=io.StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.status, ReportJob.STATUS_FAILED)
+        self.assertTrue(job.error)
+
+    @override_settings(REPORT_JOB_STALE_AFTER=60, REPORT_JOB_MAX_ATTEMPTS=2)
+    def test_stale_running_jobs_are_reclaimed(self):
+        """Test that jobs of a crashed worker are queued again, and failed after too many attempts"""
+        stale = timezone.now() - dt.timedelta(minutes=5)
+        retried = ReportJob.objects.create(
+            spreadsheet=self.spreadsheet, status=ReportJob.STATUS_RUNNING,
+            started_at=stale, heartbeat_at=stale, attempts=1, processed_rows=2
+        )
+        exhausted = ReportJob.objects.create(
+            spreadsheet=self.spreadsheet, status=ReportJob.STATUS_RUNNING,
+            started_at=stale, heartbeat_at=stale, attempts=2
+        )
+        alive = ReportJob.objects.create(
+            spreadsheet=self.spreadsheet, status=ReportJob.STATUS_RUNNING,
+            started_at=stale, heartbeat_at=timezone.now(), attempts=1
+        )
+
+        with self.assertLogs('spreadsheet_processor.jobs', 'WARNING'):
+            job = claim_next_job()
+        self.assertEqual(job.id, retried.id)
+        self.assertEqual((job.status, job.attempts, job.processed_rows), (ReportJob.STATUS_RUNNING, 2, 0))
+        exhausted.refresh_from_db()
+        self.assertEqual(exhausted.status, ReportJob.STATUS_FAILED)
+        self.assertTrue(exhausted.error)
+        alive.refresh_from_db()
+        self.assertEqual(alive.status, ReportJob.STATUS_RUNNING)
+
+    def test_superseded_run_keeps_nothing(self):
+        """Test that a run whose job was reclaimed and claimed again neither finishes the job nor leaves a file"""
+        from django.db.models.fields.files import FieldFile
+
+        enqueue_report_job(self.spreadsheet)
+        job = claim_next_job()
+        save_artifact = FieldFile.save
+
+        def taken_over(field_file, *args, **kwargs):
+            save_artifact(field_file, *args, **kwargs)
+            # Another worker reclaims and claims the job while this run saves its artifact
+            ReportJob.objects.filter(id=job.id).update(attempts=F('attempts') + 1)
+
+        with mock.patch.object(FieldFile, 'save', autospec=True, side_effect=taken_over):
+            run_report_job(job)
+        self.assertEqual((job.status, job.attempts, job.artifact.name), (ReportJob.STATUS_RUNNING, 2, ''))
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'reports')), [])
+
+        # Taken over before the artifact is written: the run stops at its next progress update
+        stale = ReportJob.objects.get(id=job.id)
+        stale.attempts = 1
+        with self.assertLogs('spreadsheet_processor.jobs', 'WARNING'):
+            run_report_job(stale)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (ReportJob.STATUS_RUNNING, 2))
+
+    @override_settings(REPORT_JOB_HEARTBEAT_INTERVAL=0)
+    def test_job_heartbeats_while_reading_and_archiving(self):
+        """Test that a running job writes heartbeats while its sheets are read and its ZIP is written"""
+        enqueue_report_job(self.spreadsheet)
+        job = claim_next_job()
+        with mock.patch.object(JobProgress, 'save', autospec=True, side_effect=JobProgress.save) as save:
+            run_report_job(job)
+        self.assertEqual(job.status, ReportJob.STATUS_COMPLETED)
+        # One per sheet read, the total, one per ZIP entry and the final counters
+        self.assertEqual(save.call_count, 1 + 1 + 3 + 1)
+
+    def test_job_endpoints_not_found(self):
+        """Test the job endpoints for missing spreadsheets and jobs"""
+        self.assertEqual(self.client.post(reverse('enqueue_report_generation', args=[999])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('report_job_status', args=[999])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('download_report_job', args=[999])).status_code, 404)
+
+
+class ReportCacheTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        df = pd.DataFrame({'Name': ['John Doe', 'Jane Smith'], 'Age': [30, 25]})
+        self.spreadsheet = self.create_spreadsheet(df, 'cached.xlsx')
+        self.download_url = reverse('download_spreadsheet_reports', args=[self.spreadsheet.id])
+
+    def test_repeat_download_served_from_cache(self):
+        """Test that a second download is served from the cached archive without rendering"""
+        first = self.client.get(self.download_url)
+        self.assertEqual(first.status_code, 200)
+        archive = first.getvalue()
+
+        cache = get_report_cache()
+        key = archive_cache_key(self.spreadsheet)
+        self.assertTrue(cache.archive_path(key).exists())
+        cached_rows = [name for _, _, names in os.walk(cache.row_dir()) for name in names]
+        self.assertEqual(len(cached_rows), 2)
+
+        with mock.patch('spreadsheet_processor.pipeline.load_dataframe') as load_dataframe:
+            second = self.client.get(self.download_url)
+            load_dataframe.assert_not_called()
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second['Content-Type'], 'application/zip')
+        self.assertEqual(
+            second['Content-Disposition'],
+            f'attachment; filename="spreadsheet_{self.spreadsheet.id}_reports.zip"'
+        )
+        self.assertEqual(second.getvalue(), archive)
+
+    @override_settings(REPORT_DOWNLOAD_STREAMING=True)
+    def test_streamed_download_is_cached(self):
+        """Test that a completely streamed archive is stored in the cache"""
+        response = self.client.get(self.download_url)
+        archive = b''.join(response.streaming_content)
+        cache = get_report_cache()
+        with cache.open_archive(archive_cache_key(self.spreadsheet)) as cached:
+            self.assertEqual(cached.read(), archive)
+
+    @override_settings(REPORT_CACHE_ENABLED=False)
+    def test_cache_disabled(self):
+        """Test that nothing is cached when the cache is disabled"""
+        response = self.client.get(self.download_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'report_cache')))
+
+    def test_lru_eviction(self):
+        """Test that the least recently used archives are evicted first"""
+        cache = ReportCache(os.path.join(self.media_root, 'lru'), max_bytes=10000)
+        for index, key in enumerate(['a', 'b', 'c']):
+            cache.store_archive(key, lambda f: f.write(b'x' * 1000)).close()
+            os.utime(cache.archive_path(key), (index, index))
+        cache.open_archive('a').close()
+        self.assertEqual(cache.enforce_limit(2500), 1)
+        self.assertTrue(cache.archive_path('a').exists())
+        self.assertFalse(cache.archive_path('b').exists())
+        self.assertTrue(cache.archive_path('c').exists())
+
+    def test_stores_walk_the_cache_only_over_the_limit(self):
+        """Test that stores keep a running size and only walk the cache when it is over the limit"""
+        cache = ReportCache(os.path.join(self.media_root, 'running'), max_bytes=2500)
+        with mock.patch.object(ReportCache, '_entries', autospec=True, side_effect=ReportCache._entries) as entries:
+            for key in ['a', 'b']:
+                cache.store_archive(key, lambda f: f.write(b'x' * 1000)).close()
+            self.assertEqual(entries.call_count, 1)
+            cache.store_archive('c', lambda f: f.write(b'x' * 1000)).close()
+            self.assertEqual(entries.call_count, 2)
+        self.assertLessEqual(cache.size(), 2500)
+
+    @override_settings(REPORT_CACHE_MAX_BYTES=1)
+    def test_row_stores_count_toward_the_limit(self):
+        """Test that storing row PDFs evicts least recently used files over the limit"""
+        row_dir = get_report_cache().row_dir()
+        render_row(1, PreparedRow(['Name'], ['John Doe']), row_dir)
+        render_row(2, PreparedRow(['Name'], ['Jane Smith']), row_dir)
+        cached_rows = [name for _, _, names in os.walk(row_dir) for name in names]
+        self.assertEqual(cached_rows, [])
+
+    def test_row_cache_hit_marks_row_as_used(self):
+        """Test that reading a row PDF from the cache refreshes its mtime"""
+        row_dir = get_report_cache().row_dir()
+        row = PreparedRow(['Name'], ['John Doe'])
+        render_row(1, row, row_dir)
+        content_hash = row_content_hash(row)
+        path = os.path.join(row_dir, content_hash[:2], f'{content_hash}.pdf')
+        os.utime(path, (0, 0))
+        self.assertIsNone(render_row(1, row, row_dir).seconds)
+        self.assertGreater(os.path.getmtime(path), 0)
+
+    def test_purge_command(self):
+        """Test purging the report cache with the management command"""
+        self.client.get(self.download_url)
+        call_command('purge_report_cache', stdout=io.StringIO())
+        self.assertFalse(os.path.exists(get_report_cache().root))
+
+
+class ConditionalDownloadTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        df = pd.DataFrame({'Name': [f'Person {i}' for i in range(5)]})
+        self.spreadsheet = self.create_spreadsheet(df, 'conditional.xlsx')
+        self.download_url = reverse('download_spreadsheet_reports', args=[self.spreadsheet.id])
+
+    def test_etag_and_not_modified(self):
+        """Test that downloads carry a content-derived ETag and a matching If-None-Match gets a 304"""
+        first = self.client.get(self.download_url)
+        etag = first['ETag']
+        self.assertIn(archive_cache_key(self.spreadsheet), etag)
+        self.assertNotEqual(self.client.get(self.download_url, {'format': 'pdf'})['ETag'], etag)
+        self.assertNotEqual(self.client.get(self.download_url, {'rows': '1-2'})['ETag'], etag)
+
+        with mock.patch('spreadsheet_processor.pipeline.load_dataframe') as load_dataframe:
+            response = self.client.get(self.download_url, HTTP_IF_NONE_MATCH=etag)
+            load_dataframe.assert_not_called()
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        # A new theme version changes the ETag
+        with mock.patch.object(ReportTheme, 'version', 'next'):
+            response = self.client.get(self.download_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_range_requests(self):
+        """Test that cached archives are served in parts for Range requests"""
+        archive = self.client.get(self.download_url).getvalue()
+        etag = self.client.get(self.download_url)['ETag']
+
+        response = self.client.get(self.download_url, HTTP_RANGE='bytes=100-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-{len(archive) - 1}/{len(archive)}')
+        self.assertEqual(b''.join(response.streaming_content), archive[100:])
+
+        response = self.client.get(self.download_url, HTTP_RANGE='bytes=-10', HTTP_IF_RANGE=etag)
+        self.assertEqual(b''.join(response.streaming_content), archive[-10:])
+
+        # A stale validator gets the whole archive
+        response = self.client.get(self.download_url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(b''.join(response.streaming_content), archive)
+
+        response = self.client.get(self.download_url, HTTP_RANGE=f'bytes={len(archive)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(archive)}')
+
+    @override_settings(REPORT_CACHE_ACCEL_REDIRECT='/_report_cache/')
+    def test_accel_redirect(self):
+        """Test that nginx is asked to send cached archives when configured"""
+        response = self.client.get(self.download_url)
+        key = archive_cache_key(self.spreadsheet)
+        self.assertEqual(response['X-Accel-Redirect'], f'/_report_cache/archives/{key}.zip')
+        self.assertEqual(response.content, b'')
+        self.assertTrue(get_report_cache().archive_path(key).exists())
+
+    def test_parse_byte_range(self):
+        """Test the byte ranges that are honoured, ignored and unsatisfiable"""
+        self.assertEqual(parse_byte_range('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(parse_byte_range('bytes=900-5000', 1000), (900, 999))
+        self.assertEqual(parse_byte_range('bytes=-2000', 1000), (0, 999))
+        self.assertIsNone(parse_byte_range(None, 1000))
+        self.assertIsNone(parse_byte_range('bytes=0-1,5-6', 1000))
+        self.assertIsNone(parse_byte_range('bytes=9-1', 1000))
+        with self.assertRaises(UnsatisfiableRange):
+            parse_byte_range('bytes=1000-', 1000)
+
+
+class SnapshotTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.df = pd.DataFrame({
+            'Name': ['John Doe', None, 'Max'],
+            'Age': [30, 25, 41],
+            'Score': [1.5, float('nan'), 3.25],
+            'Joined': pd.to_datetime(['2024-01-01', '2024-02-01', None]),
+            'Active': [True, False, True],
+            'Mixed': [1, 'two', None],
+        })
+        self.excel_bytes = self.xlsx_bytes(self.df)
+
+    def test_snapshot_round_trip(self):
+        """Test that a snapshot reproduces the parsed DataFrame and its rows"""
+        df = pd.read_excel(io.BytesIO(self.excel_bytes), engine='openpyxl')
+        path = os.path.join(self.media_root, 'frame.snapshot')
+        write_snapshot(df, path)
+        loaded = read_snapshot(path)
+        pd.testing.assert_frame_equal(loaded.copy(), df)
+        self.assertIsInstance(loaded['Age'].values, np.memmap)
+        self.assertEqual(
+            [str(row.to_dict()) for _, row in loaded.iterrows()],
+            [str(row.to_dict()) for _, row in df.iterrows()]
+        )
+
+    def test_first_download_saves_snapshot_and_later_downloads_use_it(self):
+        """Test that upload defers parsing and downloads after the first skip the xlsx"""
+        upload = SimpleUploadedFile('snap.xlsx', self.excel_bytes)
+        self.client.post(reverse('upload_spreadsheet'), {'spreadsheet': upload})
+        spreadsheet = Spreadsheet.objects.get()
+        self.assertEqual(spreadsheet.snapshot, '')
+
+        url = reverse('download_spreadsheet_reports', args=[spreadsheet.id])
+        self.client.get(url, {'rows': '1-2'}).getvalue()
+        spreadsheet.refresh_from_db()
+        self.assertTrue(spreadsheet.snapshot.endswith('.snapshot'))
+        self.assertTrue(os.path.isdir(spreadsheet.file.storage.path(spreadsheet.snapshot)))
+
+        with mock.patch('spreadsheet_processor.pipeline.pd.read_excel') as read_excel:
+            response = self.client.get(url)
+            read_excel.assert_not_called()
+        with zipfile.ZipFile(io.BytesIO(response.getvalue()), 'r') as zip_file:
+            self.assertEqual(zip_file.namelist(), ['row_1.pdf', 'row_2.pdf', 'row_3.pdf'])
+
+    def test_snapshot_backfilled_on_first_read(self):
+        """Test that spreadsheets without a snapshot get one on first read"""
+        spreadsheet = Spreadsheet.objects.create(
+            file=SimpleUploadedFile('old.xlsx', self.excel_bytes),
+            processed=True
+        )
+        self.assertEqual(spreadsheet.snapshot, '')
+        self.client.get(reverse('download_spreadsheet_reports', args=[spreadsheet.id]))
+        spreadsheet.refresh_from_db()
+        self.assertTrue(spreadsheet.snapshot)
+
+
+class StreamingReaderTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        workbook = openpyxl.Workbook()
+        sheet = workbook.active
+        sheet.append(['Name', 'Name', None, 'Code', 'Price', 'Joined', 'Active'])
+        sheet.append(['John Doe', 'x', None, '007', 10, dt.datetime(2024, 1, 1), True])
+        sheet.append(['Jane Smith', None, None, '12', 12.5, None, None])
+        sheet.append([None, None, None, None, None, None, None])
+        sheet.append(['Max', 'z', 5, None, 3, dt.datetime(2024, 1, 3, 5, 6), False])
+        sheet.append([None, None, None, None, None, None, None])
+        excel_file = io.BytesIO()
+        workbook.save(excel_file)
+        self.excel_bytes = excel_file.getvalue()
+
+    def expected_rows(self):
+        df = pd.read_excel(io.BytesIO(self.excel_bytes), engine='openpyxl')
+        return [str((index + 1, row.to_dict())) for index, row in df.iterrows()]
+
+    def test_rows_match_read_excel(self):
+        """Test that lazily read rows match row.to_dict() of pd.read_excel"""
+        for block_size in (1, 2, 1000):
+            rows = [str(row) for row in iter_xlsx_rows(io.BytesIO(self.excel_bytes), block_size=block_size)]
+            self.assertEqual(rows, self.expected_rows())
+        self.assertEqual(len(rows), 4)
+
+    def test_late_missing_values_match_read_excel(self):
+        """Test that small blocks type columns for the whole sheet, like pd.read_excel"""
+        workbook = openpyxl.Workbook()
+        sheet = workbook.active
+        sheet.append(['Count', 'Joined', 'Mixed'])
+        sheet.append([1, dt.datetime(2024, 1, 1), 1])
+        sheet.append([2, dt.datetime(2024, 1, 2), 'a'])
+        sheet.append([None, None, None])
+        sheet.append([4, None, 2])
+        sheet.append([5, None, 3])
+        excel_file = io.BytesIO()
+        workbook.save(excel_file)
+        self.excel_bytes = excel_file.getvalue()
+
+        for block_size in (1, 2, 3):
+            rows = [str(row) for row in iter_xlsx_rows(io.BytesIO(self.excel_bytes), block_size=block_size)]
+            self.assertEqual(rows, self.expected_rows())
+        self.assertIn("'Count': 1.0", rows[0])
+        self.assertIn("'Joined': NaT", rows[4])
+
+    def test_rows_are_read_lazily(self):
+        """Test that the reader yields rows before reading the whole sheet"""
+        rows = iter_xlsx_rows(io.BytesIO(self.excel_bytes), block_size=1)
+        row_number, row_data = next(rows)
+        self.assertEqual(row_number, 1)
+        self.assertEqual(row_data['Name'], 'John Doe')
+        self.assertEqual(row_data['Name.1'], 'x')
+        rows.close()
+
+    @override_settings(SPREADSHEET_ROW_READER='streaming')
+    def test_download_with_streaming_reader(self):
+        """Test that downloads can read rows without pd.read_excel"""
+        spreadsheet = Spreadsheet.objects.create(
+            file=SimpleUploadedFile('reader.xlsx', self.excel_bytes),
+            processed=True
+        )
+        with mock.patch('spreadsheet_processor.pipeline.pd.read_excel') as read_excel:
+            response = self.client.get(reverse('download_spreadsheet_reports', args=[spreadsheet.id]))
+            read_excel.assert_not_called()
+        with zipfile.ZipFile(io.BytesIO(response.getvalue()), 'r') as zip_file:
+            self.assertEqual(zip_file.namelist(), ['row_1.pdf', 'row_2.pdf', 'row_3.pdf', 'row_4.pdf'])
+
+
+class RowPreparationTests(TestCase):
+    def assertMatchesIterrows(self, df):
+        expected = [
+            (index + 1, tuple(str(value) for value in row.to_dict().values()))
+            for index, row in df.iterrows()
+        ]
+        prepared = [
+            (row_number, tuple(html.unescape(value) for value in row.values))
+            for row_number, row in prepare_rows(df, block_size=2)
+        ]
+        self.assertEqual(prepared, expected)
+
+    def test_matches_iterrows_for_mixed_frame(self):
+        """Test that column-wise formatting matches str() of iterrows values"""
+        self.assertMatchesIterrows(pd.DataFrame({
+            'Name': ['John Doe', float('nan'), 'Max', float('nan')],
+            'Age': [30, 25, 41, 7],
+            'Score': [1.5, float('nan'), 1e16, float('nan')],
+            'Joined': pd.to_datetime(['2024-01-01 00:00', None, '2024-03-01 10:30', None]),
+            'Active': [True, False, True, False],
+        }))
+
+    def test_matches_iterrows_for_numeric_and_datetime_frames(self):
+        """Test the per-row dtype iterrows applies to homogeneous frames"""
+        self.assertMatchesIterrows(pd.DataFrame({'Age': [30, 25, 41], 'Score': [1.5, float('nan'), 0.1]}))
+        self.assertMatchesIterrows(pd.DataFrame({'Count': [1, 2, 3]}))
+        self.assertMatchesIterrows(pd.DataFrame({
+            'Start': pd.to_datetime(['2024-01-01', None, '2024-01-03']),
+            'End': pd.to_datetime(['2024-01-01 00:00:00.25', None, None]),
+        }))
+
+    def test_matches_iterrows_for_missing_rows(self):
+        """Test rows that iterrows shows as NaT because they only hold missing/date values"""
+        self.assertMatchesIterrows(pd.DataFrame({
+            'Joined': pd.to_datetime(['2024-01-01', None, None]),
+            'Note': [float('nan'), float('nan'), 'a'],
+            'Score': [1.0, float('nan'), float('nan')],
+        }))
+
+    def test_markup_is_escaped(self):
+        """Test that Paragraph markup characters in text cells are escaped and render"""
+        rows = list(prepare_rows(pd.DataFrame({'Note': ['<b>bold & broken', 'plain'], 'Count': [1, 2]})))
+        self.assertEqual(rows[0][1], PreparedRow(['Note', 'Count'], ('&lt;b&gt;bold &amp; broken', '1')))
+        result = render_row(*rows[0])
+        self.assertIsNone(result.error)
+        self.assertTrue(result.pdf_data.startswith(b'%PDF'))
+
+
+class CombinedPdfTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        df = pd.DataFrame({'Name': ['John Doe', 'Jane Smith', 'Ann Lee'], 'Age': [30, 25, 41]})
+        self.spreadsheet = self.create_spreadsheet(df, 'combined.xlsx')
+        self.download_url = reverse('download_spreadsheet_reports', args=[self.spreadsheet.id])
+
+    def test_combined_pdf_has_a_page_and_bookmark_per_row(self):
+        """Test that every row starts a new page with its own outline entry, skipping broken rows"""
+        rows = [(1, {'Name': 'ok'}), (2, {'Name': '<para><b>unclosed'}), (3, PreparedRow(['Name'], ['also ok']))]
+        output = io.BytesIO()
+        self.assertEqual(render_combined_pdf(rows, output), 2)
+        pdf_data = output.getvalue()
+        self.assertTrue(pdf_data.startswith(b'%PDF'))
+        self.assertEqual(pdf_data.count(b'/Type /Page\n'), 2)
+        self.assertIn(b'(Row 1)', pdf_data)
+        self.assertIn(b'(Row 3)', pdf_data)
+
+    def test_rows_too_tall_for_a_page_are_skipped_and_reported(self):
+        """Test that a row that cannot be laid out is skipped, not the whole PDF, and reported"""
+        rows = [
+            (1, {'Name': 'ok'}),
+            (2, {'Name': 'x<br/>' * 150}),
+            (3, PreparedRow(['Name'], ['W' * 1500])),
+            (4, PreparedRow(['Name'], ['also ok'])),
+        ]
+        results = []
+        output = io.BytesIO()
+        self.assertEqual(render_combined_pdf(rows, output, on_result=results.append), 2)
+        self.assertEqual([(r.row_number, r.error is None) for r in results], [(1, True), (2, False), (3, False), (4, True)])
+        self.assertIn('taller than a page', results[2].error)
+        self.assertIn(b'(Row 4)', output.getvalue())
+        self.assertNotIn(b'(Row 2)', output.getvalue())
+
+    def test_rows_laid_out_one_at_a_time(self):
+        """Test that a row is only read once the rows before it are laid out and reported"""
+        events = []
+
+        def rows():
+            for row_number in range(1, 4):
+                events.append(('read', row_number))
+                yield row_number, {'Name': 'x' * 3000}
+
+        output = io.BytesIO()
+        render_combined_pdf(rows(), output, on_result=lambda result: events.append(('done', result.row_number)))
+        self.assertEqual(events, [(event, n) for n in range(1, 4) for event in ('read', 'done')])
+        self.assertEqual(output.getvalue().count(b'/Type /Page\n'), 6)
+
+    @override_settings(REPORT_CACHE_ENABLED=False)
+    def test_pdf_download_counts_failed_rows(self):
+        """Test that the PDF download reports every row, failed ones included, to the metrics"""
+        with mock.patch('spreadsheet_processor.reports.check_row_layout', side_effect=[None, ValueError('bad'), None]):
+            with self.assertLogs('spreadsheet_processor.metrics', 'INFO') as logs:
+                self.client.post(self.download_url, {'format': 'pdf'})
+        line = next(line for line in logs.output if 'report_pipeline' in line)
+        run = json.loads(line.split('report_pipeline ', 1)[1])
+        self.assertEqual((run['rows'], run['failed_rows']), (3, 1))
+
+    def test_download_single_pdf(self):
+        """Test downloading all reports as one PDF, cached for the next download"""
+        response = self.client.post(self.download_url, {'format': 'pdf'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(
+            response['Content-Disposition'],
+            f'attachment; filename="spreadsheet_{self.spreadsheet.id}_reports.pdf"'
+        )
+        pdf_data = response.getvalue()
+        self.assertTrue(pdf_data.startswith(b'%PDF'))
+
+        cache = get_report_cache()
+        key = archive_cache_key(self.spreadsheet)
+        self.assertTrue(cache.archive_path(key, 'pdf').exists())
+        self.assertFalse(cache.archive_path(key).exists())
+        second = self.client.get(self.download_url, {'format': 'pdf'})
+        self.assertEqual(second.getvalue(), pdf_data)
+
+    @override_settings(REPORT_OUTPUT_FORMAT='pdf', REPORT_CACHE_ENABLED=False)
+    def test_default_format_setting(self):
+        """Test that the configured output format is used when none is requested"""
+        response = self.client.post(self.download_url)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(response.content.startswith(b'%PDF'))
+
+    def test_unsupported_format(self):
+        """Test that an unknown output format redirects with an error"""
+        response = self.client.post(self.download_url, {'format': 'docx'}, follow=True)
+        self.assertRedirects(response, reverse('spreadsheet_list'))
+        messages = list(response.context['messages'])
+        self.assertEqual(str(messages[0]), 'Unsupported report format: docx')
+
+
+class ReportTemplateTests(TestCase):
+    @mock.patch('reportlab.rl_config.pageCompression', 0)
+    def test_row_pdf_draws_static_content_directly(self):
+        """Test that a single-row PDF draws the title and header on its page, without a form XObject"""
+        pdf_data = render_report_pdf(['Name', 'Age'], ['John Doe', '30'])
+        self.assertEqual(pdf_data.count(b'/Subtype /Form'), 0)
+        self.assertEqual(pdf_data.count(b'(Report) Tj'), 1)
+
+    @mock.patch('reportlab.rl_config.pageCompression', 0)
+    def test_static_content_once_per_report(self):
+        """Test that the title is shown once per row, also when a row runs over several pages"""
+        pdf_data = render_report_pdf([f'Field {n}' for n in range(80)], ['value'] * 80)
+        self.assertGreater(pdf_data.count(b'/Type /Page\n'), 1)
+        self.assertEqual(pdf_data.count(b'(Report) Tj'), 1)
+
+    @mock.patch('reportlab.rl_config.pageCompression', 0)
+    def test_combined_pdf_shares_one_form(self):
+        """Test that a multi-row PDF stores the static content once and shows it on every row's page"""
+        rows = [(number, PreparedRow(['Name'], [f'Person {number}'])) for number in range(1, 4)]
+        output = io.BytesIO()
+        render_combined_pdf(rows, output)
+        pdf_data = output.getvalue()
+        self.assertEqual(pdf_data.count(b'/Subtype /Form'), 1)
+        self.assertEqual(pdf_data.count(b'(Report) Tj'), 1)
+        self.assertEqual(pdf_data.count(b'/FormXob.ReportStatic Do'), 3)
+
+    @mock.patch('reportlab.rl_config.pageCompression', 0)
+    def test_long_cells_move_to_appendix(self):
+        """Test that cells too long for a page are cut short and shown in full in an appendix"""
+        notes = 'word ' * 1000 + 'fish &amp; chips'
+        theme = ReportTheme()
+        theme.max_appendix_chars = len(html.unescape(notes))
+        pdf_data = render_report_pdf(['Name', 'Notes', 'More'], ['John Doe', notes, notes], theme)
+        self.assertIn(b'full text in appendix A1', pdf_data)
+        self.assertIn(b'(Appendix) Tj', pdf_data)
+        self.assertIn(b'fish & chips', pdf_data)
+        # The second long cell no longer fits in the appendix
+        self.assertIn(b'more characters not shown', pdf_data)
+        self.assertNotIn(b'appendix A2', pdf_data)
+
+    def test_fit_row_cells_escapes_cut_text(self):
+        """Test that cut text is escaped again and never ends inside an entity or a tag"""
+        theme = ReportTheme()
+        theme.max_cell_chars = 10
+        table_rows, appendix = fit_row_cells(['Notes'], ['<b>a</b> &amp; ' * 10], theme)
+        self.assertEqual(table_rows[0][1][0].text, 'a &amp; a &amp; a \u2026')
+        self.assertEqual(len(appendix), 1)
+
+    def test_wide_row_split_into_tables(self):
+        """Test that a row with many fields is laid out as several tables"""
+        theme = ReportTheme()
+        story = build_report_story(
+            [f'Field {n}' for n in range(100)], ['value'] * 100, theme, FixedDatetime.now()
+        )
+        self.assertEqual(sum(isinstance(flowable, Table) for flowable in story), 3)
+
+
+class MarkdownRenderingTests(TestCase):
+    def setUp(self):
+        clear_markdown_cache()
+
+    def test_filter_matches_markdown(self):
+        """Test that the markdown filter gives the same HTML as a fresh converter"""
+        text = "# Title\n\n- **a**: b\nc\n\n| x | y |\n|---|---|\n| 1 | 2 |"
+        expected = markdown.markdown(text, extensions=['extra', 'nl2br', 'sane_lists'])
+        self.assertEqual(markdown_filter(text), expected)
+        # A converter left with state from another document gives the same result
+        render_markdown("Footnote[^1]\n\n[^1]: note")
+        clear_markdown_cache()
+        self.assertEqual(markdown_filter(text), expected)
+
+    @override_settings(MARKDOWN_CACHE_SIZE=2)
+    def test_cache_is_bounded(self):
+        """Test that documents are converted once and the least recently used are evicted"""
+        with mock.patch('markdown.Markdown.convert', autospec=True, side_effect=lambda self, text: text) as convert:
+            for text in ['a', 'b', 'a', 'c', 'a', 'b']:
+                render_markdown(text)
+        self.assertEqual([call.args[1] for call in convert.call_args_list], ['a', 'b', 'c', 'b'])
+
+    def test_batch_reports(self):
+        """Test that the batch API renders the markdown report template for every row"""
+        rows = [
+            (1, {'Name': '<b>John</b>', 'Age': 30}),
+            (2, PreparedRow(['Name', 'Age'], ['Jane &amp; Co', '25'])),
+        ]
+        reports = dict(render_markdown_reports(rows, generated_at=FixedDatetime.now()))
+        self.assertEqual(list(reports), [1, 2])
+        self.assertIn('<h1>Report for Row 1</h1>', reports[1])
+        self.assertIn('&lt;b&gt;John&lt;/b&gt;', reports[1])
+        self.assertIn('<strong>Name</strong>: Jane &amp; Co', reports[2])
+        self.assertIn(row_content_hash(rows[1][1])[:12], reports[2])
+
+
+class StartupImportTests(TestCase):
+    def test_urls_do_not_load_engines(self):
+        """Test that loading the views and templates leaves pandas and ReportLab unimported"""
+        code = (
+            "import os, sys; os.environ['DJANGO_SETTINGS_MODULE'] = 'spreadsheet_project.settings'; "
+            "import django; django.setup(); import spreadsheet_project.urls; "
+            "from django.template import engines; "
+            "engines['django'].engine.get_template('spreadsheet_processor/spreadsheet_list.html'); "
+            "print(sorted(m for m in ('pandas', 'numpy', 'openpyxl', 'reportlab', 'markdown') if m in sys.modules))"
+        )
+        result = subprocess.run(
+            [sys.executable, '-c', code], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+        )
+        self.assertEqual(result.stdout.strip(), '[]')
+
+
+class GenerateReportsCommandTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.input_dir = os.path.join(self.media_root, 'input')
+        self.output_dir = os.path.join(self.media_root, 'output')
+        os.makedirs(os.path.join(self.input_dir, 'nested'))
+        pd.DataFrame({'Name': ['A', 'B', 'C']}).to_excel(
+            os.path.join(self.input_dir, 'people.xlsx'), index=False, engine='openpyxl'
+        )
+        with pd.ExcelWriter(os.path.join(self.input_dir, 'nested', 'book.xlsx'), engine='openpyxl') as writer:
+            pd.DataFrame({'X': [1, 2]}).to_excel(writer, sheet_name='One', index=False)
+            pd.DataFrame({'Y': [3]}).to_excel(writer, sheet_name='Two', index=False)
+
+    def generate(self, *args):
+        stdout = io.StringIO()
+        call_command('generate_reports', *args, '--output-dir', self.output_dir, '--no-row-cache', stdout=stdout)
+        return stdout.getvalue()
+
+    def test_tree_output_resumes(self):
+        """Test that rows of files, directories and spreadsheets are written as PDFs and not rendered twice"""
+        spreadsheet = self.create_spreadsheet(pd.DataFrame({'Name': ['John', 'Jane']}), 'db.xlsx')
+
+        output = self.generate(self.input_dir, str(spreadsheet.id))
+        self.assertIn('8 rows rendered, 0 already written', output)
+        written = sorted(
+            os.path.relpath(os.path.join(directory, name), self.output_dir)
+            for directory, _, names in os.walk(self.output_dir) for name in names
+        )
+        self.assertEqual(written, [
+            'nested/book/One/row_1.pdf', 'nested/book/One/row_2.pdf', 'nested/book/Two/row_1.pdf',
+            'people/row_1.pdf', 'people/row_2.pdf', 'people/row_3.pdf',
+            f'spreadsheet_{spreadsheet.id}/row_1.pdf', f'spreadsheet_{spreadsheet.id}/row_2.pdf',
+        ])
+
+        # An interrupted run leaves some PDFs missing; only those are rendered again
+        os.unlink(os.path.join(self.output_dir, 'people', 'row_2.pdf'))
+        output = self.generate(self.input_dir, str(spreadsheet.id))
+        self.assertIn('1 rows rendered, 7 already written', output)
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, 'people', 'row_2.pdf')))
+
+    def test_zip_output(self):
+        """Test that each workbook gets a ZIP laid out like a download"""
+        self.generate(os.path.join(self.input_dir, 'nested', 'book.xlsx'), '--format', 'zip')
+        with zipfile.ZipFile(os.path.join(self.output_dir, 'book.zip')) as zip_file:
+            self.assertEqual(zip_file.namelist(), ['One/row_1.pdf', 'One/row_2.pdf', 'Two/row_1.pdf'])
+        self.assertEqual(os.listdir(self.output_dir), ['book.zip'])
+
+    def test_unknown_source(self):
+        """Test that missing spreadsheets and paths are reported"""
+        with self.assertRaisesMessage(CommandError, 'Spreadsheet 999 not found'):
+            self.generate('999')
+        with self.assertRaisesMessage(CommandError, 'No spreadsheet, file or directory'):
+            self.generate(os.path.join(self.input_dir, 'missing.xlsx'))
+
+
+class ZipCompressionTests(TestCase):
+    def build_zip(self, entries, compression=None):
+        output = io.BytesIO()
+        write_zip(output, entries, compression)
+        output.seek(0)
+        return zipfile.ZipFile(output)
+
+    def test_stored_and_deflate_modes(self):
+        """Test that entries are stored or deflated as configured"""
+        entries = [('row_1.pdf', b'x' * 1000)]
+        stored = self.build_zip(entries, ZipCompression('stored'))
+        self.assertEqual(stored.infolist()[0].compress_type, zipfile.ZIP_STORED)
+        deflated = self.build_zip(entries, ZipCompression('deflate', level=1))
+        self.assertEqual(deflated.infolist()[0].compress_type, zipfile.ZIP_DEFLATED)
+        self.assertEqual(deflated.read('row_1.pdf'), b'x' * 1000)
+
+    def test_adaptive_mode(self):
+        """Test that the adaptive mode stores entries once deflating stops paying off"""
+        incompressible = [(f'row_{i}.pdf', os.urandom(1000)) for i in range(1, 6)]
+        zip_file = self.build_zip(incompressible, ZipCompression('adaptive', sample_size=2))
+        self.assertEqual(
+            [info.compress_type for info in zip_file.infolist()],
+            [zipfile.ZIP_DEFLATED] * 2 + [zipfile.ZIP_STORED] * 3
+        )
+        self.assertIsNone(zip_file.testzip())
+
+        compressible = [(f'row_{i}.pdf', b'x' * 1000) for i in range(1, 6)]
+        zip_file = self.build_zip(compressible, ZipCompression('adaptive', sample_size=2))
+        self.assertEqual(
+            [info.compress_type for info in zip_file.infolist()],
+            [zipfile.ZIP_DEFLATED] * 5
+        )
+
+    @override_settings(REPORT_ZIP_COMPRESSION='stored')
+    def test_compression_setting(self):
+        """Test that archives use the configured compression, streamed or not"""
+        entries = [('row_1.pdf', b'x' * 1000)]
+        self.assertEqual(self.build_zip(entries).infolist()[0].compress_type, zipfile.ZIP_STORED)
+        streamed = zipfile.ZipFile(io.BytesIO(b''.join(iter_zip_stream(entries))))
+        self.assertEqual(streamed.infolist()[0].compress_type, zipfile.ZIP_STORED)
+
+    def test_unknown_mode(self):
+        """Test that an unknown compression mode is rejected"""
+        with self.assertRaises(ValueError):
+            ZipCompression('brotli')
+
+
+class MetricsTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.enterContext(mock.patch.object(metrics, '_registry', None))
+        df = pd.DataFrame({'Name': ['John Doe', 'Jane Smith', 'Ann Lee']})
+        self.spreadsheet = self.create_spreadsheet(df, 'metrics.xlsx')
+
+    def test_stage_time_goes_to_innermost_stage(self):
+        """Test that nested stages are timed exclusively"""
+        run = metrics.PipelineRun('test')
+        clock = iter([0.0, 1.0, 3.0, 6.0])
+        with mock.patch('spreadsheet_processor.metrics.time.perf_counter', lambda: next(clock)):
+            with run.stage('render'):
+                with run.stage('prepare'):
+                    pass
+        self.assertEqual(run.stage_seconds['render'], 4.0)
+        self.assertEqual(run.stage_seconds['prepare'], 2.0)
+
+    def test_download_is_recorded_and_exposed(self):
+        """Test that a download logs its run and shows up on /metrics/"""
+        download_url = reverse('download_spreadsheet_reports', args=[self.spreadsheet.id])
+        with self.assertLogs('spreadsheet_processor.metrics', level='INFO') as logs:
+            self.client.get(download_url).getvalue()
+        self.assertIn('report_pipeline', logs.output[0])
+        self.assertIn('"rows": 3, "failed_rows": 0', logs.output[0])
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('report_runs_total{kind="download"} 1', body)
+        self.assertIn('report_rows_total{kind="download"} 3', body)
+        self.assertIn('report_row_render_seconds_bucket{le="+Inf"} 3', body)
+        self.assertIn('report_stage_seconds_total{kind="download",stage="render"}', body)
+        self.assertIn('process_peak_rss_bytes', body)
+
+    def test_metrics_of_other_processes_are_merged(self):
+        """Test that /metrics/ adds up the files mirrored by other processes"""
+        other = metrics.new_registry()
+        other['runs']['job'] = 2
+        other['render_buckets'][0] = 5
+        other['render_count'] = 5
+        metrics_dir = metrics.get_metrics_dir()
+        os.makedirs(metrics_dir)
+        # The parent process is alive, so its file is merged
+        with open(os.path.join(metrics_dir, f'{os.getppid()}.json'), 'w') as metrics_file:
+            json.dump(other, metrics_file)
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('report_runs_total{kind="job"} 2', body)
+        self.assertIn('report_row_render_seconds_count 5', body)
+
+    def test_metrics_of_exited_processes_are_dropped(self):
+        """Test that the files of processes that are no longer running are deleted, gauges included"""
+        exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+        exited.wait()
+        other = metrics.new_registry()
+        other['runs']['job'] = 2
+        other['peak_rss_bytes'] = 1234
+        metrics_dir = metrics.get_metrics_dir()
+        os.makedirs(metrics_dir)
+        path = os.path.join(metrics_dir, f'{exited.pid}.json')
+        with open(path, 'w') as metrics_file:
+            json.dump(other, metrics_file)
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertNotIn('report_runs_total{kind="job"}', body)
+        self.assertNotIn(f'pid="{exited.pid}"', body)
+        self.assertFalse(os.path.exists(path))
+
+    @override_settings(REPORT_METRICS_ENABLED=False)
+    def test_metrics_disabled(self):
+        """Test that nothing is recorded or exposed when metrics are disabled"""
+        self.client.get(reverse('download_spreadsheet_reports', args=[self.spreadsheet.id])).getvalue()
+        self.assertFalse(os.path.exists(metrics.get_metrics_dir()))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+
+
+class RowSelectionTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.df = pd.DataFrame({
+            'Name': ['John Doe', 'Jane Smith', 'Ann Lee', 'Bob Stone', None],
+            'Age': [30, 25, 41, 35, 50],
+            'Joined': pd.to_datetime(['2020-01-01', '2021-06-01', '2019-03-15', '2022-02-02', '2023-01-01']),
+        })
+        self.spreadsheet = self.create_spreadsheet(self.df, 'selection.xlsx')
+        self.download_url = reverse('download_spreadsheet_reports', args=[self.spreadsheet.id])
+
+    def test_rows_columns_and_filters(self):
+        """Test that the selected rows keep their sheet row numbers"""
+        selection = RowSelection('2-5', ['Name'], ['Age >= 30', 'Joined < 2023-01-01'])
+        df, row_numbers = selection.apply(self.df)
+        self.assertEqual(list(row_numbers), [3, 4])
+        self.assertEqual(list(df.columns), ['Name'])
+        self.assertEqual(list(df['Name']), ['Ann Lee', 'Bob Stone'])
+
+        df, row_numbers = RowSelection(filters=['Name contains STONE']).apply(self.df)
+        self.assertEqual(list(row_numbers), [4])
+        df, row_numbers = RowSelection(filters=['Name != Ann Lee']).apply(self.df)
+        self.assertEqual(list(row_numbers), [1, 2, 4])
+
+    def test_invalid_selections(self):
+        """Test that malformed ranges, filters and unknown columns are rejected"""
+        for rows in ['0', '5-2', 'a-b']:
+            with self.assertRaises(SelectionError):
+                RowSelection(rows)
+        with self.assertRaises(SelectionError):
+            RowSelection(filters=['Age'])
+        with self.assertRaises(SelectionError):
+            RowSelection(filters=['Age > old']).apply(self.df)
+        with self.assertRaises(SelectionError):
+            RowSelection(columns=['Salary']).apply(self.df)
+
+    def test_download_selected_rows(self):
+        """Test that only the selected rows are rendered into the ZIP"""
+        with mock.patch('spreadsheet_processor.rendering.render_report_pdf', return_value=b'%PDF') as render:
+            response = self.client.post(self.download_url, {'rows': '1-3', 'filter': 'Age >= 30'})
+            archive = zipfile.ZipFile(io.BytesIO(response.getvalue()))
+        self.assertEqual(sorted(archive.namelist()), ['row_1.pdf', 'row_3.pdf'])
+        self.assertEqual(render.call_count, 2)
+
+    @override_settings(SPREADSHEET_ROW_READER='streaming', SPREADSHEET_READER_BLOCK_SIZE=2)
+    def test_streaming_reader_selection(self):
+        """Test that the streaming reader applies the selection block by block"""
+        response = self.client.get(self.download_url, {'rows': '2,4', 'columns': 'Name,Age'})
+        archive = zipfile.ZipFile(io.BytesIO(response.getvalue()))
+        self.assertEqual(sorted(archive.namelist()), ['row_2.pdf', 'row_4.pdf'])
+
+    def test_single_row_returns_bare_pdf(self):
+        """Test that asking for one row returns its PDF instead of a ZIP"""
+        response = self.client.get(self.download_url, {'rows': '2'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(
+            response['Content-Disposition'],
+            f'attachment; filename="spreadsheet_{self.spreadsheet.id}_row_2.pdf"'
+        )
+        self.assertTrue(response.content.startswith(b'%PDF'))
+
+        response = self.client.get(self.download_url, {'rows': '9'}, follow=True)
+        self.assertEqual(str(list(response.context['messages'])[0]), 'Row 9 not found')
+
+    def test_invalid_selection_redirects(self):
+        """Test that a bad selection redirects with the reason"""
+        response = self.client.post(self.download_url, {'columns': 'Salary'}, follow=True)
+        self.assertRedirects(response, reverse('spreadsheet_list'))
+        self.assertEqual(str(list(response.context['messages'])[0]), 'Unknown column: Salary')
+
+
+    @override_settings(REPORT_DOWNLOAD_STREAMING=True)
+    def test_invalid_selection_redirects_before_streaming(self):
+        """Test that a streamed download checks the selection before the response starts"""
+        for params, message in [
+            ({'columns': 'Nope'}, 'Unknown column: Nope'),
+            ({'filter': 'Age >= abc'}, 'Invalid value for column Age: abc'),
+            ({'filter': 'Joined < someday'}, 'Invalid value for column Joined: someday'),
+        ]:
+            with self.subTest(params=params):
+                response = self.client.get(self.download_url, params, follow=True)
+                self.assertRedirects(response, reverse('spreadsheet_list'))
+                self.assertEqual(str(list(response.context['messages'])[0]), message)
+        cache = get_report_cache()
+        self.assertFalse(os.path.exists(cache.root / 'archives'))
+
+    @override_settings(REPORT_DOWNLOAD_STREAMING=True, SPREADSHEET_ROW_READER='streaming',
+                       SPREADSHEET_READER_BLOCK_SIZE=2)
+    def test_streaming_reader_checks_selection_before_streaming(self):
+        """Test that the selection is checked against whole-sheet dtypes with the streaming reader"""
+        response = self.client.get(self.download_url, {'filter': 'Age >= abc'}, follow=True)
+        self.assertRedirects(response, reverse('spreadsheet_list'))
+        response = self.client.get(self.download_url, {'filter': 'Age >= 40'})
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(sorted(archive.namelist()), ['row_3.pdf', 'row_5.pdf'])
+
+
+class MultiSheetTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.spreadsheet = self.create_spreadsheet({
+            'People': pd.DataFrame({'Name': ['John Doe', 'Jane Smith']}),
+            'Items': pd.DataFrame({'Item': ['Widget', 'Gadget', 'Doohickey'], 'Price': [1.5, 2, 3]}),
+            'Notes': pd.DataFrame({'Note': ['n/a']}),
+        }, 'workbook.xlsx')
+        self.download_url = reverse('download_spreadsheet_reports', args=[self.spreadsheet.id])
+
+    def test_every_sheet_gets_a_folder(self):
+        """Test that all sheets are reported, each in its own ZIP folder"""
+        response = self.client.get(self.download_url)
+        archive = zipfile.ZipFile(io.BytesIO(response.getvalue()))
+        self.assertEqual(sorted(archive.namelist()), [
+            'Items/row_1.pdf', 'Items/row_2.pdf', 'Items/row_3.pdf',
+            'Notes/row_1.pdf',
+            'People/row_1.pdf', 'People/row_2.pdf',
+        ])
+        # Every sheet now has a snapshot for the next download
+        self.spreadsheet.refresh_from_db()
+        self.assertTrue(self.spreadsheet.snapshot)
+        self.assertTrue(os.path.isdir(self.spreadsheet.file.storage.path(f'{self.spreadsheet.file.name}.sheet2.snapshot')))
+
+    def test_selection_skips_sheets_without_its_columns(self):
+        """Test that a column selection reports on the sheets that have the columns and names the others"""
+        response = self.client.get(self.download_url, {'columns': 'Item', 'filter': 'Price >= 2'})
+        archive = zipfile.ZipFile(io.BytesIO(response.getvalue()))
+        self.assertEqual(sorted(archive.namelist()), ['Items/row_2.pdf', 'Items/row_3.pdf'])
+        messages = [str(message) for message in self.client.get(reverse('spreadsheet_list')).context['messages']]
+        self.assertEqual(messages, ['Skipped sheets without the selected columns: People, Notes'])
+
+        response = self.client.get(self.download_url, {'columns': 'Salary'}, follow=True)
+        self.assertRedirects(response, reverse('spreadsheet_list'))
+        self.assertEqual(str(list(response.context['messages'])[0]), 'Unknown column: Salary')
+
+    def test_sheet_names_are_safe_folders(self):
+        """Test that sheet names cannot climb out of the archive or output directory"""
+        spreadsheet = self.create_spreadsheet(
+            {name: pd.DataFrame({'Name': ['A']}) for name in ['..', '.People', 'people']}, 'names.xlsx'
+        )
+
+        response = self.client.get(reverse('download_spreadsheet_reports', args=[spreadsheet.id]))
+        archive = zipfile.ZipFile(io.BytesIO(response.getvalue()))
+        self.assertEqual(archive.namelist(), ['sheet/row_1.pdf', 'People/row_1.pdf', 'people_2/row_1.pdf'])
+
+        output_dir = os.path.join(self.media_root, 'output')
+        generate_reports([spreadsheet_source(spreadsheet)], output_dir)
+        written = sorted(
+            os.path.relpath(os.path.join(directory, name), output_dir)
+            for directory, _, names in os.walk(output_dir) for name in names
+        )
+        self.assertEqual(written, [
+            f'spreadsheet_{spreadsheet.id}/People/row_1.pdf',
+            f'spreadsheet_{spreadsheet.id}/people_2/row_1.pdf',
+            f'spreadsheet_{spreadsheet.id}/sheet/row_1.pdf',
+        ])
+
+    @override_settings(REPORT_RENDER_WORKERS=2, REPORT_RENDER_CHUNK_SIZE=1, REPORT_CACHE_ENABLED=False)
+    def test_sheets_in_process_pool(self):
+        """Test parsing and rendering the chosen sheets in the shared process pool"""
+        pooled = zipfile.ZipFile(io.BytesIO(self.client.get(self.download_url, {'sheets': 'Items,People'}).getvalue()))
+        self.assertEqual(sorted(pooled.namelist()), [
+            'Items/row_1.pdf', 'Items/row_2.pdf', 'Items/row_3.pdf',
+            'People/row_1.pdf', 'People/row_2.pdf',
+        ])
+
+    def test_chosen_sheet_is_flat(self):
+        """Test that a single chosen sheet keeps the flat layout and single-row PDFs"""
+        response = self.client.post(self.download_url, {'sheets': 'Items'})
+        archive = zipfile.ZipFile(io.BytesIO(response.getvalue()))
+        self.assertEqual(sorted(archive.namelist()), ['row_1.pdf', 'row_2.pdf', 'row_3.pdf'])
+
+        response = self.client.post(self.download_url, {'sheets': 'Items', 'rows': '3'})
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+
+        response = self.client.post(self.download_url, {'sheets': 'Missing'}, follow=True)
+        self.assertEqual(str(list(response.context['messages'])[0]), 'Unknown sheet: Missing')
+
+    @override_settings(REPORT_SHEETS='first', SPREADSHEET_ROW_READER='streaming')
+    def test_first_sheet_setting(self):
+        """Test that REPORT_SHEETS = 'first' reports only the first sheet"""
+        archive = zipfile.ZipFile(io.BytesIO(self.client.get(self.download_url).getvalue()))
+        self.assertEqual(sorted(archive.namelist()), ['row_1.pdf', 'row_2.pdf'])
+
+    def test_single_pdf_bookmarks_sheets(self):
+        """Test that the single PDF nests row bookmarks under their sheets"""
+        response = self.client.get(self.download_url, {'format': 'pdf'})
+        pdf_data = response.getvalue()
+        self.assertEqual(pdf_data.count(b'/Type /Page\n'), 6)
+        for title in (b'(People)', b'(Items)', b'(Notes)'):
+            self.assertIn(title, pdf_data)
+
+
+class IncrementalRenderTests(TempMediaMixin, TestCase):
+    def upload(self, names):
+        df = pd.DataFrame({'Name': names, 'Status': ['open'] * len(names)})
+        self.client.post(reverse('upload_spreadsheet'), {
+            'spreadsheet': SimpleUploadedFile('tracking.xlsx', self.xlsx_bytes(df))
+        })
+        return Spreadsheet.objects.latest('id')
+
+    def test_reupload_is_linked_to_previous_version(self):
+        """Test that uploading a file with the same name links the earlier upload"""
+        first = self.upload(['A', 'B'])
+        second = self.upload(['A', 'C'])
+        self.assertEqual(first.original_name, 'tracking.xlsx')
+        self.assertIsNone(first.previous_version)
+        self.assertEqual(second.previous_version, first)
+        response = self.client.get(reverse('spreadsheet_list'))
+        self.assertContains(response, 'New version of the upload from')
+
+    def test_only_changed_rows_are_rendered(self):
+        """Test that a new version only renders the rows whose content changed"""
+        first = self.upload(['A', 'B', 'C', 'D'])
+        self.client.get(reverse('download_spreadsheet_reports', args=[first.id])).getvalue()
+
+        second = self.upload(['A', 'B', 'changed', 'D', 'E'])
+        with mock.patch('spreadsheet_processor.rendering.render_report_pdf', wraps=render_report_pdf) as render:
+            response = self.client.get(reverse('download_spreadsheet_reports', args=[second.id]))
+            archive = zipfile.ZipFile(io.BytesIO(response.getvalue()))
+        self.assertEqual(render.call_count, 2)
+        self.assertEqual(len(archive.namelist()), 5)
+
+    def test_row_content_hash(self):
+        """Test that the row hash covers fields, values and the theme version"""
+        row = PreparedRow(['Name'], ['A'])
+        self.assertEqual(row_content_hash(row), row_content_hash(PreparedRow(['Name'], ['A'])))
+        self.assertEqual(row_content_hash(row), row_content_hash({'Name': 'A'}))
+        self.assertNotEqual(row_content_hash(row), row_content_hash(PreparedRow(['Title'], ['A'])))
+        self.assertNotEqual(row_content_hash(row), row_content_hash(PreparedRow(['Name'], ['B'])))
+        content_hash = row_content_hash(row)
+        with mock.patch.object(ReportTheme, 'version', 'next'):
+            self.assertNotEqual(row_content_hash(row), content_hash)
+
+
+class UploadDeduplicationTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.excel_data = self.xlsx_bytes(pd.DataFrame({'Name': ['A', 'B'], 'Status': ['open', 'closed']}))
+
+    def upload(self, name='test.xlsx'):
+        self.client.post(reverse('upload_spreadsheet'), {
+            'spreadsheet': SimpleUploadedFile(name, self.excel_data)
+        })
+        return Spreadsheet.objects.latest('id')
+
+    def stored_files(self):
+        return sorted(
+            name for name in os.listdir(os.path.join(self.media_root, 'spreadsheets'))
+            if not name.endswith('.snapshot')
+        )
+
+    def test_identical_uploads_share_one_file(self):
+        """Test that an identical upload reuses the stored file and snapshot without reading it"""
+        first = self.upload()
+        self.assertEqual(first.content_hash, hashlib.sha256(self.excel_data).hexdigest())
+
+        with mock.patch('spreadsheet_processor.views.validate_xlsx') as validate:
+            second = self.upload('copy.xlsx')
+        validate.assert_not_called()
+        self.assertEqual(second.file.name, first.file.name)
+        self.assertEqual(second.snapshot, first.snapshot)
+        self.assertEqual(second.original_name, 'copy.xlsx')
+        self.assertEqual(self.stored_files(), [os.path.basename(first.file.name)])
+
+        response = self.client.get(reverse('download_spreadsheet_reports', args=[second.id]))
+        self.assertEqual(len(zipfile.ZipFile(io.BytesIO(response.getvalue())).namelist()), 2)
+
+    def test_content_hash_computed_without_upload_handler(self):
+        """Test that uploads are still hashed when the hashing upload handler is not installed"""
+        request = RequestFactory().post('/', {'spreadsheet': SimpleUploadedFile('test.xlsx', self.excel_data)})
+        self.assertEqual(uploaded_content_hash(request, 'spreadsheet'), hashlib.sha256(self.excel_data).hexdigest())
+        self.assertEqual(request.FILES['spreadsheet'].read(), self.excel_data)
+
+    def test_dedupe_command_merges_existing_copies(self):
+        """Test that dedupe_spreadsheets points stored copies at one file and deletes the rest"""
+        first = self.upload()
+        copy = Spreadsheet.objects.create(file=SimpleUploadedFile('test.xlsx', self.excel_data), processed=True)
+        self.assertEqual(len(self.stored_files()), 2)
+
+        call_command('dedupe_spreadsheets', stdout=io.StringIO())
+
+        copy.refresh_from_db()
+        self.assertEqual(copy.file.name, first.file.name)
+        self.assertEqual(copy.content_hash, first.content_hash)
+        self.assertEqual(self.stored_files(), [os.path.basename(first.file.name)])
+
+    def test_migration_hashes_existing_files(self):
+        """Test that the content hash migration hashes stored files and skips missing ones"""
+        from django.apps import apps
+        from importlib import import_module
+
+        migration = import_module('spreadsheet_processor.migrations.0005_spreadsheet_content_hash')
+        spreadsheet = Spreadsheet.objects.create(file=SimpleUploadedFile('old.xlsx', self.excel_data))
+        missing = Spreadsheet.objects.create(file='spreadsheets/missing.xlsx')
+
+        migration.hash_existing_files(apps, None)
+        spreadsheet.refresh_from_db()
+        missing.refresh_from_db()
+        self.assertEqual(spreadsheet.content_hash, hashlib.sha256(self.excel_data).hexdigest())
+        self.assertEqual(missing.content_hash, '')
+
+
+class StreamedUploadTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        df = pd.DataFrame({'Name': [f'Person {n}' for n in range(5000)], 'Age': range(5000)})
+        self.excel_data = self.xlsx_bytes(df)
+
+    def upload(self, data, name='test.xlsx'):
+        return self.client.post(reverse('upload_spreadsheet'), {
+            'spreadsheet': SimpleUploadedFile(name, data)
+        })
+
+    def stored_files(self):
+        directory = os.path.join(self.media_root, 'spreadsheets')
+        return os.listdir(directory) if os.path.isdir(directory) else []
+
+    def test_upload_written_straight_to_storage(self):
+        """Test that an upload spanning many chunks is stored by the upload handler, not copied on save"""
+        self.assertGreater(len(self.excel_data), 64 * 1024)
+        with mock.patch.object(FileSystemStorage, '_save', side_effect=AssertionError('copied on save')):
+            self.upload(self.excel_data)
+        spreadsheet = Spreadsheet.objects.get()
+        self.assertEqual(spreadsheet.content_hash, hashlib.sha256(self.excel_data).hexdigest())
+        self.assertEqual(spreadsheet.file_size, len(self.excel_data))
+        self.assertEqual(spreadsheet.row_count, 5000)
+        with spreadsheet.file.open('rb') as stored_file:
+            self.assertEqual(stored_file.read(), self.excel_data)
+        self.assertEqual(self.stored_files(), [os.path.basename(spreadsheet.file.name)])
+
+    def test_oversized_upload_dropped(self):
+        """Test that an upload is dropped, and its partial file deleted, once it passes the size limit"""
+        with override_settings(SPREADSHEET_UPLOAD_MAX_BYTES=50 * 1024):
+            response = self.upload(self.excel_data)
+        self.assertContains(response, 'The spreadsheet is larger than the upload limit of 50.0\xa0KB.')
+        self.assertEqual(Spreadsheet.objects.count(), 0)
+        self.assertEqual(self.stored_files(), [])
+
+    def test_rejected_uploads_leave_no_files(self):
+        """Test that files which are not workbooks are dropped on their first bytes and invalid ones deleted"""
+        response = self.upload(b'not an excel file' * 10000)
+        self.assertContains(response, 'Please upload a valid Excel file (.xlsx)')
+
+        not_a_workbook = io.BytesIO()
+        with zipfile.ZipFile(not_a_workbook, 'w') as zip_file:
+            zip_file.writestr('readme.txt', 'hello')
+        response = self.upload(not_a_workbook.getvalue())
+        self.assertContains(response, 'Please ensure the file is a valid Excel spreadsheet.')
+        self.assertEqual(Spreadsheet.objects.count(), 0)
+        self.assertEqual(self.stored_files(), [])
+
+    def test_only_upload_view_stores_files(self):
+        """Test that spreadsheets posted elsewhere, or failing the CSRF check, leave no stored files"""
+        client = Client(enforce_csrf_checks=True)
+        client.cookies['csrftoken'] = 'a' * 32
+        upload = {'spreadsheet': SimpleUploadedFile('test.xlsx', self.excel_data), 'csrfmiddlewaretoken': 'b' * 32}
+        self.assertEqual(client.post(reverse('spreadsheet_list'), upload).status_code, 403)
+        upload['spreadsheet'].seek(0)
+        self.assertEqual(client.post(reverse('upload_spreadsheet'), upload).status_code, 403)
+        self.assertEqual(Spreadsheet.objects.count(), 0)
+        self.assertEqual(self.stored_files(), [])
+
+        upload['spreadsheet'].seek(0)
+        upload['csrfmiddlewaretoken'] = 'a' * 32
+        self.assertEqual(client.post(reverse('upload_spreadsheet'), upload).status_code, 302)
+        self.assertEqual(self.stored_files(), [os.path.basename(Spreadsheet.objects.get().file.name)])
+
+
+class UploadValidationTests(TempMediaMixin, TestCase):
+    def rewrite_sheet(self, data, rewrite):
+        """Return data with the XML of its first sheet passed through rewrite"""
+        output = io.BytesIO()
+        with zipfile.ZipFile(io.BytesIO(data)) as source, zipfile.ZipFile(output, 'w') as target:
+            for item in source.infolist():
+                content = source.read(item.filename)
+                if item.filename == 'xl/worksheets/sheet1.xml':
+                    content = rewrite(content)
+                target.writestr(item, content)
+        return output.getvalue()
+
+    def test_valid_workbook(self):
+        """Test that a workbook with data rows passes and the file is left rewound"""
+        upload = io.BytesIO(self.xlsx_bytes(pd.DataFrame({'Name': ['A', 'B'], 'Age': [1, 2]})))
+        summary = validate_xlsx(upload)
+        self.assertEqual(summary.sheet_name, 'Sheet1')
+        self.assertEqual(summary.dimension, 'A1:B3')
+        self.assertEqual(upload.tell(), 0)
+
+    def test_empty_and_invalid_files(self):
+        """Test that header-only sheets and files that are not workbooks are rejected"""
+        with self.assertRaises(EmptySpreadsheetError):
+            validate_xlsx(io.BytesIO(self.xlsx_bytes(pd.DataFrame({'Name': []}))))
+        with self.assertRaises(SpreadsheetValidationError):
+            validate_xlsx(io.BytesIO(b'not an excel file'))
+        not_a_workbook = io.BytesIO()
+        with zipfile.ZipFile(not_a_workbook, 'w') as zip_file:
+            zip_file.writestr('readme.txt', 'hello')
+        with self.assertRaises(SpreadsheetValidationError):
+            validate_xlsx(not_a_workbook)
+
+    def test_sheet_read_only_up_to_first_data_row(self):
+        """Test that validation stops at the first data row and does not trust a one-cell dimension"""
+        data = self.xlsx_bytes(pd.DataFrame({'Name': ['A', 'B', 'C']}))
+        # Cut the sheet XML off inside the third row and hide the extent
+        truncated = self.rewrite_sheet(
+            data,
+            lambda xml: xml.replace(b'ref="A1:A4"', b'ref="A1"')[:xml.index(b'<row r="3"') + 20]
+        )
+        self.assertEqual(validate_xlsx(io.BytesIO(truncated)).dimension, 'A1')
+
+    def test_upload_of_empty_spreadsheet(self):
+        """Test that the upload view rejects a spreadsheet without data rows"""
+        upload = SimpleUploadedFile('empty.xlsx', self.xlsx_bytes(pd.DataFrame({'Name': []})))
+        response = self.client.post(reverse('upload_spreadsheet'), {'spreadsheet': upload})
+        self.assertContains(response, 'The spreadsheet is empty.')
+        self.assertEqual(Spreadsheet.objects.count(), 0)
+
+
+class SpreadsheetListTests(TempMediaMixin, TestCase):
+    def create_spreadsheets(self, count):
+        start = dt.datetime(2024, 1, 1, tzinfo=dt.timezone.utc)
+        Spreadsheet.objects.bulk_create([
+            # Pairs share an upload time, so the id has to break ties
+            Spreadsheet(file=f'spreadsheets/{index}.xlsx', uploaded_at=start + dt.timedelta(minutes=index // 2))
+            for index in range(count)
+        ])
+        return list(Spreadsheet.objects.order_by('-uploaded_at', '-id'))
+
+    @override_settings(SPREADSHEET_LIST_PAGE_SIZE=4)
+    def test_keyset_pages(self):
+        """Test that older and newer pages cover every spreadsheet exactly once, in order"""
+        expected = self.create_spreadsheets(10)
+        url = reverse('spreadsheet_list')
+
+        pages = []
+        response = self.client.get(url)
+        self.assertIsNone(response.context['previous_cursor'])
+        while True:
+            pages.append(list(response.context['spreadsheets']))
+            if response.context['next_cursor'] is None:
+                break
+            response = self.client.get(url, {'after': response.context['next_cursor']})
+        self.assertEqual([len(page) for page in pages], [4, 4, 2])
+        self.assertEqual([s for page in pages for s in page], expected)
+
+        # Walk back from the last page
+        response = self.client.get(url, {'before': response.context['previous_cursor']})
+        self.assertEqual(list(response.context['spreadsheets']), pages[1])
+        response = self.client.get(url, {'before': response.context['previous_cursor']})
+        self.assertEqual(list(response.context['spreadsheets']), pages[0])
+        self.assertIsNone(response.context['previous_cursor'])
+
+        # A cursor that cannot be decoded shows the first page
+        response = self.client.get(url, {'after': 'nonsense'})
+        self.assertEqual(list(response.context['spreadsheets']), pages[0])
+
+    def test_upload_records_metadata_and_list_skips_files(self):
+        """Test that upload stores counts and size, and the list renders without file access"""
+        df = pd.DataFrame({'Name': ['A', 'B', 'C'], 'Age': [1, 2, 3]})
+        data = self.xlsx_bytes({'First': df, 'Second': df})
+        self.client.post(reverse('upload_spreadsheet'), {'spreadsheet': SimpleUploadedFile('meta.xlsx', data)})
+
+        spreadsheet = Spreadsheet.objects.get()
+        self.assertEqual(
+            (spreadsheet.file_size, spreadsheet.sheet_count, spreadsheet.row_count, spreadsheet.column_count),
+            (len(data), 2, 3, 2)
+        )
+
+        with mock.patch.object(FileSystemStorage, 'open', side_effect=AssertionError), \
+                mock.patch.object(FileSystemStorage, 'size', side_effect=AssertionError), \
+                mock.patch.object(FileSystemStorage, 'exists', side_effect=AssertionError):
+            response = self.client.get(reverse('spreadsheet_list'))
+        self.assertContains(response, '3 rows &times; 2 columns')
+        self.assertContains(response, '2 sheets')
+
+    def test_parsing_corrects_estimated_counts(self):
+        """Test that the parsed first sheet replaces counts estimated from the dimension"""
+        spreadsheet = self.create_spreadsheet(
+            pd.DataFrame({'Name': ['A', 'B']}), 'estimate.xlsx', processed=False, row_count=10, column_count=5
+        )
+        self.client.get(reverse('download_spreadsheet_reports', args=[spreadsheet.id])).getvalue()
+        spreadsheet.refresh_from_db()
+        self.assertEqual((spreadsheet.row_count, spreadsheet.column_count), (2, 1))
+
+    def test_migration_describes_existing_files(self):
+        """Test that the metadata migration fills in the counts and size of existing uploads"""
+        from django.apps import apps
+        from importlib import import_module
+
+        migration = import_module('spreadsheet_processor.migrations.0006_spreadsheet_metadata')
+        spreadsheet = self.create_spreadsheet(pd.DataFrame({'Name': ['A', 'B', 'C'], 'Age': [1, 2, 3]}), 'old.xlsx')
+        broken = Spreadsheet.objects.create(file=SimpleUploadedFile('broken.xlsx', b'not a workbook'))
+
+        migration.describe_existing_files(apps, None)
+        spreadsheet.refresh_from_db()
+        broken.refresh_from_db()
+        self.assertEqual(
+            (spreadsheet.file_size, spreadsheet.sheet_count, spreadsheet.row_count, spreadsheet.column_count),
+            (spreadsheet.file.size, 1, 3, 2)
+        )
+        self.assertEqual((broken.file_size, broken.sheet_count), (14, None))
@@ -0,0 +1,185 @@
+import hashlib
+import os
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile, StopFutureHandlers, StopUpload
+from django.template.defaultfilters import filesizeformat
+
+from .validation import ZIP_SIGNATURE
+
+class ContentHashUploadHandler(FileUploadHandler):
+    """
+    Compute the SHA-256 of every uploaded file while it streams in, so the
+    file does not have to be read again to find out whether it is a
+    duplicate. Must come before the handlers that store the file; the digests end up in
+    request.upload_content_hashes by form field name.
+    """
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.digest = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.digest.update(raw_data)
+        # Pass the data on to the handler that stores the file
+        return raw_data
+
+    def file_complete(self, file_size):
+        if not hasattr(self.request, 'upload_content_hashes'):
+            self.request.upload_content_hashes = {}
+        self.request.upload_content_hashes[self.field_name] = self.digest.hexdigest()
+        return None
+
+class StoredUploadedFile(UploadedFile):
+    """
+    An upload that SpreadsheetUploadHandler already wrote to storage under
+    stored_name; reading it reads the stored file
+    """
+    def __init__(self, storage, stored_name, name, content_type, size, charset, content_type_extra=None):
+        super().__init__(
+            open(storage.path(stored_name), 'rb'), name, content_type, size, charset, content_type_extra
+        )
+        self.storage = storage
+        self.stored_name = stored_name
+
+class SpreadsheetUploadHandler(ContentHashUploadHandler):
+    """
+    Write uploaded spreadsheets straight to their final path in the storage
+    of Spreadsheet.file as the chunks arrive, hashing them on the way, so an
+    upload is never held in memory or copied from a temporary file. Uploads
+    that do not start with the ZIP signature of an xlsx file, or that grow
+    beyond SPREADSHEET_UPLOAD_MAX_BYTES, are dropped as soon as that shows
+    and the reason is left in request.upload_errors by form field name.
+
+    Other files, and storages without local paths, are only hashed and left
+    to the next handlers in FILE_UPLOAD_HANDLERS. Installed by the upload
+    view alone, so other requests never write to storage; the files it
+    stored are listed in stored_files.
+    """
+    field_names = ('spreadsheet',)
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.max_bytes = getattr(settings, 'SPREADSHEET_UPLOAD_MAX_BYTES', 100 * 1024 * 1024)
+        self.destination = None
+        self.stored_files = []
+
+    def reject(self, message, exception):
+        """Drop the file written so far and leave message for the view"""
+        self.discard()
+        if not hasattr(self.request, 'upload_errors'):
+            self.request.upload_errors = {}
+        self.request.upload_errors[self.field_name] = message
+        raise exception
+
+    def too_large(self):
+        self.reject(
+            f'The spreadsheet is larger than the upload limit of {filesizeformat(self.max_bytes)}.',
+            StopUpload()
+        )
+
+    def discard(self):
+        if self.destination is not None:
+            self.destination.close()
+            self.storage.delete(self.stored_name)
+            self.destination = None
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        self.destination = None
+        self.head = b''
+        self.checked = field_name in self.field_names
+        if not self.checked or not file_name.endswith('.xlsx'):
+            return
+        if content_length is not None and content_length > self.max_bytes:
+            self.too_large()
+
+        from .models import Spreadsheet
+
+        field = Spreadsheet._meta.get_field('file')
+        self.storage = field.storage
+        try:
+            self.destination = self.create_stored_file(field, file_name)
+        except NotImplementedError:
+            # Remote storage: keep the upload with the next handlers
+            return
+        # The file is stored here; the other handlers need not set up a copy
+        raise StopFutureHandlers()
+
+    def create_stored_file(self, field, file_name):
+        """Open a new file for writing under a name the storage has not used"""
+        while True:
+            self.stored_name = self.storage.get_available_name(field.generate_filename(None, file_name))
+            path = self.storage.path(self.stored_name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                # Claim the name, so a concurrent upload cannot pick it as well
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666)
+            except FileExistsError:
+                continue
+            return os.fdopen(fd, 'wb')
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.checked and start + len(raw_data) > self.max_bytes:
+            self.too_large()
+        if self.checked and len(self.head) < len(ZIP_SIGNATURE):
+            self.head += raw_data[:len(ZIP_SIGNATURE) - len(self.head)]
+            if not ZIP_SIGNATURE.startswith(self.head):
+                self.reject('Please upload a valid Excel file (.xlsx)', SkipFile())
+        raw_data = super().receive_data_chunk(raw_data, start)
+        if self.destination is None:
+            return raw_data
+        self.destination.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        super().file_complete(file_size)
+        if self.destination is None:
+            return None
+        self.destination.close()
+        self.destination = None
+        permissions = getattr(self.storage, 'file_permissions_mode', None)
+        if permissions is not None:
+            os.chmod(self.storage.path(self.stored_name), permissions)
+        stored_file = StoredUploadedFile(
+            self.storage, self.stored_name, self.file_name, self.content_type, file_size,
+            self.charset, self.content_type_extra
+        )
+        self.stored_files.append(stored_file)
+        return stored_file
+
+    def upload_interrupted(self):
+        self.discard()
+
+def discard_stored_upload(uploaded_file):
+    """Delete the stored file of an upload that is not kept; other uploads were never stored"""
+    if isinstance(uploaded_file, StoredUploadedFile):
+        uploaded_file.close()
+        uploaded_file.storage.delete(uploaded_file.stored_name)
+
+def uploaded_content_hash(request, field_name):
+    """
+    SHA-256 hex digest of an uploaded file, as computed by
+    ContentHashUploadHandler, or by reading the file when the handler is
+    not installed
+    """
+    content_hash = getattr(request, 'upload_content_hashes', {}).get(field_name)
+    if content_hash is not None:
+        return content_hash
+
+    digest = hashlib.sha256()
+    uploaded_file = request.FILES[field_name]
+    for chunk in uploaded_file.chunks():
+        digest.update(chunk)
+    uploaded_file.seek(0)
+    return digest.hexdigest()
+
+def find_stored_copy(content_hash):
+    """The earliest Spreadsheet whose stored file has these contents, or None"""
+    from .models import Spreadsheet
+
+    candidates = Spreadsheet.objects.filter(content_hash=content_hash).exclude(file='').order_by('id')
+    for spreadsheet in candidates:
+        if spreadsheet.file.storage.exists(spreadsheet.file.name):
+            return spreadsheet
+    return None
@@ -5,5 +5,9 @@ urlpatterns = [
     path('upload/', views.upload_spreadsheet, name='upload_spreadsheet'),
     path('spreadsheets/', views.SpreadsheetListView.as_view(), name='spreadsheet_list'),
     path('spreadsheets/<int:spreadsheet_id>/download/', views.download_spreadsheet_reports, name='download_spreadsheet_reports'),
+    path('spreadsheets/<int:spreadsheet_id>/jobs/', views.enqueue_report_generation, name='enqueue_report_generation'),
+    path('jobs/<int:job_id>/', views.report_job_status, name='report_job_status'),
+    path('jobs/<int:job_id>/download/', views.download_report_job, name='download_report_job'),
     path('health/', views.health_check, name='health_check'),
+    path('metrics/', views.metrics, name='metrics'),
 ] 
\ No newline at end of file
@@ -0,0 +1,142 @@
+import posixpath
+import re
+import zipfile
+from collections import namedtuple
+from xml.etree import ElementTree
+
+# Local file header signature every xlsx (ZIP) file starts with
+ZIP_SIGNATURE = b'PK\x03\x04'
+
+_RELATIONSHIPS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+_MAIN = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_R_ID = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id'
+_OFFICE_DOCUMENT = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument'
+
+_DIMENSION_RE = re.compile(r'^\$?([A-Z]+)\$?(\d+)(?::\$?([A-Z]+)\$?(\d+))?$')
+
+# What validate_xlsx found out about a workbook: the name and dimension ref
+# (e.g. "A1:C200", None when there is none) of its first sheet, its number of
+# sheets, and the data rows and columns of the first sheet according to the
+# dimension (None when the dimension does not say)
+WorkbookSummary = namedtuple('WorkbookSummary', ['sheet_name', 'dimension', 'sheet_count', 'rows', 'columns'])
+
+class SpreadsheetValidationError(ValueError):
+    """An upload that is not a readable xlsx workbook"""
+
+class EmptySpreadsheetError(SpreadsheetValidationError):
+    """A workbook whose first sheet has no data rows below the header"""
+
+def _part_path(base, target):
+    """Resolve a relationship target against the part that refers to it"""
+    if target.startswith('/'):
+        return target[1:]
+    return posixpath.normpath(posixpath.join(posixpath.dirname(base), target))
+
+def _rels_path(part):
+    directory, name = posixpath.split(part)
+    return posixpath.join(directory, '_rels', f'{name}.rels')
+
+def _relationships(archive, part):
+    """{id: (type, target part)} of the relationships of a package part"""
+    root = ElementTree.fromstring(archive.read(_rels_path(part)))
+    return {
+        rel.get('Id'): (rel.get('Type'), _part_path(part, rel.get('Target')))
+        for rel in root.iter(f'{_RELATIONSHIPS}Relationship')
+    }
+
+def _column_number(letters):
+    number = 0
+    for letter in letters:
+        number = number * 26 + ord(letter) - ord('A') + 1
+    return number
+
+def dimension_shape(dimension):
+    """
+    (data rows, columns) covered by a dimension ref, not counting the header
+    row, or (None, None) unless the ref is a range. Writers that do not track
+    a sheet's extent put a single cell ("A1") there, which proves nothing.
+    """
+    match = _DIMENSION_RE.match(dimension or '')
+    if match is None or match.group(3) is None:
+        return None, None
+    first_column, first_row, last_column, last_row = match.groups()
+    rows = max(int(last_row) - int(first_row), 0)
+    columns = _column_number(last_column) - _column_number(first_column) + 1
+    return rows, columns
+
+def _is_filled(row):
+    """Whether a <row> element has a cell with a value"""
+    for cell in row.iter(f'{_MAIN}c'):
+        value = cell.find(f'{_MAIN}v')
+        if value is not None and value.text:
+            return True
+        if cell.find(f'{_MAIN}is') is not None:
+            return True
+    return False
+
+def _scan_sheet(sheet_file):
+    """
+    Return the dimension ref of a worksheet XML stream and raise
+    EmptySpreadsheetError unless it has a filled row after its header row.
+    The sheet is parsed incrementally and only up to that row.
+    """
+    dimension = None
+    filled_rows = 0
+    for event, element in ElementTree.iterparse(sheet_file, events=('start', 'end')):
+        if event == 'start':
+            if element.tag == f'{_MAIN}dimension':
+                dimension = element.get('ref')
+            elif element.tag == f'{_MAIN}sheetData':
+                # A range without rows below the header means the writer knew
+                # the sheet holds nothing else
+                if dimension_shape(dimension)[0] == 0:
+                    raise EmptySpreadsheetError("The spreadsheet is empty")
+        elif element.tag == f'{_MAIN}row':
+            if _is_filled(element):
+                filled_rows += 1
+                if filled_rows == 2:
+                    return dimension
+            element.clear()
+    raise EmptySpreadsheetError("The spreadsheet is empty")
+
+def validate_xlsx(file):
+    """
+    Check that an uploaded file is an xlsx workbook whose first sheet has at
+    least one data row, without loading the workbook: the ZIP signature is
+    checked, the workbook and first sheet are located through the package
+    relationships, and the sheet XML is parsed only up to its first data row
+    (or its dimension, when that shows the sheet is empty). The time taken
+    does not depend on how many rows follow. Returns a WorkbookSummary and
+    leaves the file rewound.
+    """
+    try:
+        file.seek(0)
+        if file.read(len(ZIP_SIGNATURE)) != ZIP_SIGNATURE:
+            raise SpreadsheetValidationError("Not an xlsx file")
+        file.seek(0)
+
+        with zipfile.ZipFile(file) as archive:
+            office_documents = [
+                target for rel_type, target in _relationships(archive, '').values()
+                if rel_type == _OFFICE_DOCUMENT
+            ]
+            if not office_documents:
+                raise SpreadsheetValidationError("No workbook in the file")
+            workbook_part = office_documents[0]
+            workbook = ElementTree.fromstring(archive.read(workbook_part))
+            sheets = workbook.findall(f'{_MAIN}sheets/{_MAIN}sheet')
+            if not sheets:
+                raise SpreadsheetValidationError("The workbook has no sheets")
+            _, sheet_part = _relationships(archive, workbook_part)[sheets[0].get(_R_ID)]
+
+            with archive.open(sheet_part) as sheet_file:
+                dimension = _scan_sheet(sheet_file)
+    except SpreadsheetValidationError:
+        raise
+    except (zipfile.BadZipFile, KeyError, ElementTree.ParseError, OSError) as e:
+        raise SpreadsheetValidationError(f"Unreadable xlsx file: {str(e)}")
+    finally:
+        file.seek(0)
+
+    rows, columns = dimension_shape(dimension)
+    return WorkbookSummary(sheets[0].get('name'), dimension, len(sheets), rows, columns)
@@ -1,130 +1,42 @@
 from django.shortcuts import render, redirect
 from django.contrib import messages
 from django.views.generic import ListView
-from .models import Spreadsheet
-import pandas as pd
-from django.http import HttpResponse, JsonResponse
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib import colors
-from reportlab.lib.units import inch
+from .models import Spreadsheet, ReportJob
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from .archive import iter_zip_stream, write_zip
+from .jobs import enqueue_report_job
+from .cache import archive_cache_key, get_report_cache, selection_cache_key, sheets_cache_key
+from .metrics import metrics_enabled, render_prometheus, start_run
+from .uploads import SpreadsheetUploadHandler, discard_stored_upload, find_stored_copy, uploaded_content_hash
+from .validation import EmptySpreadsheetError, validate_xlsx
+from .pagination import keyset_page
+from .responses import archive_response, report_etag
 import io
-import zipfile
+from django.utils.cache import get_conditional_response
 from django.views.decorators.http import require_http_methods
-from datetime import datetime
 import os
 import logging
-from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
 from django.conf import settings
-import pytz
 
 logger = logging.getLogger(__name__)
 
-def generate_pdf_report(row_data, row_number):
-    """Generate a beautiful PDF report for a single row"""
-    try:
-        # Create a buffer for the PDF
-        pdf_buffer = io.BytesIO()
-        
-        # Create PDF document
-        doc = SimpleDocTemplate(
-            pdf_buffer,
-            pagesize=letter,
-            rightMargin=72,
-            leftMargin=72,
-            topMargin=72,
-            bottomMargin=72
-        )
-        
-        # Get styles
-        styles = getSampleStyleSheet()
-        
-        # Create custom styles
-        styles.add(ParagraphStyle(
-            name='CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=24,
-            spaceAfter=30,
-            textColor=colors.HexColor('#2c3e50'),
-            alignment=1  # Center alignment
-        ))
-        
-        styles.add(ParagraphStyle(
-            name='CustomSubTitle',
-            parent=styles['Heading2'],
-            fontSize=16,
-            spaceAfter=20,
-            textColor=colors.HexColor('#34495e'),
-            alignment=1  # Center alignment
-        ))
-        
-        styles.add(ParagraphStyle(
-            name='CustomBodyText',
-            parent=styles['Normal'],
-            fontSize=12,
-            spaceAfter=12,
-            textColor=colors.HexColor('#2c3e50')
-        ))
-        
-        # Build PDF content
-        story = []
-        
-        # Add title
-        story.append(Paragraph(f"Report", styles['CustomTitle']))
-        story.append(Spacer(1, 30))
-        
-        # Create table data with wrapped text
-        table_data = [['Field', 'Value']]
-        for field, value in row_data.items():
-            # Convert long values to Paragraph objects for proper wrapping
-            wrapped_value = Paragraph(str(value), styles['CustomBodyText'])
-            table_data.append([field, wrapped_value])
-        
-        # Create table with adjusted column widths
-        table = Table(table_data, colWidths=[2*inch, 4.5*inch])
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#2c3e50')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.HexColor('#ecf0f1')),
-            ('TEXTCOLOR', (0, 1), (-1, -1), colors.HexColor('#2c3e50')),
-            ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 1), (-1, -1), 10),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#bdc3c7')),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('WORDWRAP', (0, 0), (-1, -1), True),
-            ('LEFTPADDING', (0, 0), (-1, -1), 6),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 6),
-            ('TOPPADDING', (0, 0), (-1, -1), 3),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 3),
-        ]))
-        
-        story.append(table)
-        story.append(Spacer(1, 30))
-        
-        # Add footer with PST timezone
-        pst = pytz.timezone('America/Los_Angeles')
-        current_time = datetime.now(pytz.UTC).astimezone(pst)
-        story.append(Paragraph(f"Generated on: {current_time.strftime('%B %d, %Y at %I:%M %p %Z')}", styles['CustomBodyText']))
-        
-        # Build PDF
-        doc.build(story)
-        
-        # Get the PDF data
-        pdf_buffer.seek(0)
-        return pdf_buffer.getvalue()
-        
-    except Exception as e:
-        logger.error(f"Error generating PDF report: {str(e)}")
-        raise
-
+@csrf_exempt
 def upload_spreadsheet(request):
+    # The upload handler has to be installed before the CSRF check reads the
+    # body, so the check is made by _upload_spreadsheet below
+    handler = SpreadsheetUploadHandler(request)
+    request.upload_handlers.insert(0, handler)
+    response = _upload_spreadsheet(request)
+    if response.status_code == 403:
+        # Failed the CSRF check after the upload was stored
+        for uploaded_file in handler.stored_files:
+            discard_stored_upload(uploaded_file)
+    return response
+
+@csrf_protect
+def _upload_spreadsheet(request):
     if request.method == 'POST' and request.FILES.get('spreadsheet'):
         spreadsheet_file = request.FILES['spreadsheet']
         
@@ -134,79 +46,360 @@ def upload_spreadsheet(request):
             return render(request, 'spreadsheet_processor/upload.html')
             
         try:
-            # Read Excel file with openpyxl engine
-            df = pd.read_excel(spreadsheet_file, engine='openpyxl')
-            if len(df) == 0:
+            # Link the upload to the last upload of the same file
+            previous_version = Spreadsheet.objects.filter(
+                original_name=spreadsheet_file.name
+            ).order_by('-uploaded_at', '-id').first()
+            
+            # Identical contents were already validated and stored: share them
+            content_hash = uploaded_content_hash(request, 'spreadsheet')
+            stored_copy = find_stored_copy(content_hash)
+            if stored_copy is not None:
+                discard_stored_upload(spreadsheet_file)
+                Spreadsheet.objects.create(
+                    file=stored_copy.file.name,
+                    content_hash=content_hash,
+                    snapshot=stored_copy.snapshot,
+                    processed=True,
+                    original_name=spreadsheet_file.name,
+                    previous_version=previous_version,
+                    file_size=spreadsheet_file.size,
+                    sheet_count=stored_copy.sheet_count,
+                    row_count=stored_copy.row_count,
+                    column_count=stored_copy.column_count
+                )
+                messages.success(request, 'Spreadsheet uploaded successfully!')
+                return redirect('spreadsheet_list')
+            
+            # Check the file is a non-empty workbook; it is parsed when reports are first made
+            try:
+                summary = validate_xlsx(spreadsheet_file)
+            except EmptySpreadsheetError:
+                discard_stored_upload(spreadsheet_file)
                 messages.error(request, 'The spreadsheet is empty.')
                 return render(request, 'spreadsheet_processor/upload.html')
             
-            # Save the spreadsheet
-            spreadsheet = Spreadsheet.objects.create(
-                file=spreadsheet_file,
-                processed=True
+            Spreadsheet.objects.create(
+                # Already in storage when SpreadsheetUploadHandler wrote it there
+                file=getattr(spreadsheet_file, 'stored_name', spreadsheet_file),
+                content_hash=content_hash,
+                processed=True,
+                original_name=spreadsheet_file.name,
+                previous_version=previous_version,
+                file_size=spreadsheet_file.size,
+                sheet_count=summary.sheet_count,
+                row_count=summary.rows,
+                column_count=summary.columns
             )
             messages.success(request, 'Spreadsheet uploaded successfully!')
             return redirect('spreadsheet_list')
             
         except Exception as e:
             logger.error(f"Error processing spreadsheet: {str(e)}")
+            discard_stored_upload(spreadsheet_file)
             messages.error(request, f'Error processing spreadsheet: Please ensure the file is a valid Excel spreadsheet.')
             return render(request, 'spreadsheet_processor/upload.html')
     
+    # An upload the upload handler dropped (too large, or not an xlsx file)
+    upload_error = getattr(request, 'upload_errors', {}).get('spreadsheet')
+    if upload_error is not None:
+        messages.error(request, upload_error)
     return render(request, 'spreadsheet_processor/upload.html')
 
 class SpreadsheetListView(ListView):
+    """
+    Uploaded spreadsheets, newest first, a page at a time. Pages are linked
+    by `after`/`before` cursors (see pagination.keyset_page) and rendered
+    from the database alone.
+    """
     model = Spreadsheet
     template_name = 'spreadsheet_processor/spreadsheet_list.html'
     context_object_name = 'spreadsheets'
-    ordering = ['-uploaded_at']
+    ordering = ['-uploaded_at', '-id']
+
+    def get_queryset(self):
+        return super().get_queryset().select_related('previous_version')
+
+    def get_context_data(self, **kwargs):
+        spreadsheets, next_cursor, previous_cursor = keyset_page(
+            self.object_list,
+            getattr(settings, 'SPREADSHEET_LIST_PAGE_SIZE', 25),
+            after=self.request.GET.get('after'),
+            before=self.request.GET.get('before')
+        )
+        context = super().get_context_data(object_list=spreadsheets, **kwargs)
+        context['next_cursor'] = next_cursor
+        context['previous_cursor'] = previous_cursor
+        return context
+
+# Content types of the supported download formats
+REPORT_CONTENT_TYPES = {
+    'zip': 'application/zip',
+    'pdf': 'application/pdf',
+}
+
+def get_report_format(request):
+    """Requested download format: one PDF per row in a ZIP, or a single multi-page PDF"""
+    return (
+        request.POST.get('format')
+        or request.GET.get('format')
+        or getattr(settings, 'REPORT_OUTPUT_FORMAT', 'zip')
+    )
+
+def get_requested_sheets(request):
+    """Sheet names from the `sheets` parameter (repeated or comma-separated), or None"""
+    params = request.POST if request.method == 'POST' else request.GET
+    names = [
+        name.strip()
+        for value in params.getlist('sheets')
+        for name in value.split(',')
+        if name.strip()
+    ]
+    return names or None
+
+def download_single_row(request, spreadsheet, sheet, selection, etag, row_cache_dir=None):
+    """Respond with the bare PDF of the one row a selection asks for"""
+    from .pipeline import iter_sheet_rows
+    from .rendering import render_row
+
+    row_number = selection.single_row
+    _, rows = next(iter_sheet_rows(spreadsheet, [sheet], selection=selection))
+    rows = list(rows)
+    if not rows:
+        messages.error(request, f"Row {row_number} not found")
+        return redirect('spreadsheet_list')
+    
+    run = start_run('download', format='row', spreadsheet_id=spreadsheet.id)
+    result = render_row(*rows[0], cache_dir=row_cache_dir)
+    run.record_result(result)
+    run.finish()
+    if result.error is not None:
+        logger.error(f"Error creating PDF for row {row_number}: {result.error}")
+        messages.error(request, f"Error creating PDF for row {row_number}")
+        return redirect('spreadsheet_list')
+    
+    response = HttpResponse(result.pdf_data, content_type='application/pdf')
+    response['Content-Disposition'] = f'attachment; filename="spreadsheet_{spreadsheet.id}_row_{row_number}.pdf"'
+    response['ETag'] = etag
+    return response
 
 @require_http_methods(["GET", "POST"])
 def download_spreadsheet_reports(request, spreadsheet_id):
-    """Download all reports for a spreadsheet as a ZIP file"""
+    """
+    Download the reports for a spreadsheet as a ZIP file (or a single PDF).
+    Every sheet is reported, in a folder per sheet, unless `sheets` names the
+    sheets to use. The `rows`, `columns` and `filter` parameters limit the
+    download to part of each sheet (see RowSelection); a single row of a
+    single sheet is returned as its bare PDF.
+
+    Responses carry an ETag derived from the spreadsheet contents, theme
+    version, selection and format, and GET requests with a matching
+    If-None-Match get a 304. Archives served from the report cache support
+    Range requests, or are sent by nginx (REPORT_CACHE_ACCEL_REDIRECT).
+    """
+    # The spreadsheet (pandas, openpyxl) and PDF (ReportLab) engines are only
+    # loaded by the views that render, so workers start and serve the list,
+    # upload, job and health endpoints without importing them
+    from .pipeline import check_selection, iter_sheet_rows, iter_workbook_entries, select_sheets
+    from .rendering import render_pool
+    from .reports import render_workbook_pdf
+    from .selection import RowSelection, SelectionError
+
     try:
         # Get the spreadsheet
         spreadsheet = Spreadsheet.objects.get(id=spreadsheet_id)
         
-        # Read the Excel file with openpyxl engine
-        df = pd.read_excel(spreadsheet.file, engine='openpyxl')
+        report_format = get_report_format(request)
+        if report_format not in REPORT_CONTENT_TYPES:
+            messages.error(request, f"Unsupported report format: {report_format}")
+            return redirect('spreadsheet_list')
+        content_type = REPORT_CONTENT_TYPES[report_format]
+        
+        # Only render the requested sheets, rows and columns, if any
+        sheets = select_sheets(spreadsheet, get_requested_sheets(request))
+        selection = RowSelection.from_request(request)
+        
+        cache = get_report_cache()
+        cache_key = sheets_cache_key(selection_cache_key(archive_cache_key(spreadsheet), selection), sheets)
+        # Row PDFs are cached by content, so unchanged rows of any earlier upload are reused
+        row_cache_dir = cache.row_dir() if cache else None
         
-        # Create a buffer for the ZIP file
-        zip_buffer = io.BytesIO()
+        single_row = selection is not None and selection.single_row is not None and len(sheets) == 1
+        etag = report_etag(cache_key, 'row' if single_row else report_format)
+        if request.method == 'GET':
+            not_modified = get_conditional_response(request, etag=etag)
+            if not_modified is not None:
+                not_modified['ETag'] = etag
+                return not_modified
         
-        # Create ZIP file
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            # Process each row
-            for index, row in df.iterrows():
-                try:
-                    # Convert row to dictionary
-                    row_data = row.to_dict()
-                    
-                    # Generate PDF
-                    pdf_data = generate_pdf_report(row_data, index + 1)
-                    
-                    # Add PDF to ZIP file
-                    zip_file.writestr(f'row_{index + 1}.pdf', pdf_data)
-                except Exception as e:
-                    logger.error(f"Error creating PDF for row {index + 1}: {str(e)}")
-                    continue
+        if single_row:
+            return download_single_row(request, spreadsheet, sheets[0], selection, etag, row_cache_dir)
         
-        # Prepare the response
-        zip_buffer.seek(0)
-        response = HttpResponse(zip_buffer, content_type='application/zip')
-        response['Content-Disposition'] = f'attachment; filename="spreadsheet_{spreadsheet_id}_reports.zip"'
+        filename = f'spreadsheet_{spreadsheet_id}_reports.{report_format}'
+        def cached_response(archive):
+            return archive_response(
+                request, archive, content_type, filename, etag,
+                accel_redirect=cache.accel_redirect_path(cache_key, report_format)
+            )
+        
+        # Serve repeat downloads straight from the cached archive
+        cached_archive = cache.open_archive(cache_key, report_format) if cache else None
+        if cached_archive is not None:
+            return cached_response(cached_archive)
+        
+        # Report a bad selection now rather than after the response has started;
+        # of several sheets, those without the selected columns are left out
+        folders = len(sheets) > 1
+        sheets, skipped_sheets = check_selection(spreadsheet, sheets, selection)
+        if skipped_sheets:
+            names = ', '.join(sheet.name for sheet in skipped_sheets)
+            logger.info(f"Skipped sheets of spreadsheet {spreadsheet.id} without the selected columns: {names}")
+            messages.warning(request, f"Skipped sheets without the selected columns: {names}")
+        
+        run = start_run('download', format=report_format, spreadsheet_id=spreadsheet.id, sheets=len(sheets))
+        
+        if report_format == 'pdf':
+            # Render every row into one multi-page PDF, bookmarked by sheet when there are several
+            bookmarks = getattr(settings, 'REPORT_PDF_BOOKMARKS', True)
+            def write_pdf(output):
+                with render_pool() as executor, run.stage('render'):
+                    sections = (
+                        (sheet.name if folders else None, rows)
+                        for sheet, rows in iter_sheet_rows(spreadsheet, sheets, run, selection, executor)
+                    )
+                    render_workbook_pdf(sections, output, bookmarks=bookmarks, on_result=run.record_result)
+                run.finish()
+            if cache:
+                return cached_response(cache.store_archive(cache_key, write_pdf, 'pdf'))
+            pdf_buffer = io.BytesIO()
+            write_pdf(pdf_buffer)
+            response = HttpResponse(pdf_buffer.getvalue(), content_type=content_type)
+            response['Content-Disposition'] = f'attachment; filename="{filename}"'
+            response['ETag'] = etag
+            return response
+        
+        # Read and render the sheets with the configured reader and render pool
+        entries = run.timed(iter_workbook_entries(
+            spreadsheet,
+            sheets,
+            run,
+            selection,
+            on_result=run.record_result,
+            row_cache_dir=row_cache_dir,
+            folders=folders
+        ), 'render')
+        
+        if getattr(settings, 'REPORT_DOWNLOAD_STREAMING', False):
+            # Stream each ZIP entry to the client as soon as its PDF is rendered
+            stream = run.track(run.timed(iter_zip_stream(entries), 'archive'))
+            if cache:
+                stream = cache.tee_archive(cache_key, stream)
+            response = StreamingHttpResponse(stream, content_type='application/zip')
+            # Ask nginx to pass the chunks through instead of buffering them
+            response['X-Accel-Buffering'] = 'no'
+        elif cache:
+            # Build the ZIP file in the cache and serve it from there
+            with run.stage('archive'):
+                archive = cache.store_archive(cache_key, lambda zip_file: write_zip(zip_file, entries))
+            run.finish()
+            return cached_response(archive)
+        else:
+            # Create the ZIP file in memory
+            zip_buffer = io.BytesIO()
+            with run.stage('archive'):
+                write_zip(zip_buffer, entries)
+            run.finish()
+            
+            # Prepare the response
+            zip_buffer.seek(0)
+            response = HttpResponse(zip_buffer, content_type='application/zip')
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response['ETag'] = etag
         return response
         
     except Spreadsheet.DoesNotExist:
         messages.error(request, "Spreadsheet not found")
         return redirect('spreadsheet_list')
+    except SelectionError as e:
+        messages.error(request, str(e))
+        return redirect('spreadsheet_list')
     except Exception as e:
         logger.error(f"Error creating ZIP file: {str(e)}")
         messages.error(request, "Error downloading reports")
         return redirect('spreadsheet_list')
 
+def report_job_payload(job):
+    """JSON-serializable progress information for a report job"""
+    progress = 100.0 if job.status == ReportJob.STATUS_COMPLETED else 0.0
+    if job.total_rows and job.status != ReportJob.STATUS_COMPLETED:
+        progress = round(100.0 * job.processed_rows / job.total_rows, 1)
+    payload = {
+        'job_id': job.id,
+        'spreadsheet_id': job.spreadsheet_id,
+        'status': job.status,
+        'total_rows': job.total_rows,
+        'processed_rows': job.processed_rows,
+        'failed_rows': job.failed_rows,
+        'progress': progress,
+        'error': job.error,
+        'created_at': job.created_at.isoformat(),
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'status_url': reverse('report_job_status', args=[job.id]),
+        'download_url': None,
+    }
+    if job.status == ReportJob.STATUS_COMPLETED:
+        payload['download_url'] = reverse('download_report_job', args=[job.id])
+    return payload
+
+@require_http_methods(["POST"])
+def enqueue_report_generation(request, spreadsheet_id):
+    """Queue background generation of all reports for a spreadsheet"""
+    try:
+        spreadsheet = Spreadsheet.objects.get(id=spreadsheet_id)
+    except Spreadsheet.DoesNotExist:
+        return JsonResponse({"error": "Spreadsheet not found"}, status=404)
+    
+    job = enqueue_report_job(spreadsheet)
+    return JsonResponse(report_job_payload(job), status=202)
+
+@require_http_methods(["GET"])
+def report_job_status(request, job_id):
+    """Return the progress of a report job as JSON"""
+    try:
+        job = ReportJob.objects.get(id=job_id)
+    except ReportJob.DoesNotExist:
+        return JsonResponse({"error": "Report job not found"}, status=404)
+    return JsonResponse(report_job_payload(job))
+
+@require_http_methods(["GET"])
+def download_report_job(request, job_id):
+    """Download the ZIP file produced by a completed report job"""
+    try:
+        job = ReportJob.objects.get(id=job_id)
+    except ReportJob.DoesNotExist:
+        return JsonResponse({"error": "Report job not found"}, status=404)
+    
+    if job.status != ReportJob.STATUS_COMPLETED or not job.artifact:
+        return JsonResponse({"error": "Report job has not completed", "status": job.status}, status=409)
+    
+    return FileResponse(
+        job.artifact.open('rb'),
+        as_attachment=True,
+        filename=f'spreadsheet_{job.spreadsheet_id}_reports.zip',
+        content_type='application/zip'
+    )
+
 def health_check(request):
     """
     Simple health check endpoint that returns 200 OK.
     """
     return JsonResponse({"status": "healthy"})
+
+def metrics(request):
+    """
+    Report pipeline metrics of all app processes in the Prometheus text format.
+    """
+    if not metrics_enabled():
+        return HttpResponse("Metrics are disabled", status=404, content_type='text/plain')
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
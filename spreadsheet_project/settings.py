@@ -129,3 +129,106 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Media files configuration
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+
+# Report rendering configuration
+# Number of processes used to render row PDFs; 1 renders in the request process
+REPORT_RENDER_WORKERS = 1
+# Number of rows sent to a render worker at a time
+REPORT_RENDER_CHUNK_SIZE = 50
+# Stream report ZIPs entry by entry instead of building them in memory first
+REPORT_DOWNLOAD_STREAMING = False
+
+# Background report jobs (run with `python manage.py run_report_worker`)
+# Seconds an idle worker waits before checking the queue again
+REPORT_JOB_POLL_INTERVAL = 2.0
+# Rows rendered between progress updates written to the job
+REPORT_JOB_PROGRESS_INTERVAL = 25
+# Running jobs without progress for this many seconds are taken to have lost
+# their worker: they are queued again, or failed after this many claims
+REPORT_JOB_STALE_AFTER = 600
+REPORT_JOB_MAX_ATTEMPTS = 3
+# Longest a running job goes without writing a heartbeat while it reads sheets
+# and renders (a single sheet parsed in-process can take longer)
+REPORT_JOB_HEARTBEAT_INTERVAL = 30
+
+# Report archive cache (under MEDIA_ROOT), keyed by spreadsheet contents and theme version
+REPORT_CACHE_ENABLED = True
+REPORT_CACHE_DIR = 'report_cache'
+# Least recently used archives and row PDFs are evicted above this size
+REPORT_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+# Stores keep a running total of the cache size; the cache directory is also
+# walked (picking up other processes' stores) at most this many seconds apart
+REPORT_CACHE_SWEEP_INTERVAL = 300
+# URL prefix of an nginx `internal` location aliased to the cache directory;
+# when set, cached archives are sent by nginx through X-Accel-Redirect
+# instead of by the app (which serves them with Range support)
+REPORT_CACHE_ACCEL_REDIRECT = None
+
+# How download rows are read: 'dataframe' parses the whole sheet with pandas
+# (reusing the upload snapshot), 'streaming' reads the xlsx lazily with openpyxl
+SPREADSHEET_ROW_READER = 'dataframe'
+# Rows converted at a time by the streaming reader
+SPREADSHEET_READER_BLOCK_SIZE = 1000
+# Rows formatted at a time by the column-wise row preparation stage
+REPORT_PREPARE_BLOCK_SIZE = 1000
+# Default download format: 'zip' (one PDF per row) or 'pdf' (one multi-page PDF)
+REPORT_OUTPUT_FORMAT = 'zip'
+# Add an outline entry per row to multi-page PDFs
+REPORT_PDF_BOOKMARKS = True
+
+# Compression of report ZIP entries: 'stored', 'deflate' or 'adaptive'
+# (deflate a sample of entries and store the rest if deflating saved too little)
+REPORT_ZIP_COMPRESSION = 'deflate'
+# zlib level (0-9) for deflated entries; None uses the zlib default
+REPORT_ZIP_COMPRESSLEVEL = None
+# Entries deflated by the adaptive mode before it decides
+REPORT_ZIP_ADAPTIVE_SAMPLE = 10
+# Minimum fraction of bytes the sample must save to keep deflating
+REPORT_ZIP_ADAPTIVE_MIN_SAVING = 0.05
+
+# Report pipeline metrics, served in the Prometheus text format at /metrics/
+REPORT_METRICS_ENABLED = True
+# Every app process mirrors its metrics here so /metrics/ can merge them
+REPORT_METRICS_DIR = BASE_DIR / 'metrics'
+
+# Emit one structured "report_pipeline {...}" log line per report run
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'spreadsheet_processor.metrics': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+    },
+}
+
+# Sheets of a workbook to report on when a download does not name any:
+# 'all' (a ZIP folder per sheet when there are several) or 'first'
+REPORT_SHEETS = 'all'
+
+# Uploads are kept in memory up to FILE_UPLOAD_MAX_MEMORY_SIZE and in
+# FILE_UPLOAD_TEMP_DIR (the system temporary directory by default) beyond it.
+# The upload view puts SpreadsheetUploadHandler in front of these handlers to
+# write spreadsheets straight to storage
+FILE_UPLOAD_HANDLERS = [
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2621440  # 2.5 MB
+
+# Largest spreadsheet upload accepted, in bytes; larger uploads are dropped
+# as soon as they pass it. Keep nginx's client_max_body_size in line
+SPREADSHEET_UPLOAD_MAX_BYTES = 100 * 1024 * 1024
+
+# Spreadsheets shown per page of the upload list
+SPREADSHEET_LIST_PAGE_SIZE = 25
+
+# Markdown documents whose HTML is kept in the in-process LRU cache of the
+# markdown template filter and batch report previews; 0 disables the cache
+MARKDOWN_CACHE_SIZE = 1024